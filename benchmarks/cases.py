@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+import tty
+import yaml
+from device.gamepad_mp import GamePadMp
+from device.odrive_mp import OdriveMp
+from device.serial_mp import SerilaMp, Action_t
+from device.state_bus import StateBus
+from inputs.inputs import DeviceManager
+from main import build_control
+from tools.gamepad_sim import EVENT, GamePadSim, SimGamePad, drain
+from tools.odrive_sim import OdriveSim
+
+# every case returns [(metric, value, unit, better)], better is 'higher' or 'lower'
+
+
+def _count_fs_calls(event, args):
+    if _fs_calls[1] and event in ('open', 'glob.glob', 'os.listdir', 'os.scandir'):
+        _fs_calls[0] += 1
+
+
+# an audit hook stays for the life of the process, it only counts while a case turns it on
+_fs_calls = [0, False]
+if hasattr(sys, 'addaudithook'):
+    sys.addaudithook(_count_fs_calls)
+
+
+def _logger():
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+class NullSerial():
+    # a port that takes every write, the encoding is measured without the tty
+    def write(self, data):
+        return len(data)
+
+
+def evdev_decode(scale):
+    # InputDevice._do_iter on whole frames: the read size of the process mode, then the batch of the event loop mode,
+    # then the same batch as array columns without an event object each
+    results = []
+    data = GamePadSim().encode(int(20000 * scale))
+    count = len(data) // EVENT.size
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        gamepad = SimGamePad(DeviceManager(kinds=()), char_path_override=f.name)
+        for name, read_size, read in (('evdev_decode', 1, gamepad._do_iter),
+                                      ('evdev_decode_batch', 64, gamepad._do_iter),
+                                      ('evdev_decode_columns', 64, lambda: getattr(gamepad.read_columns(), 'value', None))):
+            gamepad.read_size = read_size
+            gamepad._character_device.seek(0)
+            n = 0
+            time_start = time.perf_counter()
+            while True:
+                events = read()
+                if not events:
+                    break
+                n += len(events)
+            elapsed = time.perf_counter() - time_start
+            assert n == count
+            results.append((name, count / elapsed, 'events/s', 'higher'))
+        gamepad._character_device.close()
+    return results
+
+
+def gamepad_process(scale):
+    # a FIFO stands in for the event device, the worker reads, decodes and writes the state bus
+    sim = GamePadSim()
+    data = sim.encode(int(20000 * scale))
+    count = len(data) // EVENT.size
+    # the worker skips SYN_REPORT, the other events reach the bus
+    count_input = sum(1 for event in EVENT.iter_unpack(data) if event[2] != 0)
+    bus = StateBus()
+    try:
+        devices = DeviceManager(kinds=())
+        sim.plug(devices)
+        worker = GamePadMp(_logger(), bus, devices=devices)
+        fd = os.open(sim.path, os.O_WRONLY)
+        time_start = time.perf_counter()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        while bus.input.read().gp_trace < count_input:
+            drain(worker, time.time() + 0.0002)
+        elapsed = time.perf_counter() - time_start
+        worker.is_run.value = False
+        os.write(fd, data[:EVENT.size])
+        os.close(fd)
+        while worker._p.is_alive():
+            drain(worker, time.time() + 0.1)
+    finally:
+        sim.close()
+    return [('gamepad_process', count / elapsed, 'events/s', 'higher')]
+
+
+def nucleo_parse(scale):
+    # SerilaMp._receive on telemetry lines that change every time, so every line also wakes the main loop
+    count = int(50000 * scale)
+    lines = ['#,5,{:.3f},{:.3f},0,{},512,0,0,0,0,0\n'.format(n * 0.01, n * 0.01, n).encode() for n in range(0, count)]
+    with _nucleo() as nucleo:
+        time_start = time.perf_counter()
+        for line in lines:
+            nucleo._receive(line)
+        elapsed = time.perf_counter() - time_start
+    return [('nucleo_parse', count / elapsed, 'lines/s', 'higher')]
+
+
+def nucleo_encode(scale):
+    count = int(50000 * scale)
+    velocity = Action_t.ACTION_VELOCITY_CTRL.value
+    with _nucleo() as nucleo:
+        ser = nucleo._ser
+        nucleo._ser = NullSerial()
+        time_start = time.perf_counter()
+        for n in range(0, count):
+            nucleo._command(velocity, (n % 720) * 0.5)
+        elapsed = time.perf_counter() - time_start
+        nucleo._ser = ser
+    return [('nucleo_encode', count / elapsed, 'commands/s', 'higher')]
+
+
+def odrive_encode(scale):
+    # OdriveMp._velocity_step against the simulator, targets far enough apart that both axes get a setpoint every tick
+    results = []
+    count = int(20000 * scale)
+    sim = OdriveSim()
+    sim.start()
+    loop = asyncio.new_event_loop()
+    try:
+        for protocol in ('ascii', 'native'):
+            bus = StateBus()
+            odrive = OdriveMp(_logger(), bus, port=sim.port, loop=loop, protocol=protocol, feedback_depth=6,
+                              endpoint_cache=os.path.join(tempfile.gettempdir(), 'odrive_endpoints_bench.json'))
+            ser = odrive._pipeline._ser
+            odrive._pipeline._ser = NullSerial()
+            command = bus.command.read()
+            time_start = time.perf_counter()
+            for n in range(0, count):
+                command.odrive_target_angle_0 = command.odrive_target_angle_1 = (n % 2) * 720.0
+                odrive._velocity_step(command, 0.01)
+            elapsed = time.perf_counter() - time_start
+            odrive._pipeline._ser = ser
+            odrive.close()
+            results.append(('odrive_{}_encode'.format(protocol), count * 2 / elapsed, 'commands/s', 'higher'))
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+        sim.close()
+    return results
+
+
+def main_cycle(scale):
+    # the control step of main.py, the gamepad moves the steering and a pedal every cycle
+    count = int(20000 * scale)
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yml')) as f:
+        cfg = yaml.safe_load(f)
+    bus = StateBus()
+    events = queue.Queue()
+    control = build_control(cfg, bus, events)
+    durations = []
+    for n in range(0, count):
+        code = 0x03 if n % 2 else 0x05
+        bus.input.write(gp_type=3, gp_code=code, gp_value=n % 256, gp_trace=n, gp_time=n * 0.001)
+        if n % 100 == 0:
+            events.put(('press', 0x13b, n * 0.001, 0.0))
+        time_start = time.perf_counter()
+        control()
+        durations.append(time.perf_counter() - time_start)
+    durations.sort()
+    return [('main_cycle_mean', sum(durations) / count * 1e6, 'us', 'lower'),
+            ('main_cycle_p99', durations[int(count * 0.99)] * 1e6, 'us', 'lower')]
+
+
+def discovery(scale):
+    # DeviceManager startup, everything against the gamepads only, with the file system calls it makes
+    results = []
+    count = max(1, int(200 * scale))
+    for name, kinds in (('discovery_full', None), ('discovery_gamepad', ['gamepad'])):
+        time_start = time.perf_counter()
+        for _ in range(0, count):
+            DeviceManager(kinds=kinds)
+        results.append((name, (time.perf_counter() - time_start) / count * 1e6, 'us', 'lower'))
+        if hasattr(sys, 'addaudithook'):
+            _fs_calls[0] = 0
+            _fs_calls[1] = True
+            DeviceManager(kinds=kinds)
+            _fs_calls[1] = False
+            results.append((name + '_fs_calls', _fs_calls[0], 'calls', 'lower'))
+    return results
+
+
+def _import_time(module):
+    # the cumulative import time of a module in a fresh interpreter, from -X importtime on stderr
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stderr.decode()
+    for line in out.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise ValueError('no import time for ' + module)
+
+
+def import_time(scale):
+    # what a worker process pays before it reads the first event, the best of the runs
+    count = max(1, int(5 * scale))
+    return [('import_{}_us'.format(module.rsplit('.', 1)[1]), min(_import_time(module) for _ in range(0, count)),
+             'us', 'lower') for module in ('inputs.inputs', 'device.gamepad_mp')]
+
+
+class _nucleo():
+    # SerilaMp on a pty that is never read, built for the event loop so no worker is started
+    def __enter__(self):
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self._slave = slave
+        self._loop = asyncio.new_event_loop()
+        self.nucleo = SerilaMp(_logger(), StateBus(), port=os.ttyname(slave), timeout=0.01, loop=self._loop)
+        return self.nucleo
+
+    def __exit__(self, *args):
+        self.nucleo.close()
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+CASES = {
+    'evdev_decode': evdev_decode,
+    'gamepad_process': gamepad_process,
+    'nucleo_parse': nucleo_parse,
+    'nucleo_encode': nucleo_encode,
+    'odrive_encode': odrive_encode,
+    'main_cycle': main_cycle,
+    'discovery': discovery,
+    'import_time': import_time,
+}
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from benchmarks.cases import CASES
+
+
+def environment():
+    # what a result depends on besides the code, compare runs from the same host only
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith(('model name', 'Model')):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except IOError:
+        pass
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu': cpu,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(names, repeat, scale):
+    # the median of the repeats, one slow run from a busy host does not move it
+    results = {}
+    for name in names:
+        samples = {}
+        for _ in range(0, repeat):
+            for metric, value, unit, better in CASES[name](scale):
+                samples.setdefault(metric, (unit, better, []))[2].append(value)
+        for metric, (unit, better, values) in samples.items():
+            results[metric] = {'value': statistics.median(values), 'unit': unit, 'better': better,
+                               'min': min(values), 'max': max(values)}
+            print('{:24s} {:14.1f} {}'.format(metric, results[metric]['value'], unit))
+    return results
+
+
+def compare(results, baseline, threshold):
+    # relative change against the baseline, positive is an improvement
+    regressions = []
+    print('{:24s} {:>14s} {:>14s} {:>8s}'.format('metric', 'baseline', 'current', 'change'))
+    for metric, result in results.items():
+        if metric not in baseline:
+            continue
+        base = baseline[metric]['value']
+        change = (result['value'] - base) / base if base else 0.0
+        if result['better'] == 'lower':
+            change = -change
+        flag = ''
+        if change < -threshold:
+            flag = 'REGRESSION'
+            regressions.append(metric)
+        print('{:24s} {:14.1f} {:14.1f} {:+7.1f}% {}'.format(metric, base, result['value'], change * 100.0, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the control stack on simulated devices')
+    parser.add_argument('--case', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the median is reported')
+    parser.add_argument('--scale', type=float, default=1.0, help='work per run, relative to the default')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='a results JSON to compare against, the exit status is 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change that counts as a regression')
+    args = parser.parse_args()
+
+    results = run(args.case, args.repeat, args.scale)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['environment'].get('cpu') != environment()['cpu']:
+            print('baseline is from another CPU: {}'.format(baseline['environment'].get('cpu')))
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
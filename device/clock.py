@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+import time
+from multiprocessing import Value
+
+# every loop takes its time from a clock object:
+#   time()        timestamps that go on the state bus, comparable with the kernel's input event time
+#   monotonic()   loop deadlines
+#   sleep(s), sleep_until(deadline)   deadline on monotonic()
+#   to_real(s)    the real timeout that covers s of clock time, for select() and Event.wait()
+
+
+class RealClock():
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def sleep_until(self, deadline):
+        time_sleep = deadline - time.monotonic()
+        if time_sleep > 0:
+            time.sleep(time_sleep)
+
+    def to_real(self, seconds):
+        return seconds
+
+
+class AcceleratedClock():
+    # real time running factor times faster from the moment it is created, forked workers share it
+    def __init__(self, factor=1.0):
+        self.factor = factor
+        self._mono_start = time.monotonic()
+        self._wall_start = time.time()
+
+    def time(self):
+        return self._wall_start + self.monotonic() - self._mono_start
+
+    def monotonic(self):
+        return self._mono_start + (time.monotonic() - self._mono_start) * self.factor
+
+    def sleep(self, seconds):
+        time.sleep(max(0.0, seconds) / self.factor)
+
+    def sleep_until(self, deadline):
+        self.sleep(deadline - self.monotonic())
+
+    def to_real(self, seconds):
+        return seconds / self.factor
+
+
+class SteppedClock():
+    # only moves when it is stepped, sleepers in any process wait for the step that reaches their deadline
+    def __init__(self, start=0.0, poll=0.001):
+        self._now = Value(ctypes.c_double, start, lock=False)
+        self._poll = poll
+
+    def time(self):
+        return self._now.value
+
+    def monotonic(self):
+        return self._now.value
+
+    def sleep(self, seconds):
+        self.sleep_until(self._now.value + seconds)
+
+    def sleep_until(self, deadline):
+        while self._now.value < deadline:
+            time.sleep(self._poll)
+
+    def to_real(self, seconds):
+        # nobody knows when the next step comes, look again soon
+        return min(seconds, self._poll)
+
+    def step(self, seconds):
+        self._now.value += max(0.0, seconds)
+
+    def advance_to(self, time_next):
+        self._now.value = max(self._now.value, time_next)
+
+
+def make_clock(name='real', factor=1.0):
+    # a stepped clock needs a driver, the replay and tests create it themselves
+    if name == 'accelerated':
+        return AcceleratedClock(factor)
+    return RealClock()
+
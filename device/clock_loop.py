@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+# apart from device.clock, so the workers that only need a clock do not import asyncio
+
+
+class ClockEventLoop(asyncio.SelectorEventLoop):
+    # timers run on the clock, so asyncio.sleep and wait_for follow an accelerated or stepped clock as well
+    def __init__(self, clock):
+        super().__init__()
+        self._clock = clock
+        select = self._selector.select
+
+        def select_real(timeout=None):
+            return select(timeout if timeout is None else clock.to_real(timeout))
+        self._selector.select = select_real
+
+    def time(self):
+        return self._clock.monotonic()
+
+    def next_timer(self):
+        return self._scheduled[0].when() if self._scheduled else None
+
+    async def settle(self):
+        # let every callback and every fd that became readable run before the clock moves on
+        idle = 0
+        while idle < 2:
+            await asyncio.sleep(0)
+            idle = idle + 1 if not self._ready else 0
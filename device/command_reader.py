@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from device.clock import RealClock
+from device.metrics import metric_of
+from device.state_bus import state_requests
+
+
+class CommandReader():
+    # a worker's side of the command block for one device, 'nucleo' or 'odrive', idle_mode is its ACTION_IDLE
+    def __init__(self, bus, device, idle_mode, feed_ok=None, clock=None, trace=None, metrics=None):
+        self._bus = bus
+        self._device = device
+        self._idle_mode = idle_mode
+        self._seq_name = device + '_seq'
+        self._mode_name = device + '_mode'
+        self._feed_ok = feed_ok
+        self._clock = clock or RealClock()
+        self._trace = trace
+        self._m_commands = metric_of(metrics, 'commands_total', 'device="{}"'.format(device))
+        self._m_coalesced = metric_of(metrics, 'commands_coalesced_total', 'device="{}"'.format(device))
+
+        # z1, command is the newest one that carried a request
+        self.command = bus.command.read()
+        self._seq_z1 = getattr(self.command, self._seq_name)
+        self._state_seq_z1 = self.command.state_seq
+        self._feed_ok_z1 = True
+        self._trace_id_z1 = 0
+
+    def read(self):
+        # IDLE when the watchdog stops feeding, then every new state request and the newest setpoint of the main loop
+        request_modes = []
+        feed_ok = self._feed_ok is None or self._feed_ok.value
+        if self._feed_ok_z1 and not feed_ok:
+            request_modes.append(self._idle_mode)
+        self._feed_ok_z1 = feed_ok
+        command = self._bus.command.read()
+        if command.state_seq != self._state_seq_z1:
+            request_modes += state_requests(command, self._state_seq_z1)
+            self._m_commands.inc((command.state_seq - self._state_seq_z1) & 0xffffffff)
+            self._state_seq_z1 = command.state_seq
+            self.command = command
+        seq = getattr(command, self._seq_name)
+        if seq != self._seq_z1:
+            request_modes.append(getattr(command, self._mode_name))
+            self._m_commands.inc()
+            self._m_coalesced.inc((seq - self._seq_z1 - 1) & 0xffffffff)
+            self._seq_z1 = seq
+            self.command = command
+        return request_modes, command
+
+    def trace_write(self, command):
+        # the first write that carries an input event ends its trace
+        if self._trace is None or command.trace_id == self._trace_id_z1:
+            return
+        self._trace_id_z1 = command.trace_id
+        time_now = self._clock.time()
+        self._trace.record(self._device, time_now - command.trace_main_time)
+        self._trace.record(self._device + '_total', time_now - command.trace_time)
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import struct
+from device.clock import RealClock
+from device.mapped_file import create_mapped
+
+# file: header, one count per section, then one ring of fixed-size records per section
+# a record is written before its section count moves on, so a killed writer leaves at most
+# one half written record behind the count, which the reader never looks at
+MAGIC = b'FREC'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIIdd')
+SECTION_HEADER = struct.Struct('<Q16s')
+RECORD_VALUES = 16
+RECORD = struct.Struct('<dHHI{}d'.format(RECORD_VALUES))
+PAGE_SIZE = 4096
+
+
+class RecorderSection():
+    def __init__(self, mm, section_id, header_offset, ring_offset, capacity, clock):
+        self._mm = mm
+        self._clock = clock
+        self._id = section_id
+        self._header = header_offset
+        self._ring = ring_offset
+        self._capacity = capacity
+        self._count = 0
+        self._pad = (0.0,) * RECORD_VALUES
+
+    def append(self, values):
+        count = self._count
+        RECORD.pack_into(self._mm, self._ring + (count % self._capacity) * RECORD.size,
+                         self._clock.monotonic(), self._id, len(values), count & 0xffffffff,
+                         *(tuple(values) + self._pad[len(values):]))
+        self._count = count + 1
+        struct.pack_into('<Q', self._mm, self._header, self._count)
+
+
+class FlightRecorder():
+    # a preallocated, memory-mapped ring file
+    def __init__(self, path, section_names, capacity=65536, clock=None):
+        clock = clock or RealClock()
+        self.path = path
+        ring_offset = PAGE_SIZE
+        size = ring_offset + len(section_names) * capacity * RECORD.size
+        self._mm = create_mapped(path, size, preallocate=True)
+
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, capacity, len(section_names),
+                         clock.time(), clock.monotonic())
+        self.sections = {}
+        for i, name in enumerate(section_names):
+            header_offset = HEADER.size + i * SECTION_HEADER.size
+            SECTION_HEADER.pack_into(self._mm, header_offset, 0, name.encode())
+            self.sections[name] = RecorderSection(
+                self._mm, i, header_offset, ring_offset + i * capacity * RECORD.size, capacity, clock)
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+
+
+def load(path):
+    # every record still in the rings, oldest first: (time_mono, section name, values)
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, capacity, section_num, time_wall, time_mono = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError('{} is not a flight recorder file'.format(path))
+
+    records = []
+    for i in range(0, section_num):
+        count, name = SECTION_HEADER.unpack_from(data, HEADER.size + i * SECTION_HEADER.size)
+        name = name.rstrip(b'\0').decode()
+        ring_offset = PAGE_SIZE + i * capacity * RECORD.size
+        for n in range(max(0, count - capacity), count):
+            record = RECORD.unpack_from(data, ring_offset + (n % capacity) * RECORD.size)
+            if record[3] != n & 0xffffffff:
+                continue
+            records.append((record[0], name, record[4:4 + record[2]]))
+    records.sort(key=lambda record: record[0])
+    return {'time_wall': time_wall, 'time_mono': time_mono, 'capacity': capacity}, records
@@ -2,64 +2,259 @@
 # -*- coding: utf-8 -*-
 
 import ctypes
-from inputs.inputs import DeviceManager
-from multiprocessing import Process, Value
+import os
+import queue
+import threading
+from device.clock import RealClock
+from device.metrics import metric_of
+from device.notifier import Notifier
+from device.timeline import track_of
+from inputs.inputs import DeviceManager, EVENT_SIZE, iter_unpack
+from multiprocessing import Pipe, Process, Value
+
+
+class ButtonState():
+    # buttons as bits of one integer, events are stamped with the kernel time of the input event
+    def __init__(self, chords=None, long_press=1.0):
+        self.mask = 0
+        self._bits = {}
+        self._press_time = {}
+        self._long_press = long_press
+        self._long_press_deadline = {}
+        self._chords = {}
+        for name, codes in (chords or {}).items():
+            chord_mask = 0
+            for code in codes:
+                chord_mask |= self._bit(code)
+            self._chords[name] = chord_mask
+
+    def _bit(self, code):
+        if code not in self._bits:
+            self._bits[code] = 1 << len(self._bits)
+        return self._bits[code]
+
+    def update(self, code, value, timestamp):
+        events = self.expire(timestamp)
+        bit = self._bit(code)
+        if value:
+            # value 2 is autorepeat
+            if self.mask & bit:
+                return events
+            mask_z1 = self.mask
+            self.mask |= bit
+            self._press_time[code] = timestamp
+            if self._long_press > 0:
+                self._long_press_deadline[code] = timestamp + self._long_press
+            events.append(('press', code, timestamp, 0.0))
+            for name, chord_mask in self._chords.items():
+                if self.mask & chord_mask == chord_mask and mask_z1 & chord_mask != chord_mask:
+                    events.append(('chord', name, timestamp, 0.0))
+        else:
+            if not self.mask & bit:
+                return events
+            self.mask &= ~bit
+            self._long_press_deadline.pop(code, None)
+            events.append(('release', code, timestamp, timestamp - self._press_time.pop(code)))
+        return events
+
+    def release_all(self, timestamp):
+        # after dropped input events the buttons held are unknown, every one is released
+        events = [('release', code, timestamp, timestamp - press_time)
+                  for code, press_time in sorted(self._press_time.items(), key=lambda item: item[1])]
+        self.mask = 0
+        self._press_time.clear()
+        self._long_press_deadline.clear()
+        return events
+
+    def expire(self, time_now):
+        events = []
+        for code, deadline in sorted(self._long_press_deadline.items(), key=lambda item: item[1]):
+            if deadline > time_now:
+                break
+            del self._long_press_deadline[code]
+            events.append(('long_press', code, deadline, self._long_press))
+        return events
+
+    def next_deadline(self):
+        return min(self._long_press_deadline.values()) if self._long_press_deadline else None
+
+
+class EventPipe():
+    # button events out of the gamepad process, sent before the notify so the woken reader finds them,
+    # a multiprocessing.Queue sends from a feeder thread and the event may arrive a main loop period later.
+    # Every put happens under the button lock, the main loop drains it every cycle.
+    def __init__(self):
+        self._r, self._w = Pipe(duplex=False)
+
+    def put(self, event):
+        self._w.send(event)
+
+    def get(self, timeout=None):
+        if not self._r.poll(timeout):
+            raise queue.Empty
+        return self._r.recv()
+
+    def get_nowait(self):
+        return self.get(0)
 
 
 class GamePadMp():
-    def __init__(self, logger):
+    def __init__(self, logger, bus, chords=None, long_press=1.0, loop=None, clock=None, trace=None, timeline=None,
+                 metrics=None, devices=None):
         self._logger = logger
+        self._clock = clock or RealClock()
+        self._trace = trace
+        self._track = track_of(timeline, 'gamepad')
+        self._m_events = metric_of(metrics, 'gamepad_events_total')
+        self._trace_id = 0
         self.is_run = Value(ctypes.c_bool, False)
+        self._loop = loop
+        self._fd = None
 
         # communication variables
-        self.gp_code = Value(ctypes.c_int, 0)
-        self.gp_value = Value(ctypes.c_int, 0)
+        self._bus = bus
+        self.events = EventPipe() if loop is None else queue.Queue()
+        self.notifier = Notifier()
 
         # try to connect gamepad
         try:
-            devices = DeviceManager()
-            self.gp_dict_code = devices.codes['Absolute']
-            self.gp_dict_code.update(devices.codes['Key'])
+            devices = devices or DeviceManager(kinds={'gamepad'})
+            # event name -> evdev code, Absolute and Key codes overlap so they are merged by name
+            self.gp_dict_code = {v: k for k, v in devices.codes['Absolute'].items()}
+            self.gp_dict_code.update({v: k for k, v in devices.codes['Key'].items()})
+            self.gp_dict_type = devices.codes['type_codes']
             self._gamepad = devices.gamepads[0]
         except:
             self._logger.error("No gamepad found.")
             return
 
-        # start process
+        # button state, SYN_DROPPED until the next SYN_REPORT
+        self._button_state = ButtonState(chords, long_press)
+        self._dropped = False
+        self._button_lock = threading.Lock()
+        self._button_timer = threading.Event()
+
+        # start process, or run on the caller's event loop
         self.is_run.value = True
-        self._p = Process(target=self._process, args=())
-        self._p.start()
+        if loop is None:
+            self._p = Process(target=self._process, args=(), name='gamepad')
+            self._p.start()
+        else:
+            self._expire_handle = None
+            self._fd = self._gamepad._character_device.fileno()
+            os.set_blocking(self._fd, False)
+            loop.add_reader(self._fd, self._on_readable)
         return
 
     def close(self):
         self.is_run.value = False
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+            if self._expire_handle is not None:
+                self._expire_handle.cancel()
 
-    def is_up(self, data, data_z1, key):
-        if data_z1['gp_code'] != key \
-                and data['gp_code'] == key and data['gp_value'] == 1:
-            return True
-        elif data_z1['gp_code'] == key and data_z1['gp_value'] == 0 \
-                and data['gp_code'] == key and data['gp_value'] == 1:
-            return True
-        else:
-            return False
+    def _publish(self, events):
+        if events:
+            for event in events:
+                self.events.put(event)
+            self.notifier.notify()
 
-    def get_keys_from_value(self, d, val):
-        return [k for k, v in d.items() if v == val]
+    def _long_press_process(self):
+        # no input event arrives while a button is only held, so the long press needs its own timer
+        while self.is_run.value:
+            with self._button_lock:
+                deadline = self._button_state.next_deadline()
+            timeout = 0.1 if deadline is None else max(0.0, deadline - self._clock.time())
+            self._button_timer.wait(self._clock.to_real(timeout))
+            self._button_timer.clear()
+            with self._button_lock:
+                self._publish(self._button_state.expire(self._clock.time()))
+
+    def _handle(self, events):
+        for event in events:
+            if event.ev_type == 'Sync':
+                if event.code == 'SYN_DROPPED':
+                    self._dropped = True
+                elif event.code == 'SYN_REPORT' and self._dropped:
+                    self._dropped = False
+                    self._resync(event.timestamp)
+                continue
+            if self._dropped:
+                # the kernel buffer overran, the rest of this report is incomplete
+                continue
+            try:
+                code = self.gp_dict_code[event.code]
+                self._trace_id += 1
+                self._m_events.inc()
+                with self._button_lock:
+                    if event.ev_type == 'Key':
+                        button_events = self._button_state.update(code, event.state, event.timestamp)
+                    else:
+                        button_events = None
+                    time_bus = self._clock.time()
+                    self._bus.input.write(
+                        gp_type=self.gp_dict_type[event.ev_type], gp_code=code, gp_value=event.state,
+                        button_mask=self._button_state.mask, gp_time=event.timestamp,
+                        gp_trace=self._trace_id, gp_bus_time=time_bus)
+                    self._publish(button_events)
+                if self._trace is not None:
+                    self._trace.record('input', time_bus - event.timestamp)
+                if button_events is not None:
+                    self._button_timer.set()
+                self.notifier.notify()
+            except:
+                self._logger.error('Could not find {}'.format(event.code))
+
+    def _resync(self, timestamp):
+        # a release may be among the dropped events, a held bit would then ignore the next press
+        with self._button_lock:
+            button_events = self._button_state.release_all(timestamp)
+            self._bus.input.write(button_mask=self._button_state.mask)
+            self._publish(button_events)
+        self._button_timer.set()
+        self.notifier.notify()
+        self._logger.error('Gamepad events dropped, buttons released')
 
     def _process(self):
+        th = threading.Thread(target=self._long_press_process, daemon=True)
+        th.start()
+        self._track.attach()
         try:
             while self.is_run.value:
+                time_begin = self._track.begin()
                 events = self._gamepad.read()
-                for event in events:
-                    if event.ev_type == 'Sync':
-                        continue
-                    try:
-                        key = self.get_keys_from_value(self.gp_dict_code, event.code)[0]
-                        self.gp_code.value = int(key)
-                        self.gp_value.value = event.state
-                    except:
-                        self._logger.error('Could not find {}'.format(event.code))
+                time_begin = self._track.end('read', time_begin)
+                self._handle(events)
+                self._track.end('handle', time_begin)
         except:
             self._logger.error('Close GamePad Process')
             self.is_run.value = False
+
+    def _on_readable(self):
+        # event loop mode: the kernel hands out whole input_event records, read all that are waiting
+        try:
+            data = os.read(self._fd, EVENT_SIZE * 64)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._logger.error('Close GamePad Process')
+            self.close()
+            return
+        self._handle([self._gamepad._make_event(*event) for event in iter_unpack(data)])
+        self._schedule_expire()
+
+    def _schedule_expire(self):
+        # the long press timer as a loop callback instead of a thread
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+        deadline = self._button_state.next_deadline()
+        if deadline is not None:
+            self._expire_handle = self._loop.call_later(max(0.0, deadline - self._clock.time()), self._expire, deadline)
+
+    def _expire(self, deadline):
+        # the loop runs a timer up to one clock resolution early, the deadline is due anyway
+        self._expire_handle = None
+        self._publish(self._button_state.expire(max(deadline, self._clock.time())))
+        self._schedule_expire()
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import struct
+from device.mapped_file import create_mapped
+
+# hops of an input event on its way to the serial ports:
+#   input         kernel event time -> gamepad process wrote it to the state bus
+#   main          state bus -> main loop published the command block that carries it
+#   nucleo/odrive command block -> the worker wrote the command to its port
+#   *_total       kernel event time -> serial write
+STAGES = ('input', 'main', 'nucleo', 'odrive', 'nucleo_total', 'odrive_total')
+
+# log-linear buckets in microseconds, 16 per power of two, like HdrHistogram with ~6 % precision
+SUB_BUCKETS = 16
+BUCKETS = 36 * SUB_BUCKETS
+MAGIC = b'LHST'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+STAGE_NAME = struct.Struct('16s')
+# count, sum, max, then the buckets, all int64
+STAGE_SLOTS = 3 + BUCKETS
+
+
+def bucket_index(us):
+    if us < 2 * SUB_BUCKETS:
+        return max(0, us)
+    shift = us.bit_length() - 5
+    return min(BUCKETS - 1, (shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS)
+
+
+def bucket_value(index):
+    # upper end of the bucket, a percentile is never reported lower than it was
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index - shift * SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyTrace():
+    # histograms in a memory-mapped file, so tools.latency_dump can read them while the stack runs
+    def __init__(self, path):
+        self.path = path
+        self._offset = HEADER.size + len(STAGES) * STAGE_NAME.size
+        self._offset += -self._offset % 8
+        size = self._offset + len(STAGES) * STAGE_SLOTS * 8
+        self._mm = create_mapped(path, size)
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, len(STAGES), BUCKETS)
+        for i, name in enumerate(STAGES):
+            STAGE_NAME.pack_into(self._mm, HEADER.size + i * STAGE_NAME.size, name.encode())
+        self._slots = memoryview(self._mm)[self._offset:].cast('q')
+        self._stage_base = {name: i * STAGE_SLOTS for i, name in enumerate(STAGES)}
+
+    def record(self, stage, seconds):
+        # plain increments
+        us = int(seconds * 1e6)
+        base = self._stage_base[stage]
+        slots = self._slots
+        slots[base] += 1
+        slots[base + 1] += us
+        if us > slots[base + 2]:
+            slots[base + 2] = us
+        slots[base + 3 + bucket_index(us)] += 1
+
+    def close(self):
+        self._slots.release()
+        self._mm.close()
+
+
+def load(path):
+    # {stage: (count, sum_us, max_us, buckets)}
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, stage_num, bucket_num = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or bucket_num != BUCKETS:
+        raise ValueError('{} is not a latency trace file'.format(path))
+    offset = HEADER.size + stage_num * STAGE_NAME.size
+    offset += -offset % 8
+    stages = {}
+    for i in range(0, stage_num):
+        name = STAGE_NAME.unpack_from(data, HEADER.size + i * STAGE_NAME.size)[0].rstrip(b'\0').decode()
+        slots = struct.unpack_from('<{}q'.format(STAGE_SLOTS), data, offset + i * STAGE_SLOTS * 8)
+        stages[name] = (slots[0], slots[1], slots[2], slots[3:])
+    return stages
+
+
+def percentile(buckets, count, p):
+    rank = max(1, int(count * p / 100.0 + 0.5))
+    total = 0
+    for index, n in enumerate(buckets):
+        total += n
+        if total >= rank:
+            return bucket_value(index)
+    return 0
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+import fcntl
+import logging
+import os
+import pickle
+import select
+import struct
+import threading
+from multiprocessing import Value
+
+F_SETPIPE_SZ = 1031
+# a pipe write up to PIPE_BUF is atomic, so records from several processes never interleave
+RECORD_MAX = select.PIPE_BUF - 2
+RECORD_FIELDS = ('created', 'levelno', 'levelname', 'name', 'module', 'funcName', 'lineno', 'process')
+
+
+class PipeQueueHandler(logging.Handler):
+    # never blocks the caller, a full pipe drops the record and counts it
+    def __init__(self, fd, dropped):
+        super().__init__()
+        self._fd = fd
+        self._dropped = dropped
+
+    def emit(self, record):
+        try:
+            data = pickle.dumps(tuple(getattr(record, name) for name in RECORD_FIELDS) + (record.getMessage(),))
+            if len(data) > RECORD_MAX:
+                data = pickle.dumps(tuple(getattr(record, name) for name in RECORD_FIELDS)
+                                    + (record.getMessage()[0:RECORD_MAX // 2] + ' ...',))
+            os.write(self._fd, struct.pack('<H', len(data)) + data)
+        except BlockingIOError:
+            with self._dropped.get_lock():
+                self._dropped.value += 1
+        except Exception:
+            self.handleError(record)
+
+
+class LogListener():
+    # one thread in the main process formats and writes for every process, one flush per batch
+    def __init__(self, handlers, queue_size=65536):
+        self._handlers = handlers
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._w, False)
+        try:
+            fcntl.fcntl(self._w, F_SETPIPE_SZ, queue_size)
+        except OSError:
+            pass
+        self.dropped = Value(ctypes.c_int, 0)
+        self.handler = PipeQueueHandler(self._w, self.dropped)
+        self._th = threading.Thread(target=self._process, daemon=True)
+        self._th.start()
+
+    def close(self):
+        # an empty record ends the listener after everything before it was written
+        os.set_blocking(self._w, True)
+        os.write(self._w, struct.pack('<H', 0))
+        self._th.join()
+
+    def _make_record(self, data):
+        values = pickle.loads(data)
+        record = logging.makeLogRecord(dict(zip(RECORD_FIELDS, values[0:-1]), msg=values[-1]))
+        record.msecs = (record.created - int(record.created)) * 1000
+        return record
+
+    def _write(self, batch):
+        for handler in self._handlers:
+            lines = [handler.format(record) + handler.terminator for record in batch if record.levelno >= handler.level]
+            if not lines:
+                continue
+            handler.acquire()
+            try:
+                handler.stream.write(''.join(lines))
+                handler.flush()
+            finally:
+                handler.release()
+
+    def _process(self):
+        buf = b''
+        while True:
+            buf += os.read(self._r, 65536)
+            batch = []
+            while len(buf) >= 2:
+                size = struct.unpack('<H', buf[0:2])[0]
+                if size == 0:
+                    self._write(batch)
+                    return
+                if len(buf) < 2 + size:
+                    break
+                batch.append(self._make_record(buf[2:2 + size]))
+                buf = buf[2 + size:]
+            self._write(batch)
@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import glob
+import mmap
+import os
+
+# the recorder, metrics, latency and timeline files: mapped before the workers are forked, every section in them has
+# one writer process, so a write is a plain store without a lock and the page cache keeps it when a process is killed
+
+
+def create_mapped(path, size, preallocate=False):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        if preallocate and hasattr(os, 'posix_fallocate'):
+            # a full disk fails here instead of as SIGBUS in a worker
+            os.posix_fallocate(fd, 0, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+def prune(pattern, keep):
+    # the newest keep files matching pattern stay, every start adds one and would otherwise fill the disk
+    if keep <= 0:
+        return []
+    paths = sorted(glob.glob(pattern), key=os.path.getmtime)[:-keep]
+    for path in paths:
+        os.remove(path)
+    return paths
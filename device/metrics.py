@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import struct
+from device.mapped_file import create_mapped
+
+# an update is a plain int64 increment in a memory-mapped file
+# name, type, help, label sets (one series each)
+METRICS = (
+    ('gamepad_events_total', 'counter', 'Input events read from the gamepad', ('',)),
+    ('nucleo_frames_total', 'counter', 'Nucleo telemetry lines parsed', ('',)),
+    ('nucleo_parse_errors_total', 'counter', 'Nucleo lines that were not telemetry', ('',)),
+    ('nucleo_rx_buffer_bytes', 'gauge', 'Bytes waiting in the Nucleo receive buffer', ('',)),
+    ('odrive_feedback_total', 'counter', 'ODrive feedback and state responses', ('',)),
+    ('odrive_in_flight', 'gauge', 'ODrive requests waiting for their response', ('',)),
+    ('commands_total', 'counter', 'Command sets a worker picked up from the command block',
+     ('device="nucleo"', 'device="odrive"')),
+    ('commands_coalesced_total', 'counter', 'Command sets replaced before the worker picked them up',
+     ('device="nucleo"', 'device="odrive"')),
+    ('loop_overruns_total', 'counter', 'Cycles that ran past their deadline',
+     ('loop="main"', 'loop="nucleo"', 'loop="odrive"', 'loop="watchdog"')),
+    ('main_cycle_seconds', 'histogram', 'Main loop work per cycle, without the wait', ('',)),
+)
+HISTOGRAM_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+MAGIC = b'METR'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+
+
+def _series_slots(kind):
+    # a histogram: one count per bucket, +Inf, then the sum in nanoseconds
+    return len(HISTOGRAM_BUCKETS) + 2 if kind == 'histogram' else 1
+
+
+def _layout():
+    slots = {}
+    n = 0
+    for name, kind, _, label_sets in METRICS:
+        for labels in label_sets:
+            slots[(name, labels)] = n
+            n += _series_slots(kind)
+    return slots, n
+
+
+class Counter():
+    def __init__(self, slots, index):
+        self._slots = slots
+        self._i = index
+
+    def inc(self, n=1):
+        self._slots[self._i] += n
+
+
+class Gauge():
+    def __init__(self, slots, index):
+        self._slots = slots
+        self._i = index
+
+    def set(self, value):
+        self._slots[self._i] = value
+
+
+class Histogram():
+    def __init__(self, slots, index):
+        self._slots = slots
+        self._i = index
+
+    def observe(self, seconds):
+        i = self._i
+        for bound in HISTOGRAM_BUCKETS:
+            if seconds <= bound:
+                break
+            i += 1
+        self._slots[i] += 1
+        self._slots[self._i + len(HISTOGRAM_BUCKETS) + 1] += int(seconds * 1e9)
+
+
+class NullMetric():
+    # metrics disabled
+    def inc(self, n=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, seconds):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class Metrics():
+    def __init__(self, path):
+        self.path = path
+        self._index, n = _layout()
+        size = HEADER.size + n * 8
+        self._mm = create_mapped(path, size)
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, n)
+        self._slots = memoryview(self._mm)[HEADER.size:].cast('q')
+        self._kinds = {name: kind for name, kind, _, _ in METRICS}
+
+    def get(self, name, labels=''):
+        kind = self._kinds[name]
+        index = self._index[(name, labels)]
+        if kind == 'counter':
+            return Counter(self._slots, index)
+        elif kind == 'gauge':
+            return Gauge(self._slots, index)
+        return Histogram(self._slots, index)
+
+    def render(self):
+        return render(self._mm[:])
+
+    def close(self):
+        self._slots.release()
+        self._mm.close()
+
+
+def metric_of(metrics, name, labels=''):
+    return metrics.get(name, labels) if metrics is not None else NULL_METRIC
+
+
+def render(data):
+    # Prometheus text exposition format 0.0.4
+    magic, version, n = HEADER.unpack_from(data, 0)
+    index, n_layout = _layout()
+    if magic != MAGIC or version != VERSION or n != n_layout:
+        raise ValueError('not a metrics file')
+    slots = struct.unpack_from('<{}q'.format(n), data, HEADER.size)
+    lines = []
+    for name, kind, help_text, label_sets in METRICS:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels in label_sets:
+            i = index[(name, labels)]
+            if kind != 'histogram':
+                lines.append('{}{} {}'.format(name, '{' + labels + '}' if labels else '', slots[i]))
+                continue
+            total = 0
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(HISTOGRAM_BUCKETS + ('+Inf',), slots[i:i + len(HISTOGRAM_BUCKETS) + 1]):
+                total += count
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound, total))
+            lines.append('{}_sum{} {}'.format(name, '{' + labels + '}' if labels else '',
+                                             slots[i + len(HISTOGRAM_BUCKETS) + 1] / 1e9))
+            lines.append('{}_count{} {}'.format(name, '{' + labels + '}' if labels else '', total))
+    return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import http.server
+import threading
+
+# apart from device.metrics, so the workers that only count do not import http.server
+
+
+class MetricsServer():
+    # /metrics on localhost, from a thread of the main process
+    def __init__(self, metrics, port=9108, host='127.0.0.1'):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.HTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._th = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._th.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+
+
+class Notifier():
+    # a pipe shared with the worker processes, readable while new data is waiting
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False)
+        os.set_blocking(self._w, False)
+
+    def fileno(self):
+        return self._r
+
+    def notify(self):
+        try:
+            os.write(self._w, b'\0')
+        except BlockingIOError:
+            # the pipe is full, a wakeup is pending anyway
+            pass
+
+    def clear(self):
+        try:
+            while os.read(self._r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self._r)
+        os.close(self._w)
@@ -1,14 +1,24 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import ctypes
 import serial
 import serial.tools.list_ports
 import time
+from device.clock import RealClock
+from device.command_reader import CommandReader
+from device.metrics import metric_of
+from device.odrive_transport import feedback_requests, open_pipeline
+from device.timeline import track_of
 from enum import Enum
 from multiprocessing import Process, Value
 
 
+# counts per motor turn
+ENCODER_CPR = 8192.0
+
+
 class Action_t(Enum):
     ACTION_NONE = -1
     ACTION_CALIBRATION = 0
@@ -34,18 +44,36 @@ class AxisState_t(Enum):
 
 class OdriveMp():
     def __init__(
-            self, logger,
+            self, logger, bus,
             port='/dev/ttyACM_odrive', baud=115200, timeout=0.1,
-            speed_lim=40000.0, current_lim=70.0, lpf_gain=0.05, calibration_current=10.0):
+            speed_lim=40000.0, current_lim=70.0, lpf_gain=0.05, calibration_current=10.0,
+            feedback_rate=100.0, feedback_depth=4, state_poll_divider=10, save_config=False,
+            persist_calibration=False, resume_closedloop=False,
+            protocol='ascii', endpoint_cache='odrive_endpoints.json',
+            watchdog_timeout=0.0, feed_ok=None, loop=None, clock=None, trace=None, timeline=None,
+            metrics=None):
+        # a cycle sends one feedback read per axis, and one 'r' per axis on every state poll
+        cycle = 2 * feedback_requests(protocol) + 2
+        if feedback_rate > 0 and feedback_depth < cycle:
+            raise ValueError('feedback_depth {} is less than the {} requests of a state poll cycle'.format(
+                feedback_depth, cycle))
+        self._time_init = time.time()
         self._logger = logger
+        self._clock = clock or RealClock()
+        self._track = track_of(timeline, 'odrive')
+        self._m_feedback = metric_of(metrics, 'odrive_feedback_total')
+        self._m_in_flight = metric_of(metrics, 'odrive_in_flight')
+        self._m_overruns = metric_of(metrics, 'loop_overruns_total', 'loop="odrive"')
         self.is_run = Value(ctypes.c_bool, False)
+        self._loop = loop
+        self._task = None
         self._speed_lim = speed_lim
         self._current_lim = current_lim
 
         # communication variables
-        self.request_mode = Value(ctypes.c_int, Action_t.ACTION_NONE.value)
-        self.target_angle_0 = Value(ctypes.c_double, 0.0)
-        self.target_angle_1 = Value(ctypes.c_double, 0.0)
+        self._bus = bus
+        self._reader = CommandReader(bus, 'odrive', Action_t.ACTION_IDLE.value, feed_ok=feed_ok, clock=self._clock,
+                                     trace=trace, metrics=metrics)
 
         # try to open com port
         try:
@@ -54,75 +82,345 @@ class OdriveMp():
             self._ser.readline()
             # dummy message to clear buffer
             self._ser.write(b'\n')
+            self._pipeline = open_pipeline(self._ser, protocol, self._logger, timeout=timeout, cache_path=endpoint_cache,
+                                           clock=self._clock)
+            self._fw_version = self._read_fw_version()
+            # positions and velocities are in encoder counts on 0.4 and in motor turns on 0.5, the bus keeps counts
+            self._pos_scale = 1.0 if self._fw_version < (0, 5) else 1.0 / ENCODER_CPR
             # set limit
+            limits = []
             for i in range(0, 2):
-                self._ser.write(('w axis{}.motor.config.calibration_current {}\n'.format(i, calibration_current)).encode())
-                self._ser.write(('w axis{}.motor.config.current_lim {}\n'.format(i, current_lim)).encode())
-                self._ser.write(('w axis{}.controller.config.vel_limit {}\n'.format(i, speed_lim)).encode())
+                limits.append(('axis{}.motor.config.calibration_current'.format(i), calibration_current))
+                limits.append(('axis{}.motor.config.current_lim'.format(i), current_lim))
+                limits.append(('axis{}.controller.config.vel_limit'.format(i), speed_lim * self._pos_scale))
                 # disable vel_limit_tolerance
-                self._ser.write(('w axis{}.controller.config.vel_limit_tolerance {}\n'.format(i, 0)).encode())
+                limits.append(('axis{}.controller.config.vel_limit_tolerance'.format(i), 0))
+                limits.append(('axis{}.config.watchdog_timeout'.format(i), watchdog_timeout))
+                if self._fw_version >= (0, 5):
+                    # 0.5 arms the watchdog with enable_watchdog, 0.4 with any watchdog_timeout above 0
+                    limits.append(('axis{}.config.enable_watchdog'.format(i), 1 if watchdog_timeout > 0 else 0))
+            self._set_limits(limits, save_config)
+            # a watchdog trip during the restart gap, or a fault before it, blocks every state request
+            self._log_errors()
+            self._clear_errors()
         except:
             self._logger.error('Odrive COM Port Open Error')
             return
 
-        # lpf
-        self._target_angle_0_lpf = 0.0
-        self._target_angle_1_lpf = 0.0
+        # feedback
+        self._feedback_period = 1.0 / feedback_rate if feedback_rate > 0 else 0.0
+        self._feedback_depth = feedback_depth
+        self._state_poll_divider = state_poll_divider
+
+        # watchdog
+        self._feed_ok = feed_ok
+        self._feed_period = min(0.05, watchdog_timeout / 4.0)
+        self._watchdog_timeout = watchdog_timeout
+
+        # calibration
+        self._persist_calibration = persist_calibration
+        self._resume_closedloop = resume_closedloop
+        self._calibration_time = [0.0, 0.0]
+        self._calibration_seen = [False, False]
+        self._calibration_index = [False, False]
+        self._calibration_done = [False, False]
+
+        # lpf, lpf_gain is per 50 ms, the period of the main loop it was tuned on
+        self._target_angle_lpf = [0.0, 0.0]
         self._lpf_gain = lpf_gain
+        self._mode = Action_t.ACTION_NONE.value
 
-        # start process
+        # start process, or run on the caller's event loop
         self.is_run.value = True
-        self._p = Process(target=self._process, args=())
-        self._p.start()
+        if loop is None:
+            self._p = Process(target=self._process, args=(), name='odrive')
+            self._p.start()
+        else:
+            self._task = loop.create_task(self._run())
 
     def close(self):
         self.is_run.value = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._loop.remove_reader(self._ser.fileno())
+            self._ser.close()
+
+    def _is_same(self, response, value):
+        response = {'True': 1, 'False': 0}.get(response, response)
+        try:
+            return abs(float(response) - value) <= 1e-6 * max(1.0, abs(value))
+        except (TypeError, ValueError):
+            return False
+
+    def _set_limits(self, limits, save_config):
+        # the limits survive a restart of main.py, so only write what the ODrive does not have yet
+        time_start = time.time()
+        responses = self._pipeline.transact([name for name, _ in limits])
+        time_read = time.time() - time_start
+        changes = [(name, value) for (name, value), response in zip(limits, responses)
+                   if not self._is_same(response, value)]
+        time_start = time.time()
+        for name, value in changes:
+            self._pipeline.write_property(name, value)
+        if changes and save_config:
+            self._pipeline.save_configuration()
+        time_write = time.time() - time_start
+
+        # read back
+        time_start = time.time()
+        if changes:
+            responses = self._pipeline.transact([name for name, _ in changes])
+            for (name, value), response in zip(changes, responses):
+                if not self._is_same(response, value):
+                    self._logger.error('ODrive {} is {}, expected {}'.format(name, response, value))
+        time_verify = time.time() - time_start
+
+        self._logger.info('ODrive limits: {} of {} written{}, {} skipped, '
+                          'read {:.1f} ms, write {:.1f} ms, verify {:.1f} ms'.format(
+            len(changes), len(limits), ' and saved' if changes and save_config else '', len(limits) - len(changes),
+            time_read * 1000.0, time_write * 1000.0, time_verify * 1000.0))
+
+    def _read_fw_version(self):
+        responses = self._pipeline.transact(['fw_version_major', 'fw_version_minor'])
+        try:
+            fw_version = tuple(int(float(response)) for response in responses)
+        except (TypeError, ValueError):
+            fw_version = (0, 4)
+        self._logger.info('ODrive firmware {}.{}'.format(*fw_version))
+        return fw_version
+
+    def _log_errors(self):
+        responses = self._pipeline.transact(['axis{}.error'.format(i) for i in range(0, 2)])
+        for i, response in enumerate(responses):
+            if not self._is_same(response, 0):
+                self._logger.error('ODrive axis{} error {}, cleared'.format(i, response))
+
+    def _clear_errors(self):
+        # the firmware refuses calibration and closed loop while an axis has an error set
+        if self._fw_version >= (0, 5):
+            self._pipeline.clear_errors()
+            return
+        for i in range(0, 2):
+            for name in ('error', 'motor.error', 'encoder.error', 'controller.error'):
+                self._pipeline.write_property('axis{}.{}'.format(i, name), 0)
+
+    def _read_calibration(self):
+        # is_calibrated and is_ready stay set while the ODrive is powered, whatever happens to main.py
+        names = []
+        for i in range(0, 2):
+            names.append('axis{}.motor.is_calibrated'.format(i))
+            names.append('axis{}.encoder.is_ready'.format(i))
+            names.append('axis{}.encoder.config.pre_calibrated'.format(i))
+            names.append('axis{}.encoder.config.use_index'.format(i))
+        responses = self._pipeline.transact(names)
+        return [[self._is_same(response, 1) for response in responses[i * 4:i * 4 + 4]] for i in range(0, 2)]
+
+    def _calibrate(self):
+        time_start = time.time()
+        self._clear_errors()
+        skipped = 0
+        for i, (motor_ready, encoder_ready, encoder_pre, use_index) in enumerate(self._read_calibration()):
+            if motor_ready and encoder_ready:
+                skipped += 1
+                continue
+            elif motor_ready and encoder_pre and use_index:
+                # pre-calibrated motor and encoder only need to find the index again
+                state = AxisState_t.AXIS_STATE_ENCODER_INDEX_SEARCH
+            else:
+                state = AxisState_t.AXIS_STATE_FULL_CALIBRATION_SEQUENCE
+            self._calibration_time[i] = self._clock.monotonic()
+            self._calibration_seen[i] = False
+            self._calibration_index[i] = use_index
+            self._pipeline.write_property('axis{}.requested_state'.format(i), state.value)
+            self._logger.info('axis{} {}'.format(i, state.name))
+        self._logger.info('ODrive calibration check in {:.1f} ms, {} of 2 axes already calibrated'.format(
+            (time.time() - time_start) * 1000.0, skipped))
+
+    def _update_calibration(self, i, state):
+        if not self._calibration_time[i]:
+            return
+        if state in (AxisState_t.AXIS_STATE_FULL_CALIBRATION_SEQUENCE.value,
+                     AxisState_t.AXIS_STATE_ENCODER_INDEX_SEARCH.value):
+            self._calibration_seen[i] = True
+        elif state == AxisState_t.AXIS_STATE_IDLE.value and self._calibration_seen[i]:
+            self._logger.info('axis{} calibrated in {:.1f} s'.format(i, self._clock.monotonic() - self._calibration_time[i]))
+            self._calibration_time[i] = 0.0
+            self._calibration_done[i] = True
+            if any(self._calibration_time):
+                return
+            if self._persist_calibration:
+                self._save_calibration()
+            self._calibration_done = [False, False]
+
+    def _save_calibration(self):
+        # survive a power cycle of the ODrive as well, saved once both axes are idle, 0.5 reboots on save.
+        # An encoder without an index cannot find its offset again, it stays uncalibrated
+        for i in range(0, 2):
+            if not self._calibration_done[i]:
+                continue
+            self._pipeline.write_property('axis{}.motor.config.pre_calibrated'.format(i), 1)
+            if self._calibration_index[i]:
+                self._pipeline.write_property('axis{}.encoder.config.pre_calibrated'.format(i), 1)
+        self._pipeline.save_configuration()
+
+    def _resume(self):
+        if all(motor_ready and encoder_ready for motor_ready, encoder_ready, _, _ in self._read_calibration()):
+            self._clear_errors()
+            for i in range(0, 2):
+                self._pipeline.write_property(
+                    'axis{}.requested_state'.format(i), AxisState_t.AXIS_STATE_CLOSED_LOOP_CONTROL.value)
+            self._logger.info('ODrive resumed closed loop {:.1f} ms after start'.format(
+                (time.time() - self._time_init) * 1000.0))
+        else:
+            self._logger.info('ODrive not calibrated, waiting for ACTION_CALIBRATION')
+
+    def _poll_feedback(self, time_now):
+        # top up the pipeline, one 'f' per axis and every n-th cycle an 'r' for the axis state
+        state_poll = (self._feedback_count + 1) % self._state_poll_divider == 0
+        cycle = 2 * self._pipeline.feedback_requests + (2 if state_poll else 0)
+        if self._feedback_period > 0 and time_now >= self._feedback_time \
+                and self._pipeline.in_flight() + cycle <= self._feedback_depth:
+            self._feedback_time = max(self._feedback_time + self._feedback_period, time_now)
+            self._feedback_count += 1
+            for i in range(0, 2):
+                self._pipeline.request_feedback(i, ('f', i))
+            if state_poll:
+                for i in range(0, 2):
+                    self._pipeline.request_property('axis{}.current_state'.format(i), ('state', i))
+            if self._feedback_count % 100 == 0:
+                self._fb['fb_rtt_p99'] = self._pipeline.rtt_percentiles((99,))[99]
+        self._drain_feedback()
+        self._m_in_flight.set(self._pipeline.in_flight())
+
+    def _drain_feedback(self):
+        # drain whatever has arrived, never wait for it
+        responses = self._pipeline.poll()
+        for tag, value, time_rx in responses:
+            try:
+                if tag[0] == 'f':
+                    pos, vel = value
+                    self._fb['fb_pos_{}'.format(tag[1])] = pos / self._pos_scale
+                    self._fb['fb_vel_{}'.format(tag[1])] = vel / self._pos_scale
+                    self._fb['fb_time_{}'.format(tag[1])] = time_rx
+                elif tag[0] == 'state':
+                    self._fb['fb_state_{}'.format(tag[1])] = int(value)
+                    self._update_calibration(tag[1], int(value))
+            except (TypeError, ValueError):
+                self._logger.error('Unexpected ODrive response {} to {}'.format(value, tag))
+        # both axes go out together, a reader never sees one axis newer than the other
+        if responses:
+            self._m_feedback.inc(len(responses))
+            self._bus.odrive.write(**self._fb)
+
+    def _feed_watchdog(self, time_now):
+        # stop feeding while the main loop is stalled, the ODrive then idles the axes on its own
+        if self._watchdog_timeout <= 0 or time_now < self._feed_time:
+            return
+        if self._feed_ok is None or self._feed_ok.value:
+            self._feed_time = time_now + self._feed_period
+            for i in range(0, 2):
+                self._pipeline.feed_watchdog(i)
+
+    def _command_step(self, request_mode, command):
+        if request_mode == Action_t.ACTION_CALIBRATION.value:
+            self._logger.info('ACTION_CALIBRATION')
+            self._calibrate()
+            self._reader.trace_write(command)
+
+        elif request_mode == Action_t.ACTION_CLOSEDLOOP.value:
+            self._logger.info('ACTION_CLOSEDLOOP')
+            self._clear_errors()
+            for i in range(0, 2):
+                self._pipeline.write_property(
+                    'axis{}.requested_state'.format(i), AxisState_t.AXIS_STATE_CLOSED_LOOP_CONTROL.value)
+            self._reader.trace_write(command)
+
+        elif request_mode == Action_t.ACTION_IDLE.value:
+            self._logger.info('ACTION_IDLE')
+            self._clear_errors()
+            for i in range(0, 2):
+                self._pipeline.write_property(
+                    'axis{}.requested_state'.format(i), AxisState_t.AXIS_STATE_IDLE.value)
+            self._reader.trace_write(command)
+
+        elif request_mode == Action_t.ACTION_VELOCITY_CTRL.value:
+            # the setpoints follow in _velocity_step, on every tick
+            self._logger.info('ACTION_VELOCITY_CTRL {} {}'.format(
+                command.odrive_target_angle_0, command.odrive_target_angle_1))
+
+        else:
+            return
+        self._mode = request_mode
+
+    def _velocity_step(self, command, dt):
+        # the filter steps on the worker's tick, not per command, so its time constant does not depend on how often
+        # the main loop wakes up
+        gain = 1.0 - (1.0 - self._lpf_gain) ** (dt / 0.05)
+        for i, target_angle in enumerate((command.odrive_target_angle_0, command.odrive_target_angle_1)):
+            if abs(target_angle - self._target_angle_lpf[i]) > 1.0:
+                self._target_angle_lpf[i] += (target_angle - self._target_angle_lpf[i]) * gain
+                self._pipeline.set_pos_setpoint(
+                    i, self._target_angle_lpf[i] / 360.0 * ENCODER_CPR * 10.0 * self._pos_scale)
+                self._reader.trace_write(command)
+
+    def _step(self):
+        time_begin = self._track.begin()
+        time_now = self._clock.monotonic()
+        self._feed_watchdog(time_now)
+        self._poll_feedback(time_now)
+        time_begin = self._track.end('poll', time_begin)
+        request_modes, command = self._reader.read()
+        for request_mode in request_modes:
+            self._command_step(request_mode, command)
+        if self._mode == Action_t.ACTION_VELOCITY_CTRL.value:
+            self._velocity_step(self._reader.command, time_now - self._velocity_time)
+        self._velocity_time = time_now
+        return self._track.end('command', time_begin)
+
+    def _init_process(self):
+        self._feed_time = 0.0
+        self._feedback_time = self._clock.monotonic()
+        self._feedback_count = 0
+        self._velocity_time = self._clock.monotonic()
+        self._fb = self._bus.odrive.to_dict(self._bus.odrive.read())
+        if self._resume_closedloop:
+            self._resume()
 
     def _process(self):
+        self._track.attach()
         try:
+            self._init_process()
+            time_next = self._clock.monotonic()
             while self.is_run.value:
-                if self.request_mode.value == Action_t.ACTION_CALIBRATION.value:
-                    self._logger.info('ACTION_CALIBRATION')
-                    for i in range(0, 2):
-                        self._ser.write(('w axis{}.requested_state {}\n'.format(
-                            i, AxisState_t.AXIS_STATE_FULL_CALIBRATION_SEQUENCE.value)).encode())
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_CLOSEDLOOP.value:
-                    self._logger.info('ACTION_CLOSEDLOOP')
-                    for i in range(0, 2):
-                        self._ser.write(('w axis{}.requested_state {}\n'.format(
-                            i, AxisState_t.AXIS_STATE_CLOSED_LOOP_CONTROL.value)).encode())
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_IDLE.value:
-                    self._logger.info('ACTION_IDLE')
-                    for i in range(0, 2):
-                        self._ser.write(('w axis{}.requested_state {}\n'.format(
-                            i, AxisState_t.AXIS_STATE_IDLE.value)).encode())
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_VELOCITY_CTRL.value:
-                    if abs(self.target_angle_0.value - self._target_angle_0_lpf) > 1.0:
-                        self._target_angle_0_lpf = self.target_angle_0.value * self._lpf_gain \
-                            + self._target_angle_0_lpf * (1 - self._lpf_gain)
-                        target_step = self._target_angle_0_lpf / 360.0 * 8192.0 * 10.0
-                        self._logger.info('ACTION_VELOCITY_CTRL_0 {}'.format(self.target_angle_0.value))
-                        self._ser.write(('p {} {} {} {}\n'.format(
-                            0, target_step, 0.0, 0.0)).encode())
-                    if abs(self.target_angle_1.value - self._target_angle_1_lpf) > 1.0:
-                        self._target_angle_1_lpf = self.target_angle_1.value * self._lpf_gain \
-                            + self._target_angle_1_lpf * (1 - self._lpf_gain)
-                        target_step = self._target_angle_1_lpf / 360.0 * 8192.0 * 10.0
-                        self._logger.info('ACTION_VELOCITY_CTRL_1 {}'.format(self.target_angle_1.value))
-                        self._ser.write(('p {} {} {} {}\n'.format(
-                            1, target_step, 0.0, 0.0)).encode())
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                else:
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                time.sleep(0.01)
+                time_begin = self._step()
+                time_next += 0.01
+                time_now = self._clock.monotonic()
+                if time_now > time_next:
+                    self._m_overruns.inc()
+                    time_next = time_now
+                self._clock.sleep_until(time_next)
+                self._track.end('sleep', time_begin)
         except:
             self.is_run.value = False
         self._ser.close()
+
+    def _on_readable(self):
+        try:
+            self._drain_feedback()
+        except:
+            self.close()
+
+    async def _run(self):
+        # event loop mode: responses are drained as they arrive, the rest keeps the 10 ms cycle
+        # calibration checks and resume still wait for their round trips in place
+        try:
+            self._init_process()
+            self._loop.add_reader(self._ser.fileno(), self._on_readable)
+            while self.is_run.value:
+                self._step()
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            pass
+        except:
+            self.close()
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+import time
+from device.odrive_transport import Pipeline
+
+# ODrive native (fibre) protocol over a stream:
+# [0xAA, length, crc8] + packet + crc16 (big endian)
+# request packet:  seq_no, endpoint_id (| 0x8000 to expect a response), response length, payload, trailer
+# response packet: seq_no | 0x8000, payload
+PROTOCOL_VERSION = 1
+SYNC_BYTE = 0xAA
+CRC8_INIT = 0x42
+CRC8_POLYNOMIAL = 0x37
+CRC16_INIT = 0x1337
+CRC16_POLYNOMIAL = 0x3d65
+JSON_CHUNK_SIZE = 64
+
+ENDPOINT_FORMATS = {
+    'float': '<f',
+    'bool': '<?',
+    'int8': '<b',
+    'uint8': '<B',
+    'int16': '<h',
+    'uint16': '<H',
+    'int32': '<i',
+    'uint32': '<I',
+    'int64': '<q',
+    'uint64': '<Q',
+}
+
+
+def _make_crc_table(polynomial, bitwidth):
+    table = []
+    mask = (1 << bitwidth) - 1
+    for byte in range(0, 256):
+        remainder = byte << (bitwidth - 8)
+        for _ in range(0, 8):
+            if remainder & (1 << (bitwidth - 1)):
+                remainder = ((remainder << 1) ^ polynomial) & mask
+            else:
+                remainder = (remainder << 1) & mask
+        table.append(remainder)
+    return table
+
+
+CRC8_TABLE = _make_crc_table(CRC8_POLYNOMIAL, 8)
+CRC16_TABLE = _make_crc_table(CRC16_POLYNOMIAL, 16)
+
+
+def calc_crc8(remainder, data):
+    for byte in data:
+        remainder = CRC8_TABLE[remainder ^ byte]
+    return remainder
+
+
+def calc_crc16(remainder, data):
+    for byte in data:
+        remainder = ((remainder << 8) & 0xffff) ^ CRC16_TABLE[(remainder >> 8) ^ byte]
+    return remainder
+
+
+def encode_frame(packet):
+    header = bytes((SYNC_BYTE, len(packet)))
+    return header + bytes((calc_crc8(CRC8_INIT, header),)) + packet \
+        + struct.pack('>H', calc_crc16(CRC16_INIT, packet))
+
+
+def decode_frames(buf):
+    # returns complete packets and the bytes that still belong to an unfinished frame
+    packets = []
+    while True:
+        start = buf.find(bytes((SYNC_BYTE,)))
+        if start < 0:
+            return packets, b''
+        buf = buf[start:]
+        if len(buf) < 3:
+            return packets, buf
+        if calc_crc8(CRC8_INIT, buf[0:2]) != buf[2]:
+            buf = buf[1:]
+            continue
+        end = 3 + buf[1] + 2
+        if len(buf) < end:
+            return packets, buf
+        packet = buf[3:end - 2]
+        if calc_crc16(CRC16_INIT, packet) == struct.unpack('>H', buf[end - 2:end])[0]:
+            packets.append(packet)
+            buf = buf[end:]
+        else:
+            buf = buf[1:]
+
+
+def flatten_endpoints(members, prefix=''):
+    endpoints = {}
+    for member in members:
+        name = prefix + member.get('name', '')
+        if member.get('type') == 'object':
+            endpoints.update(flatten_endpoints(member.get('members', []), name + '.'))
+        elif member.get('type') == 'function':
+            endpoints[name] = (member['id'], None)
+        elif member.get('type') in ENDPOINT_FORMATS:
+            endpoints[name] = (member['id'], ENDPOINT_FORMATS[member['type']])
+    return endpoints
+
+
+class NativePipeline(Pipeline):
+    # responses carry the sequence number, so they are matched by seq_no and a lost one only costs itself
+    feedback_requests = 2
+
+    def __init__(self, ser, timeout=0.1, rtt_len=1000, cache_path='odrive_endpoints.json', clock=None):
+        super().__init__(ser, timeout=timeout, rtt_len=rtt_len, clock=clock)
+        self._pending = {}
+        self._unknown = []
+        self._feed_forward = {}
+        self._setpoints = {}
+        self._rx_buf = b''
+        self._seq_no = 0
+        self._json_crc = 0
+        self.endpoints = {}
+        self._cache_path = cache_path
+
+        if not (self._load_cache() and self._check_cache()):
+            self._fetch_endpoints()
+            self._save_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self._cache_path) as f:
+                cache = json.load(f)
+            self._json_crc = cache['json_crc']
+            self.endpoints = {name: tuple(value) for name, value in cache['endpoints'].items()}
+        except (IOError, ValueError, KeyError):
+            return False
+        return True
+
+    def _save_cache(self):
+        try:
+            with open(self._cache_path, 'w') as f:
+                json.dump({'json_crc': self._json_crc, 'endpoints': self.endpoints}, f)
+        except IOError:
+            pass
+
+    def _check_cache(self):
+        # the ODrive drops requests carrying a foreign JSON CRC, so any answer proves the map is current
+        for name, (_, fmt) in self.endpoints.items():
+            if fmt:
+                return self._call(name) is not None
+        return False
+
+    def _fetch_endpoints(self):
+        json_bytes = b''
+        while True:
+            chunk = self._call_raw(0, struct.pack('<I', len(json_bytes)), JSON_CHUNK_SIZE, PROTOCOL_VERSION)
+            if chunk is None:
+                raise IOError('ODrive did not answer the endpoint 0 request')
+            if not chunk:
+                break
+            json_bytes += chunk
+        self._json_crc = calc_crc16(PROTOCOL_VERSION, json_bytes)
+        self.endpoints = flatten_endpoints(json.loads(json_bytes.decode('utf-8')))
+
+    def _send(self, endpoint_id, payload, response_length, expect_response, trailer=None):
+        self._seq_no = (self._seq_no + 1) & 0x7fff
+        if expect_response:
+            endpoint_id |= 0x8000
+        packet = struct.pack('<HHH', self._seq_no, endpoint_id, response_length) + payload \
+            + struct.pack('<H', self._json_crc if trailer is None else trailer)
+        self._ser.write(encode_frame(packet))
+        return self._seq_no
+
+    def _request_raw(self, endpoint_id, payload, response_length, tag, fmt, group=None, trailer=None):
+        seq_no = self._send(endpoint_id, payload, response_length, True, trailer)
+        self._pending[seq_no] = (tag, time.time(), fmt, group)
+
+    def _call_raw(self, endpoint_id, payload, response_length, trailer=None):
+        self._request_raw(endpoint_id, payload, response_length, ('call',), None, trailer=trailer)
+        while self.in_flight():
+            for tag, value, _ in self.poll():
+                if tag[0] == 'call':
+                    return value
+            time.sleep(0.0005)
+        return None
+
+    def _call(self, name):
+        endpoint_id, fmt = self.endpoints[name]
+        data = self._call_raw(endpoint_id, b'', struct.calcsize(fmt))
+        return struct.unpack(fmt, data)[0] if data else None
+
+    def request_property(self, name, tag):
+        if name not in self.endpoints:
+            # answered with None on the next poll, like 'invalid property' on ASCII
+            self._unknown.append(tag)
+            return
+        endpoint_id, fmt = self.endpoints[name]
+        self._request_raw(endpoint_id, b'', struct.calcsize(fmt), tag, fmt)
+
+    def request_feedback(self, axis, tag):
+        # two reads, published together when the second one arrives
+        group = []
+        for name, part_tag in (('axis{}.encoder.pos_estimate', None), ('axis{}.encoder.vel_estimate', tag)):
+            endpoint_id, fmt = self.endpoints[name.format(axis)]
+            self._request_raw(endpoint_id, b'', struct.calcsize(fmt), part_tag, fmt, group)
+
+    def _encode_write(self, name, value):
+        if name not in self.endpoints:
+            return b''
+        endpoint_id, fmt = self.endpoints[name]
+        if fmt == '<f':
+            value = float(value)
+        elif fmt == '<?':
+            value = bool(value)
+        else:
+            value = int(value)
+        self._seq_no = (self._seq_no + 1) & 0x7fff
+        return encode_frame(struct.pack('<HHH', self._seq_no, endpoint_id, 0) + struct.pack(fmt, value)
+                            + struct.pack('<H', self._json_crc))
+
+    def write_property(self, name, value):
+        frame = self._encode_write(name, value)
+        if frame:
+            self._ser.write(frame)
+
+    def _setpoint_names(self, axis):
+        # firmware 0.5 takes the setpoints as input_pos, input_vel and input_torque, its *_setpoint are read only
+        if axis not in self._setpoints:
+            if 'axis{}.controller.input_pos'.format(axis) in self.endpoints:
+                names = ('input_pos', 'input_vel', 'input_torque')
+            else:
+                names = ('pos_setpoint', 'vel_setpoint', 'current_setpoint')
+            self._setpoints[axis] = ['axis{}.controller.{}'.format(axis, name) for name in names]
+        return self._setpoints[axis]
+
+    def set_pos_setpoint(self, axis, pos, vel_ff=0.0, current_ff=0.0):
+        # the feed forward terms rarely change, so usually only the position goes out
+        pos_name, vel_name, current_name = self._setpoint_names(axis)
+        frames = self._encode_write(pos_name, pos)
+        if self._feed_forward.get(axis) != (vel_ff, current_ff):
+            self._feed_forward[axis] = (vel_ff, current_ff)
+            frames += self._encode_write(vel_name, vel_ff)
+            frames += self._encode_write(current_name, current_ff)
+        if frames:
+            self._ser.write(frames)
+
+    def save_configuration(self):
+        if 'save_configuration' in self.endpoints:
+            self._send(self.endpoints['save_configuration'][0], b'', 0, False)
+
+    def feed_watchdog(self, axis):
+        name = 'axis{}.watchdog_feed'.format(axis)
+        if name in self.endpoints:
+            self._send(self.endpoints[name][0], b'', 0, False)
+
+    def clear_errors(self):
+        if 'clear_errors' in self.endpoints:
+            self._send(self.endpoints['clear_errors'][0], b'', 0, False)
+
+    def in_flight(self):
+        return len(self._pending) + len(self._unknown)
+
+    def poll(self):
+        waiting = self._ser.in_waiting
+        if waiting:
+            self._rx_buf += self._ser.read(waiting)
+        time_now = time.time()
+        time_rx = self._clock.time()
+        responses = [(tag, None, time_rx) for tag in self._unknown]
+        self._unknown = []
+        packets, self._rx_buf = decode_frames(self._rx_buf)
+        for packet in packets:
+            if len(packet) < 2:
+                continue
+            seq_no = struct.unpack('<H', packet[0:2])[0] & 0x7fff
+            if seq_no not in self._pending:
+                continue
+            tag, time_request, fmt, group = self._pending.pop(seq_no)
+            self.rtt.append(time_now - time_request)
+            data = packet[2:]
+            try:
+                value = struct.unpack(fmt, data)[0] if fmt else data
+            except struct.error:
+                value = None
+            if group is None:
+                responses.append((tag, value, time_rx))
+            elif tag is None:
+                group.append(value)
+            else:
+                responses.append((tag, (group[0], value) if group and group[0] is not None else None, time_rx))
+
+        # only the expired requests are lost, everything else is still matched by seq_no
+        for seq_no in [seq_no for seq_no, pending in self._pending.items() if time_now - pending[1] > self._timeout]:
+            tag, _, _, group = self._pending.pop(seq_no)
+            self.timeout_count += 1
+            if tag is not None:
+                responses.append((tag, None, time_rx))
+        return responses
+
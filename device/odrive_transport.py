@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+from collections import deque
+from device.clock import RealClock
+
+
+class Pipeline():
+    # requests one request_feedback call puts in flight
+    feedback_requests = 1
+
+    # the round trip times and timeouts are real time, the response stamps go on the bus and follow the clock
+    def __init__(self, ser, timeout=0.1, rtt_len=1000, clock=None):
+        self._ser = ser
+        self._timeout = timeout
+        self._clock = clock or RealClock()
+        self.rtt = deque(maxlen=rtt_len)
+        self.timeout_count = 0
+
+    def transact(self, names):
+        # send a whole batch before waiting, so the batch costs about one round trip
+        results = [None] * len(names)
+        for n, name in enumerate(names):
+            self.request_property(name, ('transact', n))
+        while self.in_flight():
+            for tag, value, _ in self.poll():
+                if tag[0] == 'transact':
+                    results[tag[1]] = value
+            time.sleep(0.0005)
+        return results
+
+    def rtt_percentiles(self, percentiles=(50, 90, 99)):
+        data = sorted(self.rtt)
+        if not data:
+            return {p: 0.0 for p in percentiles}
+        return {p: data[min(len(data) - 1, int(len(data) * p / 100.0))] for p in percentiles}
+
+
+class AsciiPipeline(Pipeline):
+    # ODrive answers 'f' and 'r' with exactly one line and stays silent on 'p' and 'w',
+    # so responses can be matched to requests in order while several are in flight.
+    # An 'f' reply is two numbers and an 'r' reply anything else, a reply that does not fit
+    # the oldest request means the replies in between were lost.
+    def __init__(self, ser, timeout=0.1, rtt_len=1000, clock=None):
+        super().__init__(ser, timeout=timeout, rtt_len=rtt_len, clock=clock)
+        self._pending = deque()
+        self._rx_buf = b''
+
+    def _write(self, line):
+        self._ser.write(line.encode())
+
+    def _request(self, line, tag, parse, shape):
+        self._ser.write(line.encode())
+        self._pending.append((tag, time.time(), parse, shape))
+
+    @staticmethod
+    def _parse_feedback(line):
+        pos, vel = line.split()[0:2]
+        return float(pos), float(vel)
+
+    @staticmethod
+    def _shape(line):
+        try:
+            pos, vel = line.split()
+            float(pos), float(vel)
+            return 'f'
+        except ValueError:
+            return 'r'
+
+    def request_property(self, name, tag):
+        self._request('r {}\n'.format(name), tag, str, 'r')
+
+    def request_feedback(self, axis, tag):
+        self._request('f {}\n'.format(axis), tag, self._parse_feedback, 'f')
+
+    def write_property(self, name, value):
+        self._write('w {} {}\n'.format(name, value))
+
+    def set_pos_setpoint(self, axis, pos, vel_ff=0.0, current_ff=0.0):
+        self._write('p {} {} {} {}\n'.format(axis, pos, vel_ff, current_ff))
+
+    def save_configuration(self):
+        self._write('ss\n')
+
+    def feed_watchdog(self, axis):
+        self._write('u {}\n'.format(axis))
+
+    def clear_errors(self):
+        # firmware 0.5, all axes at once
+        self._write('sc\n')
+
+    def in_flight(self):
+        return len(self._pending)
+
+    def poll(self):
+        responses = []
+        waiting = self._ser.in_waiting
+        if waiting:
+            self._rx_buf += self._ser.read(waiting)
+        time_now = time.time()
+        time_rx = self._clock.time()
+        while b'\n' in self._rx_buf:
+            line, self._rx_buf = self._rx_buf.split(b'\n', 1)
+            line = line.strip().decode('utf-8', 'replace')
+            if not line:
+                continue
+            # resync: drop the requests whose replies were lost, or the line if nothing waits for it
+            shape = self._shape(line)
+            lost = next((n for n, request in enumerate(self._pending) if request[3] == shape), None)
+            if lost is None:
+                continue
+            for _ in range(0, lost):
+                self._pending.popleft()
+            self.timeout_count += lost
+            tag, time_request, parse, _ = self._pending.popleft()
+            self.rtt.append(time_now - time_request)
+            try:
+                value = parse(line)
+            except ValueError:
+                value = None
+            responses.append((tag, value, time_rx))
+
+        # a lost response would shift every later match, so start over
+        if self._pending and time_now - self._pending[0][1] > self._timeout:
+            self.timeout_count += len(self._pending)
+            self._pending.clear()
+            self._rx_buf = b''
+            self._ser.reset_input_buffer()
+        return responses
+
+
+def feedback_requests(protocol):
+    # for the depth check before the pipeline is open, a native fallback to ASCII only costs less
+    if protocol == 'native':
+        from device.odrive_native import NativePipeline
+        return NativePipeline.feedback_requests
+    return AsciiPipeline.feedback_requests
+
+
+def open_pipeline(ser, protocol, logger, timeout=0.1, cache_path='odrive_endpoints.json', clock=None):
+    # the ASCII protocol stays as the fallback when the native one does not answer
+    if protocol == 'native':
+        from device.odrive_native import NativePipeline
+        try:
+            pipeline = NativePipeline(ser, timeout=timeout, cache_path=cache_path, clock=clock)
+            logger.info('ODrive native protocol, {} endpoints'.format(len(pipeline.endpoints)))
+            return pipeline
+        except (IOError, KeyError, ValueError) as e:
+            logger.error('ODrive native protocol not available ({}), use ASCII'.format(e))
+            ser.reset_input_buffer()
+            ser.write(b'\n')
+    return AsciiPipeline(ser, timeout=timeout, clock=clock)
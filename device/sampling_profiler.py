@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import collections
+import multiprocessing
+import os
+import signal
+
+
+class SamplingProfiler():
+    # statistical profiler on CPU time: SIGPROF samples the interrupted stack, another signal toggles it
+    # installed before the workers are forked, every process toggles and writes its own profile
+    def __init__(self, prefix, interval=0.005, logger=None):
+        self._prefix = prefix
+        self._interval = interval
+        self._logger = logger
+        self._stacks = collections.Counter()
+        self._labels = {}
+        self.is_running = False
+
+    def install(self, signum=signal.SIGUSR1):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.signal(signum, self._toggle)
+
+    def start(self):
+        self._stacks.clear()
+        self.is_running = True
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+
+    def stop(self):
+        # collapsed stacks, one 'root;...;leaf count' line each, the input of flamegraph.pl and speedscope
+        signal.setitimer(signal.ITIMER_PROF, 0.0, 0.0)
+        self.is_running = False
+        path = '{}_{}_{}.collapsed'.format(self._prefix, multiprocessing.current_process().name, os.getpid())
+        with open(path, 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        return path
+
+    def _toggle(self, signum, frame):
+        if not self.is_running:
+            self.start()
+            if self._logger is not None:
+                self._logger.info('Profiler started in {}'.format(multiprocessing.current_process().name))
+            return
+        path = self.stop()
+        if self._logger is not None:
+            self._logger.info('Profile of {} samples written to {}'.format(sum(self._stacks.values()), path))
+
+    def _sample(self, signum, frame):
+        # Python runs signal handlers in the main thread, the loop of every worker
+        labels = self._labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = '{} ({}:{})'.format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        self._stacks[';'.join(stack)] += 1
@@ -1,10 +1,15 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import ctypes
 import serial
 import serial.tools.list_ports
-import time
+from device.clock import RealClock
+from device.command_reader import CommandReader
+from device.metrics import metric_of
+from device.notifier import Notifier
+from device.timeline import track_of
 from enum import Enum
 from multiprocessing import Process, Value
 
@@ -21,20 +26,24 @@ class Action_t(Enum):
 
 
 class SerilaMp():
-    def __init__(self, logger, port='/dev/ttyACM_f446re', baud=115200, timeout=0.1):
+    def __init__(self, logger, bus, port='/dev/ttyACM_f446re', baud=115200, timeout=0.1,
+                 keepalive_interval=0.0, feed_ok=None, loop=None, clock=None, trace=None, timeline=None,
+                 metrics=None):
         self._logger = logger
+        self._clock = clock or RealClock()
+        self._track = track_of(timeline, 'nucleo')
+        self._metrics = metrics
+        self._m_frames = metric_of(metrics, 'nucleo_frames_total')
+        self._m_parse_errors = metric_of(metrics, 'nucleo_parse_errors_total')
+        self._m_rx_buffer = metric_of(metrics, 'nucleo_rx_buffer_bytes')
+        self._m_overruns = metric_of(metrics, 'loop_overruns_total', 'loop="nucleo"')
         self.is_run = Value(ctypes.c_bool, False)
+        self._loop = loop
+        self._task = None
 
         # communication variables
-        self.request_mode = Value(ctypes.c_int, Action_t.ACTION_NONE.value)
-        self.target_angle = Value(ctypes.c_double, 0.0)
-
-        self.rx_stw_mode = Value(ctypes.c_int, 0)
-        self.rx_actual_angle_lpf = Value(ctypes.c_double, 0.0)
-        self.rx_target_angle_lpf = Value(ctypes.c_double, 0.0)
-        self.rx_selector_switch = Value(ctypes.c_int, 0)
-        self.rx_actual_encoder_pos = Value(ctypes.c_int, 0)
-        self.rx_potentio_a_raw = Value(ctypes.c_int, 0)
+        self._bus = bus
+        self.notifier = Notifier()
 
         # try to open com port
         try:
@@ -51,16 +60,35 @@ class SerilaMp():
             self._logger.error('Serial Nucleo COM Port Open Error')
             return
 
+        # keepalive
+        self._keepalive_interval = keepalive_interval
+        self._keepalive_time = 0.0
+        self._feed_ok = feed_ok
+
         # z1
         self._target_angle_z1 = 0.0
+        self._dlist_z1 = None
+        self._reader = CommandReader(bus, 'nucleo', Action_t.ACTION_IDLE.value, feed_ok=feed_ok, clock=self._clock,
+                                     trace=trace, metrics=metrics)
 
-        # start process
+        # start process, or run on the caller's event loop
         self.is_run.value = True
-        self._p = Process(target=self._process, args=())
-        self._p.start()
+        if loop is None:
+            self._p = Process(target=self._process, args=(), name='nucleo')
+            self._p.start()
+        else:
+            self._ser.timeout = 0
+            self._rx_buf = b''
+            loop.add_reader(self._ser.fileno(), self._on_readable)
+            self._task = loop.create_task(self._run())
 
     def close(self):
         self.is_run.value = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._loop.remove_reader(self._ser.fileno())
+            self._ser.close()
 
     def _search_com_port(self):
         coms = serial.tools.list_ports.comports()
@@ -77,51 +105,110 @@ class SerilaMp():
             self._logger.debug('Could not find COM port')
         return use_port
 
+    def _keepalive(self):
+        if self._keepalive_interval <= 0 or self._clock.monotonic() < self._keepalive_time:
+            return
+        if self._feed_ok is None or self._feed_ok.value:
+            self._keepalive_time = self._clock.monotonic() + self._keepalive_interval
+            self._ser.write(b'k\n')
+
+    def _receive(self, line):
+        dlist = line.decode('utf-8').split(',')
+        if dlist[0] == '#' and len(dlist) == 12:
+            self._bus.nucleo.write(
+                rx_stw_mode=int(dlist[1]),
+                rx_actual_angle_lpf=float(dlist[2]),
+                rx_target_angle_lpf=float(dlist[3]),
+                rx_selector_switch=int(dlist[4]),
+                rx_actual_encoder_pos=int(dlist[5]),
+                rx_potentio_a_raw=int(dlist[6]),
+                rx_time=self._clock.time())
+            self._m_frames.inc()
+            # wake the main loop only when the telemetry changed
+            if dlist[1:7] != self._dlist_z1:
+                self._dlist_z1 = dlist[1:7]
+                self.notifier.notify()
+        else:
+            self._m_parse_errors.inc()
+            self._logger.error('--- Unexpected Rx Data ---')
+            self._logger.info(len(dlist))
+            self._logger.info(dlist)
+
+    def _command(self, request_mode, target_angle):
+        if request_mode == Action_t.ACTION_CALIBRATION.value:
+            self._logger.info('ACTION_CALIBRATION')
+            self._ser.write(b'c\n')
+            self._reader.trace_write(self._reader.command)
+
+        elif request_mode == Action_t.ACTION_CLOSEDLOOP.value:
+            self._logger.info('ACTION_CLOSEDLOOP')
+            self._ser.write(b'l\n')
+            self._reader.trace_write(self._reader.command)
+
+        elif request_mode == Action_t.ACTION_IDLE.value:
+            self._logger.info('ACTION_IDLE')
+            self._ser.write(b'i\n')
+            self._reader.trace_write(self._reader.command)
+
+        elif request_mode == Action_t.ACTION_VELOCITY_CTRL.value \
+                and target_angle != self._target_angle_z1:
+            self._logger.info('ACTION_VELOCITY_CTRL {}'.format(target_angle))
+            self._ser.write('p,{}\n\r'.format(int(target_angle * 1000.0)).encode())
+            self._reader.trace_write(self._reader.command)
+            self._target_angle_z1 = target_angle
+
+        else:
+            pass
+
     def _process(self):
+        self._track.attach()
         try:
+            time_next = self._clock.monotonic()
             while self.is_run.value:
-                if self.request_mode.value == Action_t.ACTION_NONE.value:
-                    # receive task
-                    string_data = self._ser.readline().decode('utf-8')
-                    dlist = string_data.split(',')
-                    if dlist[0] == '#' and len(dlist) == 12:
-                        self.rx_stw_mode.value = int(dlist[1])
-                        self.rx_actual_angle_lpf.value = float(dlist[2])
-                        self.rx_target_angle_lpf.value = float(dlist[3])
-                        self.rx_selector_switch.value = int(dlist[4])
-                        self.rx_actual_encoder_pos.value = int(dlist[5])
-                        self.rx_potentio_a_raw.value = int(dlist[6])
-                    else:
-                        self._logger.error('--- Unexpected Rx Data ---')
-                        self._logger.info(len(dlist))
-                        self._logger.info(dlist)
-
-                elif self.request_mode.value == Action_t.ACTION_CALIBRATION.value:
-                    self._logger.info('ACTION_CALIBRATION')
-                    self._ser.write(b'c\n')
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_CLOSEDLOOP.value:
-                    self._logger.info('ACTION_CLOSEDLOOP')
-                    self._ser.write(b'l\n')
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_IDLE.value:
-                    self._logger.info('ACTION_IDLE')
-                    self._ser.write(b'i\n')
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                elif self.request_mode.value == Action_t.ACTION_VELOCITY_CTRL.value \
-                        and self.target_angle.value != self._target_angle_z1:
-                    self._logger.info('ACTION_VELOCITY_CTRL {}'.format(self.target_angle.value))
-                    self._ser.write('p,{}\n\r'.format(int(self.target_angle.value * 1000.0)).encode())
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-                    self._target_angle_z1 = self.target_angle.value
-
-                else:
-                    self.request_mode.value = Action_t.ACTION_NONE.value
-
-                time.sleep(0.01)
+                time_begin = self._track.begin()
+                self._keepalive()
+                request_modes, command = self._reader.read()
+                for request_mode in request_modes:
+                    self._command(request_mode, command.nucleo_target_angle)
+                time_begin = self._track.end('write', time_begin)
+                # receive task, on every cycle so commands do not take turns with the telemetry
+                line = self._ser.readline()
+                if self._metrics is not None:
+                    self._m_rx_buffer.set(self._ser.in_waiting)
+                time_begin = self._track.end('read', time_begin)
+                self._receive(line)
+                time_begin = self._track.end('parse', time_begin)
+                # 10 ms cycle, the time spent waiting in readline counts towards it
+                time_next += 0.01
+                time_now = self._clock.monotonic()
+                if time_now > time_next:
+                    self._m_overruns.inc()
+                    time_next = time_now
+                self._clock.sleep_until(time_next)
+                self._track.end('sleep', time_begin)
         except:
             self.is_run.value = False
         self._ser.close()
+
+    def _on_readable(self):
+        # event loop mode: telemetry is parsed as soon as a line is complete
+        try:
+            self._rx_buf += self._ser.read(self._ser.in_waiting or 1)
+            while b'\n' in self._rx_buf:
+                line, self._rx_buf = self._rx_buf.split(b'\n', 1)
+                self._receive(line + b'\n')
+        except:
+            self.close()
+
+    async def _run(self):
+        try:
+            while self.is_run.value:
+                self._keepalive()
+                request_modes, command = self._reader.read()
+                for request_mode in request_modes:
+                    self._command(request_mode, command.nucleo_target_angle)
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            pass
+        except:
+            self.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+from multiprocessing.sharedctypes import RawValue
+
+
+class InputState(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_uint32),
+        ('gp_type', ctypes.c_int32),
+        ('gp_code', ctypes.c_int32),
+        ('gp_value', ctypes.c_int32),
+        ('button_mask', ctypes.c_int64),
+        ('gp_time', ctypes.c_double),
+        # latency trace: event number and the time it was written here
+        ('gp_trace', ctypes.c_uint32),
+        ('gp_bus_time', ctypes.c_double),
+    ]
+
+
+class NucleoState(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_uint32),
+        ('rx_stw_mode', ctypes.c_int32),
+        ('rx_actual_angle_lpf', ctypes.c_double),
+        ('rx_target_angle_lpf', ctypes.c_double),
+        ('rx_selector_switch', ctypes.c_int32),
+        ('rx_actual_encoder_pos', ctypes.c_int32),
+        ('rx_potentio_a_raw', ctypes.c_int32),
+        ('rx_time', ctypes.c_double),
+    ]
+
+
+class OdriveState(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_uint32),
+        ('fb_pos_0', ctypes.c_double),
+        ('fb_vel_0', ctypes.c_double),
+        ('fb_time_0', ctypes.c_double),
+        ('fb_pos_1', ctypes.c_double),
+        ('fb_vel_1', ctypes.c_double),
+        ('fb_time_1', ctypes.c_double),
+        ('fb_state_0', ctypes.c_int32),
+        ('fb_state_1', ctypes.c_int32),
+        ('fb_rtt_p99', ctypes.c_double),
+    ]
+
+
+# state requests (calibration, closed loop, idle) go to both devices through a small ring, a worker that falls
+# behind still applies every one of them in order, where the setpoints only ever need the newest
+STATE_DEPTH = 4
+
+
+class CommandState(ctypes.Structure):
+    # each device counts its own setpoint commands, a worker acts when its counter moved
+    _fields_ = [
+        ('nucleo_seq', ctypes.c_uint32),
+        ('nucleo_mode', ctypes.c_int32),
+        ('nucleo_target_angle', ctypes.c_double),
+        ('odrive_seq', ctypes.c_uint32),
+        ('odrive_mode', ctypes.c_int32),
+        ('odrive_target_angle_0', ctypes.c_double),
+        ('odrive_target_angle_1', ctypes.c_double),
+        ('state_seq', ctypes.c_uint32),
+        ('state_0', ctypes.c_int32),
+        ('state_1', ctypes.c_int32),
+        ('state_2', ctypes.c_int32),
+        ('state_3', ctypes.c_int32),
+        # latency trace: the newest input event behind this command, its kernel time and the publish time
+        ('trace_id', ctypes.c_uint32),
+        ('trace_time', ctypes.c_double),
+        ('trace_main_time', ctypes.c_double),
+    ]
+
+
+class CommandLayout(ctypes.Structure):
+    _fields_ = [
+        ('index', ctypes.c_uint32),
+        ('slots', CommandState * 2),
+    ]
+
+
+class BusLayout(ctypes.Structure):
+    _fields_ = [
+        ('input', InputState),
+        ('nucleo', NucleoState),
+        ('odrive', OdriveState),
+        ('command', CommandLayout),
+    ]
+
+
+class Section():
+    # seqlock: one writer per section, the counter is odd while a write is in progress
+    def __init__(self, shm, struct_type, record=None):
+        self._shm = shm
+        self._type = struct_type
+        self._offset = getattr(struct_type, struct_type._fields_[1][0]).offset
+        self._size = ctypes.sizeof(struct_type) - self._offset
+        self._record = record
+        self._names = [name for name, _ in struct_type._fields_[1:]]
+
+    def read(self):
+        shm = self._shm
+        while True:
+            seq = shm.seq
+            if seq & 1:
+                continue
+            snapshot = self._type.from_buffer_copy(shm)
+            if shm.seq == seq:
+                return snapshot
+
+    def write(self, **fields):
+        shm = self._shm
+        shm.seq += 1
+        for name, value in fields.items():
+            setattr(shm, name, value)
+        shm.seq += 1
+        if self._record is not None:
+            self._record.append([getattr(shm, name) for name in self._names])
+
+    def publish(self, snapshot):
+        # copy everything behind the counter in one pass
+        shm = self._shm
+        shm.seq += 1
+        ctypes.memmove(ctypes.addressof(shm) + self._offset, ctypes.addressof(snapshot) + self._offset, self._size)
+        shm.seq += 1
+        if self._record is not None:
+            self._record.append([getattr(snapshot, name) for name in self._names])
+
+    def to_dict(self, snapshot):
+        return {name: getattr(snapshot, name) for name, _ in self._type._fields_[1:]}
+
+
+class CommandBlock():
+    # double buffered: the writer fills the idle slot and flips the index once it is complete,
+    # so a mode never pairs with the targets of another command
+    def __init__(self, shm, record=None):
+        self._shm = shm
+        self._record = record
+        self._names = [name for name, _ in CommandState._fields_]
+
+    def read(self):
+        shm = self._shm
+        while True:
+            index = shm.index
+            snapshot = CommandState.from_buffer_copy(shm.slots[index & 1])
+            # the writer only touches this slot again after the next flip
+            if shm.index == index:
+                return snapshot
+
+    def publish(self, snapshot):
+        shm = self._shm
+        index = shm.index + 1
+        ctypes.memmove(ctypes.addressof(shm.slots[index & 1]), ctypes.addressof(snapshot), ctypes.sizeof(CommandState))
+        shm.index = index
+        if self._record is not None:
+            self._record.append([getattr(snapshot, name) for name in self._names])
+
+    def to_dict(self, snapshot):
+        return {name: getattr(snapshot, name) for name, _ in CommandState._fields_}
+
+
+def request_state(command, mode):
+    setattr(command, 'state_{}'.format(command.state_seq % STATE_DEPTH), mode)
+    command.state_seq += 1
+
+
+def state_requests(command, state_seq_z1):
+    # the state requests published after state_seq_z1, oldest first, a ring overrun keeps the newest STATE_DEPTH
+    count = (command.state_seq - state_seq_z1) & 0xffffffff
+    return [getattr(command, 'state_{}'.format(n % STATE_DEPTH))
+            for n in range(command.state_seq - min(count, STATE_DEPTH), command.state_seq)]
+
+
+SECTION_FIELDS = {
+    'input': [name for name, _ in InputState._fields_[1:]],
+    'nucleo': [name for name, _ in NucleoState._fields_[1:]],
+    'odrive': [name for name, _ in OdriveState._fields_[1:]],
+    'command': [name for name, _ in CommandState._fields_],
+}
+
+
+class StateBus():
+    # one shared block for the whole stack, created before the workers are forked
+    # with a FlightRecorder every section write is also appended to the recorder's ring
+    def __init__(self, recorder=None):
+        records = recorder.sections if recorder is not None else {}
+        self._shm = RawValue(BusLayout)
+        self.input = Section(self._shm.input, InputState, records.get('input'))
+        self.nucleo = Section(self._shm.nucleo, NucleoState, records.get('nucleo'))
+        self.odrive = Section(self._shm.odrive, OdriveState, records.get('odrive'))
+        self.command = CommandBlock(self._shm.command, records.get('command'))
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import struct
+import time
+from device.mapped_file import create_mapped
+
+# one ring of spans per loop, merged into a Chrome trace on demand
+# the rings live in a memory-mapped file, so a dump works from a signal handler or from another process
+SPAN_NAMES = ('read', 'parse', 'handle', 'write', 'poll', 'command', 'control', 'console', 'wait', 'sleep')
+MAGIC = b'TLNE'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+TRACK_HEADER = struct.Struct('<QI16s')
+SPAN = struct.Struct('<ddI')
+_SPAN_ID = {name: i for i, name in enumerate(SPAN_NAMES)}
+
+
+class Track():
+    def __init__(self, mm, header_offset, ring_offset, capacity):
+        self._mm = mm
+        self._header = header_offset
+        self._ring = ring_offset
+        self._capacity = capacity
+        self._count = 0
+
+    def attach(self):
+        # the process that runs the loop, a forked worker only knows its pid once it runs
+        struct.pack_into('<I', self._mm, self._header + 8, os.getpid())
+
+    def begin(self):
+        return time.monotonic()
+
+    def end(self, name, time_begin):
+        time_end = time.monotonic()
+        count = self._count
+        SPAN.pack_into(self._mm, self._ring + (count % self._capacity) * SPAN.size,
+                       time_begin, time_end - time_begin, _SPAN_ID[name])
+        self._count = count + 1
+        struct.pack_into('<Q', self._mm, self._header, self._count)
+        return time_end
+
+
+class NullTrack():
+    # tracing disabled: two calls per span that do nothing
+    def attach(self):
+        pass
+
+    def begin(self):
+        return 0.0
+
+    def end(self, name, time_begin):
+        return 0.0
+
+
+NULL_TRACK = NullTrack()
+
+
+class Timeline():
+    def __init__(self, path, track_names, capacity=16384):
+        self.path = path
+        ring_offset = HEADER.size + len(track_names) * TRACK_HEADER.size
+        size = ring_offset + len(track_names) * capacity * SPAN.size
+        self._mm = create_mapped(path, size)
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, capacity, len(track_names))
+        self.tracks = {}
+        for i, name in enumerate(track_names):
+            header_offset = HEADER.size + i * TRACK_HEADER.size
+            TRACK_HEADER.pack_into(self._mm, header_offset, 0, os.getpid(), name.encode())
+            self.tracks[name] = Track(self._mm, header_offset, ring_offset + i * capacity * SPAN.size, capacity)
+
+    def close(self):
+        self._mm.close()
+
+
+def track_of(timeline, name):
+    return timeline.tracks[name] if timeline is not None else NULL_TRACK
+
+
+def to_chrome_trace(data):
+    # Chrome / Perfetto JSON: one complete event per span, a thread per loop, times in microseconds
+    magic, version, capacity, track_num = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a timeline file')
+    ring_offset = HEADER.size + track_num * TRACK_HEADER.size
+    events = []
+    for i in range(0, track_num):
+        count, pid, name = TRACK_HEADER.unpack_from(data, HEADER.size + i * TRACK_HEADER.size)
+        name = name.rstrip(b'\0').decode()
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'pid {}'.format(pid)}})
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': i, 'args': {'name': name}})
+        ring = ring_offset + i * capacity * SPAN.size
+        for n in range(max(0, count - capacity), count):
+            time_begin, duration, span_id = SPAN.unpack_from(data, ring + (n % capacity) * SPAN.size)
+            events.append({'name': SPAN_NAMES[span_id], 'ph': 'X', 'pid': pid, 'tid': i,
+                           'ts': time_begin * 1e6, 'dur': duration * 1e6})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def dump_chrome_trace(path, output):
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(output, 'w') as f:
+        json.dump(to_chrome_trace(data), f)
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ctypes
+from device.clock import RealClock
+from device.metrics import metric_of
+from multiprocessing import Process, Value
+
+
+class WatchdogMp():
+    def __init__(self, logger, period=0.01, deadline=0.2, clock=None, metrics=None):
+        self._logger = logger
+        self._clock = clock or RealClock()
+        self._m_overruns = metric_of(metrics, 'loop_overruns_total', 'loop="watchdog"')
+        self.is_run = Value(ctypes.c_bool, False)
+        self._period = period
+        self._deadline = deadline
+
+        # communication variables
+        self.heartbeat = Value(ctypes.c_double, self._clock.monotonic())
+        self.feed_ok = Value(ctypes.c_bool, True)
+
+        # statistics
+        self.cycle_time = Value(ctypes.c_double, 0.0)
+        self.cycle_time_max = Value(ctypes.c_double, 0.0)
+        self.miss_count = Value(ctypes.c_int, 0)
+        self.overrun_count = Value(ctypes.c_int, 0)
+
+    def start(self):
+        self.heartbeat.value = self._clock.monotonic()
+        self.is_run.value = True
+        self._p = Process(target=self._process, args=(), name='watchdog')
+        self._p.start()
+
+    def close(self):
+        self.is_run.value = False
+
+    def feed(self):
+        self.heartbeat.value = self._clock.monotonic()
+
+    def _process(self):
+        # the workers watch feed_ok and go IDLE on its falling edge
+        heartbeat_z1 = self.heartbeat.value
+        time_next = self._clock.monotonic()
+        try:
+            while self.is_run.value:
+                time_now = self._clock.monotonic()
+                heartbeat = self.heartbeat.value
+
+                # main loop cycle
+                if heartbeat != heartbeat_z1:
+                    cycle_time = heartbeat - heartbeat_z1
+                    self.cycle_time.value = cycle_time
+                    if cycle_time > self.cycle_time_max.value:
+                        self.cycle_time_max.value = cycle_time
+                    heartbeat_z1 = heartbeat
+
+                # deadline
+                if time_now - heartbeat > self._deadline:
+                    if self.feed_ok.value:
+                        self.feed_ok.value = False
+                        self.miss_count.value += 1
+                        self._logger.error('Main loop stalled for {:.3f} s, IDLE'.format(time_now - heartbeat))
+                elif not self.feed_ok.value:
+                    self.feed_ok.value = True
+                    self._logger.info('Main loop recovered')
+
+                # fixed rate, a late wakeup does not shift the following ones
+                time_next += self._period
+                if time_next > self._clock.monotonic():
+                    self._clock.sleep_until(time_next)
+                else:
+                    self.overrun_count.value += 1
+                    self._m_overruns.inc()
+                    time_next = self._clock.monotonic()
+        except:
+            self._logger.error('Close Watchdog Process')
+            self.is_run.value = False
@@ -0,0 +1,210 @@
+"""Inputs - the base of the listeners on other platforms.
+
+Where there is no evdev, a listener in a subprocess turns the
+native events into evdev style events and writes them to a pipe.
+
+"""
+
+# Copyright (c) 2016, 2018: Zeth
+# All rights reserved.
+#
+# BSD Licence
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+from __future__ import division
+
+import struct
+import time
+
+from .inputs import (WIN, CODES, EVENT_FORMAT, UnknownEventType,
+                     convert_timeval)
+
+
+class BaseListener(object):  # pylint: disable=useless-object-inheritance
+    """Loosely emulate Evdev keyboard behaviour on other platforms.
+    Listen (hook in Windows terminology) for key events then buffer
+    them in a pipe.
+    """
+
+    def __init__(self, pipe, events=None, codes=None):
+        self.pipe = pipe
+        self.events = events if events else []
+        self.codes = codes if codes else None
+        self.app = None
+        self.timeval = None
+        self.type_codes = CODES['type_codes']
+
+        self.install_handle_input()
+
+    def install_handle_input(self):
+        """Install the input handler."""
+        pass
+
+    def uninstall_handle_input(self):
+        """Un-install the input handler."""
+        pass
+
+    def __del__(self):
+        """Clean up when deleted."""
+        self.uninstall_handle_input()
+
+    @staticmethod
+    def get_timeval():
+        """Get the time in seconds and microseconds."""
+        return convert_timeval(time.time())
+
+    def update_timeval(self):
+        """Update the timeval with the current time."""
+        self.timeval = self.get_timeval()
+
+    def create_event_object(self,
+                            event_type,
+                            code,
+                            value,
+                            timeval=None):
+        """Create an evdev style structure."""
+        if not timeval:
+            self.update_timeval()
+            timeval = self.timeval
+        try:
+            event_code = self.type_codes[event_type]
+        except KeyError:
+            raise UnknownEventType(
+                "We don't know what kind of event a %s is." % event_type)
+
+        event = struct.pack(EVENT_FORMAT,
+                            timeval[0],
+                            timeval[1],
+                            event_code,
+                            code,
+                            value)
+        return event
+
+    def write_to_pipe(self, event_list):
+        """Send event back to the mouse object."""
+        self.pipe.send_bytes(b''.join(event_list))
+
+    def emulate_wheel(self, data, direction, timeval):
+        """Emulate rel values for the mouse wheel.
+
+        In evdev, a single click forwards of the mouse wheel is 1 and
+        a click back is -1. Windows uses 120 and -120. We floor divide
+        the Windows number by 120. This is fine for the digital scroll
+        wheels found on the vast majority of mice. It also works on
+        the analogue ball on the top of the Apple mouse.
+
+        What do the analogue scroll wheels found on 200 quid high end
+        gaming mice do? If the lowest unit is 120 then we are okay. If
+        they report changes of less than 120 units Windows, then this
+        might be an unacceptable loss of precision. Needless to say, I
+        don't have such a mouse to test one way or the other.
+
+        """
+        if direction == 'x':
+            code = 0x06
+        elif direction == 'z':
+            # Not enitely sure if this exists
+            code = 0x07
+        else:
+            code = 0x08
+
+        if WIN:
+            data = data // 120
+
+        return self.create_event_object(
+            "Relative",
+            code,
+            data,
+            timeval)
+
+    def emulate_rel(self, key_code, value, timeval):
+        """Emulate the relative changes of the mouse cursor."""
+        return self.create_event_object(
+            "Relative",
+            key_code,
+            value,
+            timeval)
+
+    def emulate_press(self, key_code, scan_code, value, timeval):
+        """Emulate a button press.
+
+        Currently supports 5 buttons.
+
+        The Microsoft documentation does not define what happens with
+        a mouse with more than five buttons, and I don't have such a
+        mouse.
+
+        From reading the Linux sources, I guess evdev can support up
+        to 255 buttons.
+
+        Therefore, I guess we could support more buttons quite easily,
+        if we had any useful hardware.
+        """
+        scan_event = self.create_event_object(
+            "Misc",
+            0x04,
+            scan_code,
+            timeval)
+        key_event = self.create_event_object(
+            "Key",
+            key_code,
+            value,
+            timeval)
+        return scan_event, key_event
+
+    def emulate_repeat(self, value, timeval):
+        """The repeat press of a key/mouse button, e.g. double click."""
+        repeat_event = self.create_event_object(
+            "Repeat",
+            2,
+            value,
+            timeval)
+        return repeat_event
+
+    def sync_marker(self, timeval):
+        """Separate groups of events."""
+        return self.create_event_object(
+            "Sync",
+            0,
+            0,
+            timeval)
+
+    def emulate_abs(self, x_val, y_val, timeval):
+        """Emulate the absolute co-ordinates of the mouse cursor."""
+        x_event = self.create_event_object(
+            "Absolute",
+            0x00,
+            x_val,
+            timeval)
+        y_event = self.create_event_object(
+            "Absolute",
+            0x01,
+            y_val,
+            timeval)
+        return x_event, y_event
@@ -0,0 +1,738 @@
+"""Inputs - the Mac backend.
+
+The Quartz and AppKit listeners and the Mac key codes. The inputs
+module imports it on first use.
+
+"""
+
+# Copyright (c) 2016, 2018: Zeth
+# All rights reserved.
+#
+# BSD Licence
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+from __future__ import division
+
+from .listener import BaseListener
+
+
+MAC_EVENT_CODES = (
+    # NSLeftMouseDown Quartz.kCGEventLeftMouseDown
+    (1, ("Key", 0x110, 1, 589825)),
+    # NSLeftMouseUp Quartz.kCGEventLeftMouseUp
+    (2, ("Key", 0x110, 0, 589825)),
+    # NSRightMouseDown Quartz.kCGEventRightMouseDown
+    (3, ("Key", 0x111, 1, 589826)),
+    # NSRightMouseUp Quartz.kCGEventRightMouseUp
+    (4, ("Key", 0x111, 0, 589826)),
+    (5, (None, 0, 0, 0)),    # NSMouseMoved Quartz.kCGEventMouseMoved
+    (6, (None, 0, 0, 0)),  # NSLeftMouseDragged Quartz.kCGEventLeftMouseDragged
+    # NSRightMouseDragged Quartz.kCGEventRightMouseDragged
+    (7, (None, 0, 0, 0)),
+    (8, (None, 0, 0, 0)),    # NSMouseEntered
+    (9, (None, 0, 0, 0)),    # NSMouseExited
+    (10, (None, 0, 0, 0)),   # NSKeyDown
+    (11, (None, 0, 0, 0)),   # NSKeyUp
+    (12, (None, 0, 0, 0)),   # NSFlagsChanged
+    (13, (None, 0, 0, 0)),   # NSAppKitDefined
+    (14, (None, 0, 0, 0)),   # NSSystemDefined
+    (15, (None, 0, 0, 0)),   # NSApplicationDefined
+    (16, (None, 0, 0, 0)),   # NSPeriodic
+    (17, (None, 0, 0, 0)),   # NSCursorUpdate
+    (22, (None, 0, 0, 0)),   # NSScrollWheel Quartz.kCGEventScrollWheel
+    (23, (None, 0, 0, 0)),   # NSTabletPoint Quartz.kCGEventTabletPointer
+    (24, (None, 0, 0, 0)),   # NSTabletProximity Quartz.kCGEventTabletProximity
+    (25, (None, 0, 0, 0)),   # NSOtherMouseDown Quartz.kCGEventOtherMouseDown
+    (25.2, ("Key", 0x112, 1, 589827)),   # BTN_MIDDLE
+    (25.3, ("Key", 0x113, 1, 589828)),   # BTN_SIDE
+    (25.4, ("Key", 0x114, 1, 589829)),   # BTN_EXTRA
+    (26, (None, 0, 0, 0)),   # NSOtherMouseUp Quartz.kCGEventOtherMouseUp
+    (26.2, ("Key", 0x112, 0, 589827)),   # BTN_MIDDLE
+    (26.3, ("Key", 0x113, 0, 589828)),   # BTN_SIDE
+    (26.4, ("Key", 0x114, 0, 589829)),   # BTN_EXTRA
+    (27, (None, 0, 0, 0)),   # NSOtherMouseDragged
+    (29, (None, 0, 0, 0)),   # NSEventTypeGesture
+    (30, (None, 0, 0, 0)),   # NSEventTypeMagnify
+    (31, (None, 0, 0, 0)),   # NSEventTypeSwipe
+    (18, (None, 0, 0, 0)),   # NSEventTypeRotate
+    (19, (None, 0, 0, 0)),   # NSEventTypeBeginGesture
+    (20, (None, 0, 0, 0)),   # NSEventTypeEndGesture
+    (27, (None, 0, 0, 0)),   # Quartz.kCGEventOtherMouseDragged
+    (32, (None, 0, 0, 0)),   # NSEventTypeSmartMagnify
+    (33, (None, 0, 0, 0)),   # NSEventTypeQuickLook
+    (34, (None, 0, 0, 0)),   # NSEventTypePressure
+)
+
+MAC_KEYS = (
+    (0x00, 30),  # kVK_ANSI_A
+    (0x01, 31),  # kVK_ANSI_S    (0x02, 32),  # kVK_ANSI_D
+    (0x03, 33),  # kVK_ANSI_F
+    (0x04, 35),  # kVK_ANSI_H
+    (0x05, 34),  # kVK_ANSI_G
+    (0x06, 44),  # kVK_ANSI_Z
+    (0x07, 45),  # kVK_ANSI_X
+    (0x08, 46),  # kVK_ANSI_C
+    (0x09, 47),  # kVK_ANSI_V
+    (0x0B, 48),  # kVK_ANSI_B
+    (0x0C, 16),  # kVK_ANSI_Q
+    (0x0D, 17),  # kVK_ANSI_W
+    (0x0E, 18),  # kVK_ANSI_E
+    (0x0F, 33),  # kVK_ANSI_R
+    (0x10, 21),  # kVK_ANSI_Y
+    (0x11, 20),  # kVK_ANSI_T
+    (0x12, 2),  # kVK_ANSI_1
+    (0x13, 3),  # kVK_ANSI_2
+    (0x14, 4),  # kVK_ANSI_3
+    (0x15, 5),  # kVK_ANSI_4
+    (0x16, 7),  # kVK_ANSI_6
+    (0x17, 6),  # kVK_ANSI_5
+    (0x18, 13),  # kVK_ANSI_Equal
+    (0x19, 10),  # kVK_ANSI_9
+    (0x1A, 8),  # kVK_ANSI_7
+    (0x1B, 12),  # kVK_ANSI_Minus
+    (0x1C, 9),  # kVK_ANSI_8
+    (0x1D, 11),  # kVK_ANSI_0
+    (0x1E, 27),  # kVK_ANSI_RightBracket
+    (0x1F, 24),  # kVK_ANSI_O
+    (0x20, 22),  # kVK_ANSI_U
+    (0x21, 26),  # kVK_ANSI_LeftBracket
+    (0x22, 23),  # kVK_ANSI_I
+    (0x23, 25),  # kVK_ANSI_P
+    (0x25, 38),  # kVK_ANSI_L
+    (0x26, 36),  # kVK_ANSI_J
+    (0x27, 40),  # kVK_ANSI_Quote
+    (0x28, 37),  # kVK_ANSI_K
+    (0x29, 39),  # kVK_ANSI_Semicolon
+    (0x2A, 43),  # kVK_ANSI_Backslash
+    (0x2B, 51),  # kVK_ANSI_Comma
+    (0x2C, 53),  # kVK_ANSI_Slash
+    (0x2D, 49),  # kVK_ANSI_N
+    (0x2E, 50),  # kVK_ANSI_M
+    (0x2F, 52),  # kVK_ANSI_Period
+    (0x32, 41),  # kVK_ANSI_Grave
+    (0x41, 83),  # kVK_ANSI_KeypadDecimal
+    (0x43, 55),  # kVK_ANSI_KeypadMultiply
+    (0x45, 78),  # kVK_ANSI_KeypadPlus
+    (0x47, 69),  # kVK_ANSI_KeypadClear
+    (0x4B, 98),  # kVK_ANSI_KeypadDivide
+    (0x4C, 96),  # kVK_ANSI_KeypadEnter
+    (0x4E, 74),  # kVK_ANSI_KeypadMinus
+    (0x51, 117),  # kVK_ANSI_KeypadEquals
+    (0x52, 82),  # kVK_ANSI_Keypad0
+    (0x53, 79),  # kVK_ANSI_Keypad1
+    (0x54, 80),  # kVK_ANSI_Keypad2
+    (0x55, 81),  # kVK_ANSI_Keypad3
+    (0x56, 75),  # kVK_ANSI_Keypad4
+    (0x57, 76),  # kVK_ANSI_Keypad5
+    (0x58, 77),  # kVK_ANSI_Keypad6
+    (0x59, 71),  # kVK_ANSI_Keypad7
+    (0x5B, 72),  # kVK_ANSI_Keypad8
+    (0x5C, 73),  # kVK_ANSI_Keypad9
+    (0x24, 28),  # kVK_Return
+    (0x30, 15),  # kVK_Tab
+    (0x31, 57),  # kVK_Space
+    (0x33, 111),  # kVK_Delete
+    (0x35, 1),  # kVK_Escape
+    (0x37, 125),  # kVK_Command
+    (0x38, 42),  # kVK_Shift
+    (0x39, 58),  # kVK_CapsLock
+    (0x3A, 56),  # kVK_Option
+    (0x3B, 29),  # kVK_Control
+    (0x3C, 54),  # kVK_RightShift
+    (0x3D, 100),  # kVK_RightOption
+    (0x3E, 126),  # kVK_RightControl
+    (0x36, 126),  # Right Meta
+    (0x3F, 0x1d0),  # kVK_Function
+    (0x40, 187),  # kVK_F17
+    (0x48, 115),  # kVK_VolumeUp
+    (0x49, 114),  # kVK_VolumeDown
+    (0x4A, 113),  # kVK_Mute
+    (0x4F, 188),  # kVK_F18
+    (0x50, 189),  # kVK_F19
+    (0x5A, 190),  # kVK_F20
+    (0x60, 63),  # kVK_F5
+    (0x61, 64),  # kVK_F6
+    (0x62, 65),  # kVK_F7
+    (0x63, 61),  # kVK_F3
+    (0x64, 66),  # kVK_F8
+    (0x65, 67),  # kVK_F9
+    (0x67, 87),  # kVK_F11
+    (0x69, 183),  # kVK_F13
+    (0x6A, 186),  # kVK_F16
+    (0x6B, 184),  # kVK_F14
+    (0x6D, 68),  # kVK_F10
+    (0x6F, 88),  # kVK_F12
+    (0x71, 185),  # kVK_F15
+    (0x72, 138),  # kVK_Help
+    (0x73, 102),  # kVK_Home
+    (0x74, 104),  # kVK_PageUp
+    (0x75, 111),  # kVK_ForwardDelete
+    (0x76, 62),  # kVK_F4
+    (0x77, 107),  # kVK_End
+    (0x78, 60),  # kVK_F2
+    (0x79, 109),  # kVK_PageDown
+    (0x7A, 59),  # kVK_F1
+    (0x7B, 105),  # kVK_LeftArrow
+    (0x7C, 106),  # kVK_RightArrow
+    (0x7D, 108),  # kVK_DownArrow
+    (0x7E, 103),  # kVK_UpArrow
+    (0x0A, 170),  # kVK_ISO_Section
+    (0x5D, 124),  # kVK_JIS_Yen
+    (0x5E, 92),  # kVK_JIS_Underscore
+    (0x5F, 95),  # kVK_JIS_KeypadComma
+    (0x66, 94),  # kVK_JIS_Eisu
+    (0x68, 90)   # kVK_JIS_Kana
+)
+
+
+# Evdev style paths for the Mac
+
+APPKIT_KB_PATH = "/dev/input/by-id/usb-AppKit_Keyboard-event-kbd"
+QUARTZ_MOUSE_PATH = "/dev/input/by-id/usb-Quartz_Mouse-event-mouse"
+APPKIT_MOUSE_PATH = "/dev/input/by-id/usb-AppKit_Mouse-event-mouse"
+
+
+class QuartzMouseBaseListener(BaseListener):
+    """Emulate evdev mouse behaviour on mac."""
+    def __init__(self, pipe):
+        super(QuartzMouseBaseListener, self).__init__(
+            pipe,
+            codes=dict(MAC_EVENT_CODES))
+        self.active = True
+        self.events = []
+
+    def _get_mouse_button_number(self, event):
+        """Get the mouse button number from an event."""
+        raise NotImplementedError
+
+    def _get_click_state(self, event):
+        """The click state from an event."""
+        raise NotImplementedError
+
+    def _get_scroll(self, event):
+        """The scroll values from an event."""
+        raise NotImplementedError
+
+    def _get_absolute(self, event):
+        """Get abolute cursor location."""
+        raise NotImplementedError
+
+    def _get_relative(self, event):
+        """Get the relative mouse movement."""
+        raise NotImplementedError
+
+    def handle_button(self, event, event_type):
+        """Convert the button information from quartz into evdev format."""
+        # 0 for left
+        # 1 for right
+        # 2 for middle/center
+        # 3 for side
+        mouse_button_number = self._get_mouse_button_number(event)
+
+        # Identify buttons 3,4,5
+        if event_type in (25, 26):
+            event_type = event_type + (mouse_button_number * 0.1)
+
+        # Add buttons to events
+        event_type_string, event_code, value, scan = self.codes[event_type]
+        if event_type_string == "Key":
+            scan_event, key_event = self.emulate_press(
+                event_code, scan, value, self.timeval)
+            self.events.append(scan_event)
+            self.events.append(key_event)
+
+        # doubleclick/n-click of button
+        click_state = self._get_click_state(event)
+
+        repeat = self.emulate_repeat(click_state, self.timeval)
+        self.events.append(repeat)
+
+    def handle_scrollwheel(self, event):
+        """Handle the scrollwheel (it is a ball on the mighty mouse)."""
+        # relative Scrollwheel
+        scroll_x, scroll_y = self._get_scroll(event)
+
+        if scroll_x:
+            self.events.append(
+                self.emulate_wheel(scroll_x, 'x', self.timeval))
+
+        if scroll_y:
+            self.events.append(
+                self.emulate_wheel(scroll_y, 'y', self.timeval))
+
+    def handle_absolute(self, event):
+        """Absolute mouse position on the screen."""
+        (x_val, y_val) = self._get_absolute(event)
+        x_event, y_event = self.emulate_abs(
+            int(x_val),
+            int(y_val),
+            self.timeval)
+        self.events.append(x_event)
+        self.events.append(y_event)
+
+    def handle_relative(self, event):
+        """Relative mouse movement."""
+        delta_x, delta_y = self._get_relative(event)
+        if delta_x:
+            self.events.append(
+                self.emulate_rel(0x00,
+                                 delta_x,
+                                 self.timeval))
+        if delta_y:
+            self.events.append(
+                self.emulate_rel(0x01,
+                                 delta_y,
+                                 self.timeval))
+
+    # pylint: disable=unused-argument
+    def handle_input(self, proxy, event_type, event, refcon):
+        """Handle an input event."""
+        self.update_timeval()
+        self.events = []
+
+        if event_type in (1, 2, 3, 4, 25, 26, 27):
+            self.handle_button(event, event_type)
+
+        if event_type == 22:
+            self.handle_scrollwheel(event)
+
+        # Add in the absolute position of the mouse cursor
+        self.handle_absolute(event)
+
+        # Add in the relative position of the mouse cursor
+        self.handle_relative(event)
+
+        # End with a sync marker
+        self.events.append(self.sync_marker(self.timeval))
+
+        # We are done
+        self.write_to_pipe(self.events)
+
+
+def quartz_mouse_process(pipe):
+    """Single subprocess for reading mouse events on Mac using newer Quartz."""
+    # Quartz only on the mac, so don't warn about Quartz
+    # pylint: disable=import-error
+    import Quartz
+    # pylint: disable=no-member
+
+    class QuartzMouseListener(QuartzMouseBaseListener):
+        """Loosely emulate Evdev mouse behaviour on the Macs.
+        Listen for key events then buffer them in a pipe.
+        """
+        def install_handle_input(self):
+            """Constants below listed at:
+            https://developer.apple.com/documentation/coregraphics/
+            cgeventtype?language=objc#topics
+            """
+            # Keep Mac Names to make it easy to find the documentation
+            # pylint: disable=invalid-name
+
+            NSMachPort = Quartz.CGEventTapCreate(
+                Quartz.kCGSessionEventTap,
+                Quartz.kCGHeadInsertEventTap,
+                Quartz.kCGEventTapOptionDefault,
+                Quartz.CGEventMaskBit(Quartz.kCGEventLeftMouseDown) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventLeftMouseUp) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventRightMouseDown) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventRightMouseUp) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventMouseMoved) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventLeftMouseDragged) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventRightMouseDragged) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventScrollWheel) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventTabletPointer) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventTabletProximity) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventOtherMouseDown) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventOtherMouseUp) |
+                Quartz.CGEventMaskBit(Quartz.kCGEventOtherMouseDragged),
+                self.handle_input,
+                None)
+
+            CFRunLoopSourceRef = Quartz.CFMachPortCreateRunLoopSource(
+                None,
+                NSMachPort,
+                0)
+            CFRunLoopRef = Quartz.CFRunLoopGetCurrent()
+            Quartz.CFRunLoopAddSource(
+                CFRunLoopRef,
+                CFRunLoopSourceRef,
+                Quartz.kCFRunLoopDefaultMode)
+            Quartz.CGEventTapEnable(
+                NSMachPort,
+                True)
+
+        def listen(self):
+            """Listen for quartz events."""
+            while self.active:
+                Quartz.CFRunLoopRunInMode(
+                    Quartz.kCFRunLoopDefaultMode, 5, False)
+
+        def uninstall_handle_input(self):
+            self.active = False
+
+        def _get_mouse_button_number(self, event):
+            """Get the mouse button number from an event."""
+            return Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGMouseEventButtonNumber)
+
+        def _get_click_state(self, event):
+            """The click state from an event."""
+            return Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGMouseEventClickState)
+
+        def _get_scroll(self, event):
+            """The scroll values from an event."""
+            scroll_y = Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGScrollWheelEventDeltaAxis1)
+            scroll_x = Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGScrollWheelEventDeltaAxis2)
+            return scroll_x, scroll_y
+
+        def _get_absolute(self, event):
+            """Get abolute cursor location."""
+            return Quartz.CGEventGetLocation(event)
+
+        def _get_relative(self, event):
+            """Get the relative mouse movement."""
+            delta_x = Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGMouseEventDeltaX)
+            delta_y = Quartz.CGEventGetIntegerValueField(
+                event, Quartz.kCGMouseEventDeltaY)
+            return delta_x, delta_y
+
+    mouse = QuartzMouseListener(pipe)
+    mouse.listen()
+
+
+class AppKitMouseBaseListener(BaseListener):
+    """Emulate evdev behaviour on the the Mac."""
+    def __init__(self, pipe, events=None):
+        super(AppKitMouseBaseListener, self).__init__(
+            pipe, events, codes=dict(MAC_EVENT_CODES))
+
+    @staticmethod
+    def _get_mouse_button_number(event):
+        """Get the button number."""
+        return event.buttonNumber()
+
+    @staticmethod
+    def _get_absolute(event):
+        """Get the absolute (pixel) location of the mouse cursor."""
+        return event.locationInWindow()
+
+    @staticmethod
+    def _get_event_type(event):
+        """Get the appkit event type of the event."""
+        return event.type()
+
+    @staticmethod
+    def _get_deltas(event):
+        """Get the changes from the appkit event."""
+        delta_x = round(event.deltaX())
+        delta_y = round(event.deltaY())
+        delta_z = round(event.deltaZ())
+        return delta_x, delta_y, delta_z
+
+    def handle_button(self, event, event_type):
+        """Handle mouse click."""
+        mouse_button_number = self._get_mouse_button_number(event)
+        # Identify buttons 3,4,5
+        if event_type in (25, 26):
+            event_type = event_type + (mouse_button_number * 0.1)
+        # Add buttons to events
+        event_type_name, event_code, value, scan = self.codes[event_type]
+        if event_type_name == "Key":
+            scan_event, key_event = self.emulate_press(
+                event_code, scan, value, self.timeval)
+            self.events.append(scan_event)
+            self.events.append(key_event)
+
+    def handle_absolute(self, event):
+        """Absolute mouse position on the screen."""
+        point = self._get_absolute(event)
+        x_pos = round(point.x)
+        y_pos = round(point.y)
+        x_event, y_event = self.emulate_abs(x_pos, y_pos, self.timeval)
+        self.events.append(x_event)
+        self.events.append(y_event)
+
+    def handle_scrollwheel(self, event):
+        """Make endev from appkit scroll wheel event."""
+        delta_x, delta_y, delta_z = self._get_deltas(event)
+        if delta_x:
+            self.events.append(
+                self.emulate_wheel(delta_x, 'x', self.timeval))
+        if delta_y:
+            self.events.append(
+                self.emulate_wheel(delta_y, 'y', self.timeval))
+        if delta_z:
+            self.events.append(
+                self.emulate_wheel(delta_z, 'z', self.timeval))
+
+    def handle_relative(self, event):
+        """Get the position of the mouse on the screen."""
+        delta_x, delta_y, delta_z = self._get_deltas(event)
+        if delta_x:
+            self.events.append(
+                self.emulate_rel(0x00,
+                                 delta_x,
+                                 self.timeval))
+        if delta_y:
+            self.events.append(
+                self.emulate_rel(0x01,
+                                 delta_y,
+                                 self.timeval))
+        if delta_z:
+            self.events.append(
+                self.emulate_rel(0x02,
+                                 delta_z,
+                                 self.timeval))
+
+    def handle_input(self, event):
+        """Process the mouse event."""
+        self.update_timeval()
+        self.events = []
+        code = self._get_event_type(event)
+
+        # Deal with buttons
+        self.handle_button(event, code)
+
+        # Mouse wheel
+        if code == 22:
+            self.handle_scrollwheel(event)
+        # Other relative mouse movements
+        else:
+            self.handle_relative(event)
+
+        # Add in the absolute position of the mouse cursor
+        self.handle_absolute(event)
+
+        # End with a sync marker
+        self.events.append(self.sync_marker(self.timeval))
+
+        # We are done
+        self.write_to_pipe(self.events)
+
+
+def appkit_mouse_process(pipe):
+    """Single subprocess for reading mouse events on Mac using older AppKit."""
+    # pylint: disable=import-error,too-many-locals
+
+    # Note Objective C does not support a Unix style fork.
+    # So these imports have to be inside the child subprocess since
+    # otherwise the child process cannot use them.
+
+    # pylint: disable=no-member, no-name-in-module
+    from Foundation import NSObject
+    from AppKit import NSApplication, NSApp
+    from Cocoa import (NSEvent, NSLeftMouseDownMask,
+                       NSLeftMouseUpMask, NSRightMouseDownMask,
+                       NSRightMouseUpMask, NSMouseMovedMask,
+                       NSLeftMouseDraggedMask,
+                       NSRightMouseDraggedMask, NSMouseEnteredMask,
+                       NSMouseExitedMask, NSScrollWheelMask,
+                       NSOtherMouseDownMask, NSOtherMouseUpMask)
+    from PyObjCTools import AppHelper
+    import objc
+
+    class MacMouseSetup(NSObject):
+        """Setup the handler."""
+        @objc.python_method
+        def init_with_handler(self, handler):
+            """
+            Init method that receives the write end of the pipe.
+            """
+            # ALWAYS call the super's designated initializer.
+            # Also, make sure to re-bind "self" just in case it
+            # returns something else!
+            # pylint: disable=self-cls-assignment
+            self = super(MacMouseSetup, self).init()
+            self.handler = handler
+            # Unlike Python's __init__, initializers MUST return self,
+            # because they are allowed to return any object!
+            return self
+
+        # pylint: disable=invalid-name, unused-argument
+        def applicationDidFinishLaunching_(self, notification):
+            """Bind the listen method as the handler for mouse events."""
+
+            mask = (NSLeftMouseDownMask | NSLeftMouseUpMask |
+                    NSRightMouseDownMask | NSRightMouseUpMask |
+                    NSMouseMovedMask | NSLeftMouseDraggedMask |
+                    NSRightMouseDraggedMask | NSScrollWheelMask |
+                    NSMouseEnteredMask | NSMouseExitedMask |
+                    NSOtherMouseDownMask | NSOtherMouseUpMask)
+            NSEvent.addGlobalMonitorForEventsMatchingMask_handler_(
+                mask, self.handler)
+
+    class MacMouseListener(AppKitMouseBaseListener):
+        """Loosely emulate Evdev mouse behaviour on the Macs.
+        Listen for key events then buffer them in a pipe.
+        """
+        def install_handle_input(self):
+            """Install the hook."""
+            self.app = NSApplication.sharedApplication()
+            # pylint: disable=no-member
+            delegate = MacMouseSetup.alloc().init_with_handler(
+                self.handle_input)
+            NSApp().setDelegate_(delegate)
+            AppHelper.runEventLoop()
+
+        def __del__(self):
+            """Stop the listener on deletion."""
+            AppHelper.stopEventLoop()
+
+    # pylint: disable=unused-variable
+    mouse = MacMouseListener(pipe, events=[])
+
+
+class AppKitKeyboardListener(BaseListener):
+    """Emulate an evdev keyboard on the Mac."""
+    def __init__(self, pipe):
+        super(AppKitKeyboardListener, self).__init__(
+            pipe, codes=dict(MAC_KEYS))
+
+    @staticmethod
+    def _get_event_key_code(event):
+        """Get the key code."""
+        return event.keyCode()
+
+    @staticmethod
+    def _get_event_type(event):
+        """Get the event type."""
+        return event.type()
+
+    @staticmethod
+    def _get_flag_value(event):
+        """Note, this may be able to be made more accurate,
+            i.e. handle two modifier keys at once."""
+        flags = event.modifierFlags()
+        if flags == 0x100:
+            value = 0
+        else:
+            value = 1
+        return value
+
+    def _get_key_value(self, event, event_type):
+        """Get the key value."""
+        if event_type == 10:
+            value = 1
+        elif event_type == 11:
+            value = 0
+        elif event_type == 12:
+            value = self._get_flag_value(event)
+        else:
+            value = -1
+        return value
+
+    def handle_input(self, event):
+        """Process they keyboard input."""
+        self.update_timeval()
+        self.events = []
+        code = self._get_event_key_code(event)
+
+        if code in self.codes:
+            new_code = self.codes[code]
+        else:
+            new_code = 0
+        event_type = self._get_event_type(event)
+        value = self._get_key_value(event, event_type)
+        scan_event, key_event = self.emulate_press(
+            new_code, code, value, self.timeval)
+
+        self.events.append(scan_event)
+        self.events.append(key_event)
+        # End with a sync marker
+        self.events.append(self.sync_marker(self.timeval))
+        # We are done
+        self.write_to_pipe(self.events)
+
+
+def mac_keyboard_process(pipe):
+    """Single subprocesses for reading keyboard on Mac."""
+    # pylint: disable=import-error,too-many-locals
+    # Note Objective C does not support a Unix style fork.
+    # So these imports have to be inside the child subprocess since
+    # otherwise the child process cannot use them.
+
+    # pylint: disable=no-member, no-name-in-module
+    from AppKit import NSApplication, NSApp
+    from Foundation import NSObject
+    from Cocoa import (NSEvent, NSKeyDownMask, NSKeyUpMask,
+                       NSFlagsChangedMask)
+    from PyObjCTools import AppHelper
+    import objc
+
+    class MacKeyboardSetup(NSObject):
+        """Setup the handler."""
+
+        @objc.python_method
+        def init_with_handler(self, handler):
+            """
+            Init method that receives the write end of the pipe.
+            """
+            # ALWAYS call the super's designated initializer.
+            # Also, make sure to re-bind "self" just in case it
+            # returns something else!
+
+            # pylint: disable=self-cls-assignment
+            self = super(MacKeyboardSetup, self).init()
+
+            self.handler = handler
+
+            # Unlike Python's __init__, initializers MUST return self,
+            # because they are allowed to return any object!
+            return self
+
+        # pylint: disable=invalid-name, unused-argument
+        def applicationDidFinishLaunching_(self, notification):
+            """Bind the handler to listen to keyboard events."""
+            mask = NSKeyDownMask | NSKeyUpMask | NSFlagsChangedMask
+            NSEvent.addGlobalMonitorForEventsMatchingMask_handler_(
+                mask, self.handler)
+
+    class MacKeyboardListener(AppKitKeyboardListener):
+        """Loosely emulate Evdev keyboard behaviour on the Mac.
+        Listen for key events then buffer them in a pipe.
+        """
+        def install_handle_input(self):
+            """Install the hook."""
+            self.app = NSApplication.sharedApplication()
+            # pylint: disable=no-member
+            delegate = MacKeyboardSetup.alloc().init_with_handler(
+                self.handle_input)
+            NSApp().setDelegate_(delegate)
+            AppHelper.runEventLoop()
+
+        def __del__(self):
+            """Stop the listener on deletion."""
+            AppHelper.stopEventLoop()
+
+    # pylint: disable=unused-variable
+    keyboard = MacKeyboardListener(pipe)
@@ -0,0 +1,668 @@
+"""Inputs - the Windows backend.
+
+The keyboard and mouse hooks, the XInput gamepad structures and the
+Windows key codes. The inputs module imports it on first use.
+
+"""
+
+# Copyright (c) 2016, 2018: Zeth
+# All rights reserved.
+#
+# BSD Licence
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function
+from __future__ import division
+
+import ctypes
+import time
+
+from .inputs import WIN
+from .listener import BaseListener
+
+
+if WIN:
+    # pylint: disable=wrong-import-position
+    import ctypes.wintypes
+    DWORD = ctypes.wintypes.DWORD
+    HANDLE = ctypes.wintypes.HANDLE
+    WPARAM = ctypes.wintypes.WPARAM
+    LPARAM = ctypes.wintypes.WPARAM
+    MSG = ctypes.wintypes.MSG
+else:
+    DWORD = ctypes.c_ulong
+    HANDLE = ctypes.c_void_p
+    WPARAM = ctypes.c_ulonglong
+    LPARAM = ctypes.c_ulonglong
+    MSG = ctypes.Structure
+
+
+XINPUT_MAPPING = (
+    (1, 0x11),
+    (2, 0x11),
+    (3, 0x10),
+    (4, 0x10),
+    (5, 0x13a),
+    (6, 0x13b),
+    (7, 0x13d),
+    (8, 0x13e),
+    (9, 0x136),
+    (10, 0x137),
+    (13, 0x130),
+    (14, 0x131),
+    (15, 0x134),
+    (16, 0x133),
+    (17, 0x11),
+    ('l_thumb_x', 0x00),
+    ('l_thumb_y', 0x01),
+    ('left_trigger', 0x02),
+    ('r_thumb_x', 0x03),
+    ('r_thumb_y', 0x04),
+    ('right_trigger', 0x05),
+)
+
+XINPUT_DLL_NAMES = (
+    "XInput1_4.dll",
+    "XInput9_1_0.dll",
+    "XInput1_3.dll",
+    "XInput1_2.dll",
+    "XInput1_1.dll"
+)
+
+XINPUT_ERROR_DEVICE_NOT_CONNECTED = 1167
+XINPUT_ERROR_SUCCESS = 0
+
+
+WIN_KEYBOARD_CODES = {
+    0x0100: 1,
+    0x0101: 0,
+    0x104: 1,
+    0x105: 0,
+}
+
+WIN_MOUSE_CODES = {
+    0x0201: (0x110, 1, 589825),   # WM_LBUTTONDOWN --> BTN_LEFT
+    0x0202: (0x110, 0, 589825),   # WM_LBUTTONUP   --> BTN_LEFT
+    0x0204: (0x111, 1, 589826),   # WM_RBUTTONDOWN --> BTN_RIGHT
+    0x0205: (0x111, 0, 589826),   # WM_RBUTTONUP   --> BTN_RIGHT
+    0x0207: (0x112, 1, 589827),   # WM_MBUTTONDOWN --> BTN_MIDDLE
+    0x0208: (0x112, 0, 589827),   # WM_MBUTTONU    --> BTN_MIDDLE
+    0x020B: (0x113, 1, 589828),   # WM_XBUTTONDOWN --> BTN_SIDE
+    0x020C: (0x113, 0, 589828),   # WM_XBUTTONUP   --> BTN_SIDE
+    0x020B2: (0x114, 1, 589829),  # WM_XBUTTONDOWN --> BTN_EXTRA
+    0x020C2: (0x114, 0, 589829),  # WM_XBUTTONUP   --> BTN_EXTRA
+}
+
+# THING SING That thing can sing!
+# SONG LONG A long, long song.
+# Good-bye, Thing. You sing too long.
+# pylint: disable=too-many-lines
+
+WINCODES = (
+    (0x01, 0x110),  # Left mouse button
+    (0x02, 0x111),  # Right mouse button
+    (0x03, 0),  # Control-break processing
+    (0x04, 0x112),  # Middle mouse button (three-button mouse)
+    (0x05, 0x113),  # X1 mouse button
+    (0x06, 0x114),  # X2 mouse button
+    (0x07, 0),  # Undefined
+    (0x08, 14),  # BACKSPACE key
+    (0x09, 15),  # TAB key
+    (0x0A, 0),  # Reserved
+    (0x0B, 0),  # Reserved
+    (0x0C, 0x163),  # CLEAR key
+    (0x0D, 28),  # ENTER key
+    (0x0E, 0),  # Undefined
+    (0x0F, 0),  # Undefined
+    (0x10, 42),  # SHIFT key
+    (0x11, 29),  # CTRL key
+    (0x12, 56),  # ALT key
+    (0x13, 119),  # PAUSE key
+    (0x14, 58),  # CAPS LOCK key
+    (0x15, 90),  # IME Kana mode
+    (0x15, 91),  # IME Hanguel mode (maintained for compatibility; use
+                 # VK_HANGUL)
+    (0x15, 91),  # IME Hangul mode
+    (0x16, 0),  # Undefined
+    (0x17, 92),  # IME Junja mode - These all need to be fixed
+    (0x18, 93),  # IME final mode - By someone who
+    (0x19, 94),  # IME Hanja mode - Knows how
+    (0x19, 95),  # IME Kanji mode - Japanese Keyboards work
+    (0x1A, 0),  # Undefined
+    (0x1B, 1),  # ESC key
+    (0x1C, 0),  # IME convert
+    (0x1D, 0),  # IME nonconvert
+    (0x1E, 0),  # IME accept
+    (0x1F, 0),  # IME mode change request
+    (0x20, 57),  # SPACEBAR
+    (0x21, 104),  # PAGE UP key
+    (0x22, 109),  # PAGE DOWN key
+    (0x23, 107),  # END key
+    (0x24, 102),  # HOME key
+    (0x25, 105),  # LEFT ARROW key
+    (0x26, 103),  # UP ARROW key
+    (0x27, 106),  # RIGHT ARROW key
+    (0x28, 108),  # DOWN ARROW key
+    (0x29, 0x161),  # SELECT key
+    (0x2A, 210),  # PRINT key
+    (0x2B, 28),  # EXECUTE key
+    (0x2C, 99),  # PRINT SCREEN key
+    (0x2D, 110),  # INS key
+    (0x2E, 111),  # DEL key
+    (0x2F, 138),  # HELP key
+    (0x30, 11),  # 0 key
+    (0x31, 2),  # 1 key
+    (0x32, 3),  # 2 key
+    (0x33, 4),  # 3 key
+    (0x34, 5),  # 4 key
+    (0x35, 6),  # 5 key
+    (0x36, 7),  # 6 key
+    (0x37, 8),  # 7 key
+    (0x38, 9),  # 8 key
+    (0x39, 10),  # 9 key
+    #  (0x3A-40, 0),  # Undefined
+    (0x41, 30),  # A key
+    (0x42, 48),  # B key
+    (0x43, 46),  # C key
+    (0x44, 32),  # D key
+    (0x45, 18),  # E key
+    (0x46, 33),  # F key
+    (0x47, 34),  # G key
+    (0x48, 35),  # H key
+    (0x49, 23),  # I key
+    (0x4A, 36),  # J key
+    (0x4B, 37),  # K key
+    (0x4C, 38),  # L key
+    (0x4D, 50),  # M key
+    (0x4E, 49),  # N key
+    (0x4F, 24),  # O key
+    (0x50, 25),  # P key
+    (0x51, 16),  # Q key
+    (0x52, 19),  # R key
+    (0x53, 31),  # S key
+    (0x54, 20),  # T key
+    (0x55, 22),  # U key
+    (0x56, 47),  # V key
+    (0x57, 17),  # W key
+    (0x58, 45),  # X key
+    (0x59, 21),  # Y key
+    (0x5A, 44),  # Z key
+    (0x5B, 125),  # Left Windows key (Natural keyboard)
+    (0x5C, 126),  # Right Windows key (Natural keyboard)
+    (0x5D, 139),  # Applications key (Natural keyboard)
+    (0x5E, 0),  # Reserved
+    (0x5F, 142),  # Computer Sleep key
+    (0x60, 82),  # Numeric keypad 0 key
+    (0x61, 79),  # Numeric keypad 1 key
+    (0x62, 80),  # Numeric keypad 2 key
+    (0x63, 81),  # Numeric keypad 3 key
+    (0x64, 75),  # Numeric keypad 4 key
+    (0x65, 76),  # Numeric keypad 5 key
+    (0x66, 77),  # Numeric keypad 6 key
+    (0x67, 71),  # Numeric keypad 7 key
+    (0x68, 72),  # Numeric keypad 8 key
+    (0x69, 73),  # Numeric keypad 9 key
+    (0x6A, 55),  # Multiply key
+    (0x6B, 78),  # Add key
+    (0x6C, 96),  # Separator key
+    (0x6D, 74),  # Subtract key
+    (0x6E, 83),  # Decimal key
+    (0x6F, 98),  # Divide key
+    (0x70, 59),  # F1 key
+    (0x71, 60),  # F2 key
+    (0x72, 61),  # F3 key
+    (0x73, 62),  # F4 key
+    (0x74, 63),  # F5 key
+    (0x75, 64),  # F6 key
+    (0x76, 65),  # F7 key
+    (0x77, 66),  # F8 key
+    (0x78, 67),  # F9 key
+    (0x79, 68),  # F10 key
+    (0x7A, 87),  # F11 key
+    (0x7B, 88),  # F12 key
+    (0x7C, 183),  # F13 key
+    (0x7D, 184),  # F14 key
+    (0x7E, 185),  # F15 key
+    (0x7F, 186),  # F16 key
+    (0x80, 187),  # F17 key
+    (0x81, 188),  # F18 key
+    (0x82, 189),  # F19 key
+    (0x83, 190),  # F20 key
+    (0x84, 191),  # F21 key
+    (0x85, 192),  # F22 key
+    (0x86, 192),  # F23 key
+    (0x87, 194),  # F24 key
+    #  (0x88-8F, 0),  # Unassigned
+    (0x90, 69),  # NUM LOCK key
+    (0x91, 70),  # SCROLL LOCK key
+    #  (0x92-96, 0),  # OEM specific
+    #  (0x97-9F, 0),  # Unassigned
+    (0xA0, 42),  # Left SHIFT key
+    (0xA1, 54),  # Right SHIFT key
+    (0xA2, 29),  # Left CONTROL key
+    (0xA3, 97),  # Right CONTROL key
+    (0xA4, 125),  # Left MENU key
+    (0xA5, 126),  # Right MENU key
+    (0xA6, 158),  # Browser Back key
+    (0xA7, 159),  # Browser Forward key
+    (0xA8, 173),  # Browser Refresh key
+    (0xA9, 128),  # Browser Stop key
+    (0xAA, 217),  # Browser Search key
+    (0xAB, 0x16c),  # Browser Favorites key
+    (0xAC, 150),  # Browser Start and Home key
+    (0xAD, 113),  # Volume Mute key
+    (0xAE, 114),  # Volume Down key
+    (0xAF, 115),  # Volume Up key
+    (0xB0, 163),  # Next Track key
+    (0xB1, 165),  # Previous Track key
+    (0xB2, 166),  # Stop Media key
+    (0xB3, 164),  # Play/Pause Media key
+    (0xB4, 155),  # Start Mail key
+    (0xB5, 0x161),  # Select Media key
+    (0xB6, 148),  # Start Application 1 key
+    (0xB7, 149),  # Start Application 2 key
+    #  (0xB8-B9, 0),  # Reserved
+    (0xBA, 39),  # Used for miscellaneous characters; it can vary by keyboard.
+    (0xBB, 13),  # For any country/region, the '+' key
+    (0xBC, 51),  # For any country/region, the ',' key
+    (0xBD, 12),  # For any country/region, the '-' key
+    (0xBE, 52),  # For any country/region, the '.' key
+    (0xBF, 53),  # Slash
+    (0xC0, 40),  # Apostrophe
+    #  (0xC1-D7, 0),  # Reserved
+    #  (0xD8-DA, 0),  # Unassigned
+    (0xDB, 26),  # [
+    (0xDC, 86),  # \
+    (0xDD, 27),  # ]
+    (0xDE, 43),  # '
+    (0xDF, 119),  # VK_OFF - What's that?
+    (0xE0, 0),  # Reserved
+    (0xE1, 0),  # OEM Specific
+    (0xE2, 43),  # Either the angle bracket key or the backslash key
+                 # on the RT 102-key keyboard (0xE3-E4, 0), # OEM
+                 # specific
+    (0xE5, 0),  # IME PROCESS key
+    (0xE6, 0),  # OEM specific
+    (0xE7, 0),  # Used to pass Unicode characters as if they were
+                # keystrokes. The VK_PACKET key is the low word of a
+                # 32-bit Virtual Key value used for non-keyboard input
+                # methods. For more information, see Remark in
+                # KEYBDINPUT, SendInput, WM_KEYDOWN, and WM_KEYUP
+    (0xE8, 0),  # Unassigned
+    #  (0xE9-F5, 0),  # OEM specific
+    (0xF6, 0),  # Attn key
+    (0xF7, 0),  # CrSel key
+    (0xF8, 0),  # ExSel key
+    (0xF9, 222),  # Erase EOF key
+    (0xFA, 207),  # Play key
+    (0xFB, 0x174),  # Zoom key
+    (0xFC, 0),  # Reserved
+    (0xFD, 0x19b),  # PA1 key
+    (0xFE, 0x163),   # Clear key
+    (0xFF, 185)
+)
+
+
+# Now comes all the structs we need to parse the infomation coming
+# from Windows.
+
+
+class KBDLLHookStruct(ctypes.Structure):
+    """Contains information about a low-level keyboard input event.
+
+    For full details see Microsoft's documentation:
+
+    https://msdn.microsoft.com/en-us/library/windows/desktop/
+    ms644967%28v=vs.85%29.aspx
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [("vk_code", DWORD),
+                ("scan_code", DWORD),
+                ("flags", DWORD),
+                ("time", ctypes.c_int)]
+
+
+class MSLLHookStruct(ctypes.Structure):
+    """Contains information about a low-level mouse input event.
+
+    For full details see Microsoft's documentation:
+
+    https://msdn.microsoft.com/en-us/library/windows/desktop/
+    ms644970%28v=vs.85%29.aspx
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [("x_pos", ctypes.c_long),
+                ("y_pos", ctypes.c_long),
+                ('reserved', ctypes.c_short),
+                ('mousedata', ctypes.c_short),
+                ("flags", DWORD),
+                ("time", DWORD),
+                ("extrainfo", ctypes.c_ulong)]
+
+
+class XinputGamepad(ctypes.Structure):
+    """Describes the current state of the Xbox 360 Controller.
+
+    For full details see Microsoft's documentation:
+
+    https://msdn.microsoft.com/en-us/library/windows/desktop/
+    microsoft.directx_sdk.reference.xinput_gamepad%28v=vs.85%29.aspx
+
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [
+        ('buttons', ctypes.c_ushort),  # wButtons
+        ('left_trigger', ctypes.c_ubyte),  # bLeftTrigger
+        ('right_trigger', ctypes.c_ubyte),  # bLeftTrigger
+        ('l_thumb_x', ctypes.c_short),  # sThumbLX
+        ('l_thumb_y', ctypes.c_short),  # sThumbLY
+        ('r_thumb_x', ctypes.c_short),  # sThumbRx
+        ('r_thumb_y', ctypes.c_short),  # sThumbRy
+    ]
+
+
+class XinputState(ctypes.Structure):
+    """Represents the state of a controller.
+
+    For full details see Microsoft's documentation:
+
+    https://msdn.microsoft.com/en-us/library/windows/desktop/
+    microsoft.directx_sdk.reference.xinput_state%28v=vs.85%29.aspx
+
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [
+        ('packet_number', ctypes.c_ulong),  # dwPacketNumber
+        ('gamepad', XinputGamepad),  # Gamepad
+    ]
+
+
+class XinputVibration(ctypes.Structure):
+    """Specifies motor speed levels for the vibration function of a
+    controller.
+
+    For full details see Microsoft's documentation:
+
+    https://msdn.microsoft.com/en-us/library/windows/desktop/
+    microsoft.directx_sdk.reference.xinput_vibration%28v=vs.85%29.aspx
+
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [("wLeftMotorSpeed", ctypes.c_ushort),
+                ("wRightMotorSpeed", ctypes.c_ushort)]
+
+
+class WindowsKeyboardListener(BaseListener):
+    """Loosely emulate Evdev keyboard behaviour on Windows.  Listen (hook
+    in Windows terminology) for key events then buffer them in a pipe.
+    """
+    def __init__(self, pipe, codes=None):
+        self.pipe = pipe
+        self.hooked = None
+        self.pointer = None
+        super(WindowsKeyboardListener, self).__init__(pipe, codes)
+
+    @staticmethod
+    def listen():
+        """Listen for keyboard input."""
+        msg = MSG()
+        ctypes.windll.user32.GetMessageA(ctypes.byref(msg), 0, 0, 0)
+
+    def get_fptr(self):
+        """Get the function pointer."""
+        cmpfunc = ctypes.CFUNCTYPE(ctypes.c_int,
+                                   WPARAM,
+                                   LPARAM,
+                                   ctypes.POINTER(KBDLLHookStruct))
+        return cmpfunc(self.handle_input)
+
+    def install_handle_input(self):
+        """Install the hook."""
+        self.pointer = self.get_fptr()
+
+        self.hooked = ctypes.windll.user32.SetWindowsHookExA(
+            13,
+            self.pointer,
+            ctypes.windll.kernel32.GetModuleHandleW(None),
+            0
+        )
+        if not self.hooked:
+            return False
+        return True
+
+    def uninstall_handle_input(self):
+        """Remove the hook."""
+        if self.hooked is None:
+            return
+        ctypes.windll.user32.UnhookWindowsHookEx(self.hooked)
+        self.hooked = None
+
+    def handle_input(self, ncode, wparam, lparam):
+        """Process the key input."""
+        value = WIN_KEYBOARD_CODES[wparam]
+        scan_code = lparam.contents.scan_code
+        vk_code = lparam.contents.vk_code
+        self.update_timeval()
+
+        events = []
+        # Add key event
+        scan_key, key_event = self.emulate_press(
+            vk_code, scan_code, value, self.timeval)
+        events.append(scan_key)
+        events.append(key_event)
+
+        # End with a sync marker
+        events.append(self.sync_marker(self.timeval))
+
+        # We are done
+        self.write_to_pipe(events)
+
+        return ctypes.windll.user32.CallNextHookEx(
+            self.hooked, ncode, wparam, lparam)
+
+
+def keyboard_process(pipe):
+    """Single subprocess for reading keyboard events on Windows."""
+    keyboard = WindowsKeyboardListener(pipe)
+    keyboard.listen()
+
+
+class WindowsMouseListener(BaseListener):
+    """Loosely emulate Evdev mouse behaviour on Windows.  Listen (hook
+    in Windows terminology) for key events then buffer them in a pipe.
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.hooked = None
+        self.pointer = None
+        self.mouse_codes = WIN_MOUSE_CODES
+        super(WindowsMouseListener, self).__init__(pipe)
+
+    @staticmethod
+    def listen():
+        """Listen for mouse input."""
+        msg = MSG()
+        ctypes.windll.user32.GetMessageA(ctypes.byref(msg), 0, 0, 0)
+
+    def get_fptr(self):
+        """Get the function pointer."""
+        cmpfunc = ctypes.CFUNCTYPE(ctypes.c_int,
+                                   WPARAM,
+                                   LPARAM,
+                                   ctypes.POINTER(MSLLHookStruct))
+        return cmpfunc(self.handle_input)
+
+    def install_handle_input(self):
+        """Install the hook."""
+        self.pointer = self.get_fptr()
+
+        self.hooked = ctypes.windll.user32.SetWindowsHookExA(
+            14,
+            self.pointer,
+            ctypes.windll.kernel32.GetModuleHandleW(None),
+            0
+        )
+        if not self.hooked:
+            return False
+        return True
+
+    def uninstall_handle_input(self):
+        """Remove the hook."""
+        if self.hooked is None:
+            return
+        ctypes.windll.user32.UnhookWindowsHookEx(self.hooked)
+        self.hooked = None
+
+    def handle_input(self, ncode, wparam, lparam):
+        """Process the key input."""
+        x_pos = lparam.contents.x_pos
+        y_pos = lparam.contents.y_pos
+        data = lparam.contents.mousedata
+
+        # This is how we can distinguish mouse 1 from mouse 2
+        # extrainfo = lparam.contents.extrainfo
+        # The way windows seems to do it is there is primary mouse
+        # and all other mouses report as mouse 2
+
+        # Also useful later will be to support the flags field
+        # flags = lparam.contents.flags
+        # This shows if the event was from a real device or whether it
+        # was injected somehow via software
+
+        self.emulate_mouse(wparam, x_pos, y_pos, data)
+
+        # Give back control to Windows to wait for and process the
+        # next event
+        return ctypes.windll.user32.CallNextHookEx(
+            self.hooked, ncode, wparam, lparam)
+
+    def emulate_mouse(self, key_code, x_val, y_val, data):
+        """Emulate the ev codes using the data Windows has given us.
+
+        Note that by default in Windows, to recognise a double click,
+        you just notice two clicks in a row within a reasonablely
+        short time period.
+
+        However, if the application developer sets the application
+        window's class style to CS_DBLCLKS, the operating system will
+        notice the four button events (down, up, down, up), intercept
+        them and then send a single key code instead.
+
+        There are no such special double click codes on other
+        platforms, so not obvious what to do with them. It might be
+        best to just convert them back to four events.
+
+        Currently we do nothing.
+
+        ((0x0203, 'WM_LBUTTONDBLCLK'),
+         (0x0206, 'WM_RBUTTONDBLCLK'),
+         (0x0209, 'WM_MBUTTONDBLCLK'),
+         (0x020D, 'WM_XBUTTONDBLCLK'))
+
+        """
+        # Once again ignore Windows' relative time (since system
+        # startup) and use the absolute time (since epoch i.e. 1st Jan
+        # 1970).
+        self.update_timeval()
+
+        events = []
+
+        if key_code == 0x0200:
+            # We have a mouse move alone.
+            # So just pass through to below
+            pass
+        elif key_code == 0x020A:
+            # We have a vertical mouse wheel turn
+            events.append(self.emulate_wheel(data, 'y', self.timeval))
+        elif key_code == 0x020E:
+            # We have a horizontal mouse wheel turn
+            # https://msdn.microsoft.com/en-us/library/windows/desktop/
+            # ms645614%28v=vs.85%29.aspx
+            events.append(self.emulate_wheel(data, 'x', self.timeval))
+        else:
+            # We have a button press.
+
+            # Distinguish the second extra button
+            if key_code == 0x020B and data == 2:
+                key_code = 0x020B2
+            elif key_code == 0x020C and data == 2:
+                key_code = 0x020C2
+
+            # Get the mouse codes
+            code, value, scan_code = self.mouse_codes[key_code]
+            # Add in the press events
+            scan_event, key_event = self.emulate_press(
+                code, scan_code, value, self.timeval)
+            events.append(scan_event)
+            events.append(key_event)
+
+        # Add in the absolute position of the mouse cursor
+        x_event, y_event = self.emulate_abs(x_val, y_val, self.timeval)
+        events.append(x_event)
+        events.append(y_event)
+
+        # End with a sync marker
+        events.append(self.sync_marker(self.timeval))
+
+        # We are done
+        self.write_to_pipe(events)
+
+
+def mouse_process(pipe):
+    """Single subprocess for reading mouse events on Windows."""
+    mouse = WindowsMouseListener(pipe)
+    mouse.listen()
+
+
+def delay_and_stop(duration, dll, device_number):
+    """Stop vibration aka force feedback aka rumble on
+    Windows after duration miliseconds."""
+    xinput = getattr(ctypes.windll, dll)
+    time.sleep(duration/1000)
+    xinput_set_state = xinput.XInputSetState
+    xinput_set_state.argtypes = [
+        ctypes.c_uint, ctypes.POINTER(XinputVibration)]
+    xinput_set_state.restype = ctypes.c_uint
+    vibration = XinputVibration(0, 0)
+    xinput_set_state(device_number, ctypes.byref(vibration))
+
+
+class RawInputDeviceList(ctypes.Structure):
+    """
+    Contains information about a raw input device.
+
+    For full details see Microsoft's documentation:
+
+    http://msdn.microsoft.com/en-us/library/windows/desktop/
+    ms645568(v=vs.85).aspx
+    """
+    # pylint: disable=too-few-public-methods
+    _fields_ = [
+        ("hDevice", HANDLE),
+        ("dwType", DWORD)
+    ]
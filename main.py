@@ -1,26 +1,44 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import datetime
 import json
 import logging
-import time
+import os
+import queue
+import selectors
+import signal
+import threading
 import yaml
+from device.clock import RealClock, make_clock
+from device.clock_loop import ClockEventLoop
+from device.flight_recorder import FlightRecorder
 from device.gamepad_mp import GamePadMp
+from device.latency_trace import LatencyTrace
+from device.log_queue import LogListener
+from device.mapped_file import prune
+from device.metrics import Metrics, metric_of
+from device.metrics_server import MetricsServer
 from device.odrive_mp import OdriveMp
+from device.sampling_profiler import SamplingProfiler
 from device.serial_mp import SerilaMp, Action_t
+from device.state_bus import StateBus, SECTION_FIELDS, request_state
+from device.timeline import NULL_TRACK, Timeline, dump_chrome_trace, track_of
+from device.watchdog_mp import WatchdogMp
 
 
-def set_logging(name, level=logging.INFO, stream=True, file=True, dir='log/', filetype='.log'):
+def set_logging(name, level=logging.INFO, stream=True, file=True, dir='log/', filetype='.log', queue_size=65536):
     logger = logging.getLogger(name)
     logger.setLevel(level)
+    handlers = []
 
     # StreamHandler
     if stream:
         formatter = logging.Formatter('[%(asctime)s] %(module)s.%(funcName)s %(levelname)s -> %(message)s')
         sh = logging.StreamHandler()
         sh.setFormatter(formatter)
-        logger.addHandler(sh)
+        handlers.append(sh)
 
     # FileHandler
     if file:
@@ -29,9 +47,126 @@ def set_logging(name, level=logging.INFO, stream=True, file=True, dir='log/', fi
         filename = dir + current_datetime.strftime('20%y%m%d_%H%M_') + name + filetype
         fh = logging.FileHandler(filename, )
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
 
-    return logger
+    # the logger is inherited by every worker process, they only enqueue and the listener does the I/O
+    log_listener = LogListener(handlers, queue_size=queue_size)
+    logger.addHandler(log_listener.handler)
+
+    return logger, log_listener
+
+
+def build_dispatch_table(mapping, actions):
+    # level: {evdev code: handler} on every cycle
+    # events: {(button event kind, evdev code or chord name): handler} once per event
+    level_table = {}
+    event_table = {}
+    for key, entry in mapping.items():
+        if entry['trigger'] == 'level':
+            level_table[int(key)] = actions[entry['action']]
+        elif entry['trigger'] == 'chord':
+            event_table[('chord', key)] = actions[entry['action']]
+        else:
+            event_table[(entry['trigger'], int(key))] = actions[entry['action']]
+    return level_table, event_table
+
+
+async def control_loop(loop, control_step, is_run, notifiers, period, track=NULL_TRACK):
+    # the asyncio runtime: same cycle as the selector loop, woken through the same notifiers
+    wake = asyncio.Event()
+
+    def wake_up(notifier):
+        notifier.clear()
+        wake.set()
+
+    for notifier in notifiers:
+        loop.add_reader(notifier.fileno(), wake_up, notifier)
+    while is_run():
+        control_step()
+        time_begin = track.begin()
+        try:
+            await asyncio.wait_for(wake.wait(), period)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+        track.end('wait', time_begin)
+    for notifier in notifiers:
+        loop.remove_reader(notifier.fileno())
+
+
+def build_control(cfg, bus, events, clock=None, trace=None):
+    # gamepad actions, collected in a local copy and published once per cycle
+    clock = clock or RealClock()
+    command = bus.command.read()
+
+    def set_mode(mode):
+        def handler(gp_value):
+            request_state(command, mode.value)
+        return handler
+
+    # the setpoint counters only move on a change, a worker then has nothing to do for an unchanged stick
+    def steering(gp_value):
+        if abs(gp_value) < 1024:
+            gp_value = 0
+        target_angle = gp_value / 32768.0 * 360.0 * 3.0
+        if command.nucleo_mode != Action_t.ACTION_VELOCITY_CTRL.value or command.nucleo_target_angle != target_angle:
+            command.nucleo_mode = Action_t.ACTION_VELOCITY_CTRL.value
+            command.nucleo_target_angle = target_angle
+            command.nucleo_seq += 1
+
+    def pedal(target_name):
+        def handler(gp_value):
+            target_angle = gp_value / 256.0 * 360.0
+            if command.odrive_mode != Action_t.ACTION_VELOCITY_CTRL.value \
+                    or getattr(command, target_name) != target_angle:
+                command.odrive_mode = Action_t.ACTION_VELOCITY_CTRL.value
+                setattr(command, target_name, target_angle)
+                command.odrive_seq += 1
+        return handler
+
+    level_table, event_table = build_dispatch_table(cfg['gamepad_actions'], {
+        'calibration': set_mode(Action_t.ACTION_CALIBRATION),
+        'closedloop': set_mode(Action_t.ACTION_CLOSEDLOOP),
+        'idle': set_mode(Action_t.ACTION_IDLE),
+        'steering': steering,
+        'pedal_0': pedal('odrive_target_angle_0'),
+        'pedal_1': pedal('odrive_target_angle_1')})
+
+    # z1
+    command_seq_z1 = (command.nucleo_seq, command.odrive_seq, command.state_seq)
+    gp_trace_z1 = bus.input.read().gp_trace
+
+    def control():
+        nonlocal command_seq_z1, gp_trace_z1
+
+        # action, a level handler only runs on new input
+        gp_data = bus.input.read()
+        if gp_data.gp_trace != gp_trace_z1 and gp_data.gp_code in level_table:
+            level_table[gp_data.gp_code](gp_data.gp_value)
+        gp_trace_z1 = gp_data.gp_trace
+
+        # button events, detected in the gamepad process however slow this loop runs
+        while True:
+            try:
+                kind, key, timestamp, duration = events.get_nowait()
+            except queue.Empty:
+                break
+            if (kind, key) in event_table:
+                event_table[(kind, key)](duration)
+
+        if (command.nucleo_seq, command.odrive_seq, command.state_seq) != command_seq_z1:
+            command_seq_z1 = (command.nucleo_seq, command.odrive_seq, command.state_seq)
+            if gp_data.gp_trace != command.trace_id:
+                # the first command published after an input event carries it to the workers
+                command.trace_id = gp_data.gp_trace
+                command.trace_time = gp_data.gp_time
+                command.trace_main_time = clock.time()
+                if trace is not None:
+                    trace.record('main', command.trace_main_time - gp_data.gp_bus_time)
+            bus.command.publish(command)
+        return gp_data
+
+    return control
 
 
 def main():
@@ -40,84 +175,172 @@ def main():
         ymlfile = open('config.yml')
         cfg = yaml.load(ymlfile)
         ymlfile.close()
+        if cfg['runtime'] == 'asyncio' and (cfg['nucleo_keepalive_interval'] <= 0 or cfg['odrive_watchdog_timeout'] <= 0):
+            # the IDLE on a missed deadline is written from the event loop that stalled, only the devices' own
+            # watchdogs still stop them in time
+            raise ValueError("runtime 'asyncio' needs nucleo_keepalive_interval and odrive_watchdog_timeout above 0")
 
         # logging setting
         if cfg['log_level'] == 'debug':
-            logger_main = set_logging('main', level=logging.DEBUG)
+            logger_main, log_listener = set_logging('main', level=logging.DEBUG, queue_size=cfg['log_queue_size'])
         else:
-            logger_main = set_logging('main')
+            logger_main, log_listener = set_logging('main', queue_size=cfg['log_queue_size'])
 
-        # instance setting
-        gamepad_mp = GamePadMp(logger_main)
+        # instance setting, the devices either run as processes or share this process' event loop
+        clock = make_clock(cfg['clock'], cfg['clock_factor'])
+        if cfg['runtime'] == 'asyncio':
+            loop = ClockEventLoop(clock)
+            asyncio.set_event_loop(loop)
+        else:
+            loop = None
+        # down to the second and with the pid, run.sh restarts within the minute and must not overwrite the files of
+        # the session that crashed
+        session = 'log/' + datetime.datetime.now().strftime('20%y%m%d_%H%M%S_') + '{}_'.format(os.getpid())
+        if cfg['recorder_capacity'] > 0:
+            recorder = FlightRecorder(
+                session + 'main.rec',
+                list(SECTION_FIELDS), capacity=cfg['recorder_capacity'], clock=clock)
+            logger_main.info('Flight recorder {}'.format(recorder.path))
+        else:
+            recorder = None
+        if cfg['latency_trace']:
+            trace = LatencyTrace(session + 'latency.hist')
+            logger_main.info('Latency trace {}'.format(trace.path))
+        else:
+            trace = None
+        if cfg['timeline_capacity'] > 0:
+            timeline = Timeline(session + 'timeline.bin',
+                                ['main', 'gamepad', 'nucleo', 'odrive'], capacity=cfg['timeline_capacity'])
+            logger_main.info('Timeline {}, kill -USR2 {} writes it as a Chrome trace'.format(timeline.path, os.getpid()))
+        else:
+            timeline = None
+        track = track_of(timeline, 'main')
+        track.attach()
+        if cfg['metrics']:
+            metrics = Metrics(session + 'metrics.bin')
+            metrics_server = MetricsServer(metrics, port=cfg['metrics_port']) if cfg['metrics_port'] > 0 else None
+            logger_main.info('Metrics {}{}'.format(
+                metrics.path, ', http://127.0.0.1:{}/metrics'.format(cfg['metrics_port']) if metrics_server else ''))
+        else:
+            metrics = metrics_server = None
+        for name in ('main.rec', 'latency.hist', 'timeline.bin', 'metrics.bin'):
+            for path in prune('log/*_' + name, cfg['log_keep_sessions']):
+                logger_main.info('Removed {}'.format(path))
+        m_cycle = metric_of(metrics, 'main_cycle_seconds')
+        m_overruns = metric_of(metrics, 'loop_overruns_total', 'loop="main"')
+        if cfg['profiler_interval'] > 0:
+            profiler = SamplingProfiler(session + 'profile',
+                                        interval=cfg['profiler_interval'], logger=logger_main)
+            profiler.install()
+            logger_main.info('Profiler: kill -USR1 <pid> starts and stops it in that process, pid {} is main'.format(
+                os.getpid()))
+        bus = StateBus(recorder)
+        watchdog_mp = WatchdogMp(logger_main, period=cfg['watchdog_period'], deadline=cfg['watchdog_deadline'],
+                                 clock=clock, metrics=metrics)
+        gamepad_mp = GamePadMp(logger_main, bus, chords=cfg['gamepad_chords'], long_press=cfg['gamepad_long_press'],
+                               loop=loop, clock=clock, trace=trace,
+                               timeline=timeline, metrics=metrics)
         odrive_mp = OdriveMp(
-            logger_main, port=cfg['odrive_port'], baud=cfg['odrive_baud'],
+            logger_main, bus, port=cfg['odrive_port'], baud=cfg['odrive_baud'],
             speed_lim=cfg['odrive_speed_lim'], current_lim=cfg['odrive_current_lim'],
-            calibration_current=cfg['odrive_calibration_current'])
-        serial_mp = SerilaMp(logger_main, port=cfg['nucleo_port'], baud=cfg['nucleo_baud'])
+            calibration_current=cfg['odrive_calibration_current'],
+            feedback_rate=cfg['odrive_feedback_rate'], feedback_depth=cfg['odrive_feedback_depth'],
+            save_config=cfg['odrive_save_config'],
+            persist_calibration=cfg['odrive_persist_calibration'],
+            resume_closedloop=cfg['odrive_resume_closedloop'],
+            protocol=cfg['odrive_protocol'], endpoint_cache=cfg['odrive_endpoint_cache'],
+            watchdog_timeout=cfg['odrive_watchdog_timeout'], feed_ok=watchdog_mp.feed_ok, loop=loop,
+            clock=clock, trace=trace, timeline=timeline, metrics=metrics)
+        serial_mp = SerilaMp(
+            logger_main, bus, port=cfg['nucleo_port'], baud=cfg['nucleo_baud'],
+            keepalive_interval=cfg['nucleo_keepalive_interval'], feed_ok=watchdog_mp.feed_ok, loop=loop,
+            clock=clock, trace=trace, timeline=timeline, metrics=metrics)
+        watchdog_mp.start()
+
+        # installed after the workers are forked, so only this process answers the signal
+        if timeline is not None:
+            def write_timeline(signum, frame):
+                # from a thread, the main loop keeps its cycle while the JSON is built
+                output = timeline.path.replace('.bin', '.json')
+                threading.Thread(target=dump_chrome_trace, args=(timeline.path, output), daemon=True).start()
+            signal.signal(signal.SIGUSR2, write_timeline)
         logger_main.debug('GamePad: {}'.format(gamepad_mp.is_run.value))
         logger_main.debug('Serial: {}'.format(serial_mp.is_run.value))
 
+        control = build_control(cfg, bus, gamepad_mp.events, clock=clock, trace=trace)
+
         # z1
-        console_time_z1 = time.time()
-        gp_data_z1 = False
+        console_time_z1 = clock.monotonic()
 
-        # main loop
-        while gamepad_mp.is_run.value and serial_mp.is_run.value and odrive_mp.is_run.value:
-            time_now = time.time()
-
-            # update sensors
-            gp_data = {'gp_code': hex(gamepad_mp.gp_code.value),
-                       'gp_value': gamepad_mp.gp_value.value}
-            rx_data = {'rx_stw_mode': serial_mp.rx_stw_mode.value,
-                       'rx_actual_angle_lpf': serial_mp.rx_actual_angle_lpf.value,
-                       'rx_target_angle_lpf': serial_mp.rx_target_angle_lpf.value,
-                       'rx_selector_switch': serial_mp.rx_selector_switch.value,
-                       'rx_actual_encoder_pos': serial_mp.rx_actual_encoder_pos.value,
-                       'rx_potentio_a_raw': serial_mp.rx_potentio_a_raw.value}
-
-            # action
-            if not gp_data_z1:
-                pass
-            elif gamepad_mp.is_up(gp_data, gp_data_z1, '0x13c'):
-                serial_mp.request_mode.value = Action_t.ACTION_CALIBRATION.value
-                odrive_mp.request_mode.value = Action_t.ACTION_CALIBRATION.value
-            elif gamepad_mp.is_up(gp_data, gp_data_z1, '0x13b'):
-                serial_mp.request_mode.value = Action_t.ACTION_CLOSEDLOOP.value
-                odrive_mp.request_mode.value = Action_t.ACTION_CLOSEDLOOP.value
-            elif gamepad_mp.is_up(gp_data, gp_data_z1, '0x13a'):
-                serial_mp.request_mode.value = Action_t.ACTION_IDLE.value
-                odrive_mp.request_mode.value = Action_t.ACTION_IDLE.value
-            elif gp_data['gp_code'] == '0x3':
-                serial_mp.request_mode.value = Action_t.ACTION_VELOCITY_CTRL.value
-                gp_value = float(gp_data['gp_value'])
-                if abs(gp_value) < 1024:
-                    gp_value = 0
-                serial_mp.target_angle.value = gp_value / 32768.0 * 360.0 * 3.0
-            elif gp_data['gp_code'] == '0x5':
-                odrive_mp.request_mode.value = Action_t.ACTION_VELOCITY_CTRL.value
-                odrive_mp.target_angle_0.value = float(gp_data['gp_value']) / 256.0 * 360.0
-            elif gp_data['gp_code'] == '0x2':
-                odrive_mp.request_mode.value = Action_t.ACTION_VELOCITY_CTRL.value
-                odrive_mp.target_angle_1.value = float(gp_data['gp_value']) / 256.0 * 360.0
+        def is_run():
+            return gamepad_mp.is_run.value and serial_mp.is_run.value and odrive_mp.is_run.value
+
+        def control_step():
+            nonlocal console_time_z1
+            time_begin = track.begin()
+            time_now = clock.monotonic()
+            watchdog_mp.feed()
+            gp_data = control()
+            time_begin = track.end('control', time_begin)
+            time_cycle = clock.monotonic() - time_now
+            m_cycle.observe(time_cycle)
+            if time_cycle > cfg['main_loop_period']:
+                m_overruns.inc()
 
             # debug console
             if time_now - console_time_z1 > cfg['debug_console_interval']:
                 console_time_z1 = time_now
-                logger_main.debug(json.dumps(gp_data))
+                gp_dict = bus.input.to_dict(gp_data)
+                gp_dict['gp_code'] = hex(gp_dict['gp_code'])
+                gp_dict['button_mask'] = hex(gp_dict['button_mask'])
+                rx_data = bus.nucleo.to_dict(bus.nucleo.read())
+                od_data = bus.odrive.to_dict(bus.odrive.read())
+                wd_data = {'cycle_time': watchdog_mp.cycle_time.value,
+                           'cycle_time_max': watchdog_mp.cycle_time_max.value,
+                           'miss_count': watchdog_mp.miss_count.value,
+                           'overrun_count': watchdog_mp.overrun_count.value,
+                           'log_dropped': log_listener.dropped.value}
+                logger_main.debug(json.dumps(gp_dict))
                 logger_main.debug(json.dumps(rx_data))
+                logger_main.debug(json.dumps(od_data))
+                logger_main.debug(json.dumps(wd_data))
                 logger_main.debug('\n')
+                track.end('console', time_begin)
 
-            # store z1
-            gp_data_z1 = gp_data
-
-            time.sleep(0.05)
+        # main loop
+        if loop is None:
+            # wake up on new gamepad or Nucleo data, at least every main_loop_period
+            selector = selectors.DefaultSelector()
+            selector.register(gamepad_mp.notifier, selectors.EVENT_READ)
+            selector.register(serial_mp.notifier, selectors.EVENT_READ)
+            while is_run():
+                control_step()
+                time_begin = track.begin()
+                for key, _ in selector.select(clock.to_real(cfg['main_loop_period'])):
+                    key.fileobj.clear()
+                track.end('wait', time_begin)
+        else:
+            loop.run_until_complete(control_loop(loop, control_step, is_run,
+                                                 [gamepad_mp.notifier, serial_mp.notifier], cfg['main_loop_period'], track))
     except KeyboardInterrupt:
         pass
 
+    watchdog_mp.close()
     gamepad_mp.close()
     odrive_mp.close()
     serial_mp.close()
+    if recorder is not None:
+        recorder.close()
+    if trace is not None:
+        trace.close()
+    if timeline is not None:
+        timeline.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    if metrics is not None:
+        metrics.close()
     logger_main.debug('End Program')
+    log_listener.close()
 
 
 if __name__ == '__main__':
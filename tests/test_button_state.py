@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from device.gamepad_mp import ButtonState
+
+BTN_SOUTH = 0x130
+BTN_EAST = 0x131
+BTN_START = 0x13b
+
+
+def test_chord_fires_on_the_edge_only():
+    state = ButtonState(chords={'reset': (BTN_SOUTH, BTN_EAST)}, long_press=0)
+    assert state.update(BTN_SOUTH, 1, 1.0) == [('press', BTN_SOUTH, 1.0, 0.0)]
+    assert state.update(BTN_EAST, 1, 1.1) == [('press', BTN_EAST, 1.1, 0.0), ('chord', 'reset', 1.1, 0.0)]
+    # still held, an autorepeat or another button does not fire it again
+    assert state.update(BTN_EAST, 2, 1.2) == []
+    assert state.update(BTN_START, 1, 1.3) == [('press', BTN_START, 1.3, 0.0)]
+    # released and pressed again is a new edge
+    assert state.update(BTN_EAST, 0, 1.4) == [('release', BTN_EAST, 1.4, 1.4 - 1.1)]
+    assert state.update(BTN_EAST, 1, 1.5) == [('press', BTN_EAST, 1.5, 0.0), ('chord', 'reset', 1.5, 0.0)]
+
+
+def test_long_press_expires_in_deadline_order_before_the_next_event():
+    state = ButtonState(long_press=1.0)
+    state.update(BTN_EAST, 1, 0.2)
+    state.update(BTN_SOUTH, 1, 0.0)
+    assert state.next_deadline() == 1.0
+    # both deadlines passed, they come first and stamped with the deadline, not the time of the next event
+    assert state.update(BTN_START, 1, 1.5) == [
+        ('long_press', BTN_SOUTH, 1.0, 1.0),
+        ('long_press', BTN_EAST, 1.2, 1.0),
+        ('press', BTN_START, 1.5, 0.0),
+    ]
+    assert state.next_deadline() == 2.5
+    # the release after a long press still reports the whole duration
+    assert state.update(BTN_SOUTH, 0, 1.6) == [('release', BTN_SOUTH, 1.6, 1.6)]
+
+
+def test_release_before_the_deadline_cancels_the_long_press():
+    state = ButtonState(long_press=1.0)
+    state.update(BTN_SOUTH, 1, 0.0)
+    assert state.expire(0.9) == []
+    state.update(BTN_SOUTH, 0, 0.5)
+    assert state.next_deadline() is None
+    assert state.expire(2.0) == []
+
+
+def test_autorepeat_is_not_a_press():
+    state = ButtonState(long_press=1.0)
+    state.update(BTN_SOUTH, 1, 0.0)
+    mask = state.mask
+    assert state.update(BTN_SOUTH, 2, 0.3) == []
+    assert state.update(BTN_SOUTH, 2, 0.6) == []
+    assert state.mask == mask
+    # the repeats neither move the deadline nor the press time
+    assert state.next_deadline() == 1.0
+    assert state.update(BTN_SOUTH, 0, 0.8) == [('release', BTN_SOUTH, 0.8, 0.8)]
+    # a release of a button that is not held is ignored
+    assert state.update(BTN_SOUTH, 0, 0.9) == []
+
+
+def test_release_all_after_syn_dropped():
+    state = ButtonState(chords={'reset': (BTN_SOUTH, BTN_EAST)}, long_press=1.0)
+    state.update(BTN_EAST, 1, 0.1)
+    state.update(BTN_SOUTH, 1, 0.2)
+    # every held button is released in press order, with nothing left to expire
+    assert state.release_all(0.5) == [('release', BTN_EAST, 0.5, 0.5 - 0.1), ('release', BTN_SOUTH, 0.5, 0.5 - 0.2)]
+    assert state.mask == 0
+    assert state.next_deadline() is None
+    assert state.expire(5.0) == []
+    assert state.release_all(0.6) == []
+    # the press that follows the resync is not mistaken for an autorepeat, and the chord edge is seen again
+    assert state.update(BTN_SOUTH, 1, 0.7) == [('press', BTN_SOUTH, 0.7, 0.0)]
+    assert state.update(BTN_EAST, 1, 0.8) == [('press', BTN_EAST, 0.8, 0.0), ('chord', 'reset', 0.8, 0.0)]
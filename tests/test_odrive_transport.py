@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import pytest
+import serial
+from device.odrive_transport import AsciiPipeline
+from tools.odrive_sim import OdriveSim
+
+
+@pytest.fixture
+def sim():
+    sim = OdriveSim()
+    sim.start()
+    yield sim
+    sim.close()
+
+
+@pytest.fixture
+def pipeline(sim):
+    ser = serial.Serial(sim.port, 115200, timeout=0.1)
+    yield AsciiPipeline(ser, timeout=0.2)
+    ser.close()
+
+
+def poll_until_idle(pipeline, timeout=1.0):
+    responses = []
+    time_end = time.time() + timeout
+    while pipeline.in_flight() and time.time() < time_end:
+        responses += pipeline.poll()
+        time.sleep(0.001)
+    return [(tag, value) for tag, value, _ in responses]
+
+
+def test_dropped_feedback_reply(sim, pipeline):
+    # the state reply does not fit the lost feedback request, which is dropped, the rest still match
+    sim.drop_replies['f'] = 1
+    pipeline.request_feedback(0, ('f', 0))
+    pipeline.request_property('axis0.current_state', ('state', 0))
+    pipeline.request_feedback(1, ('f', 1))
+    assert poll_until_idle(pipeline) == [(('state', 0), '1'), (('f', 1), (0.0, 0.0))]
+    assert pipeline.timeout_count == 1
+
+
+def test_dropped_property_reply(sim, pipeline):
+    sim.drop_replies['r'] = 1
+    pipeline.request_property('axis0.current_state', ('state', 0))
+    pipeline.request_feedback(0, ('f', 0))
+    pipeline.request_property('axis1.current_state', ('state', 1))
+    assert poll_until_idle(pipeline) == [(('f', 0), (0.0, 0.0)), (('state', 1), '1')]
+    assert pipeline.timeout_count == 1
+
+
+def test_timeout_clears_the_pipeline(sim, pipeline):
+    # nothing answers, the oldest request expires and takes everything behind it
+    sim.drop_replies['f'] = 2
+    pipeline.request_feedback(0, ('f', 0))
+    pipeline.request_feedback(1, ('f', 1))
+    assert poll_until_idle(pipeline, timeout=0.1) == []
+    assert pipeline.in_flight() == 2
+    assert poll_until_idle(pipeline) == []
+    assert pipeline.in_flight() == 0
+    assert pipeline.timeout_count == 2
+    # and the next request is matched again
+    pipeline.request_feedback(0, ('f', 0))
+    assert poll_until_idle(pipeline) == [(('f', 0), (0.0, 0.0))]
+    assert pipeline.timeout_count == 2
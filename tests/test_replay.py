@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import yaml
+from device.clock import SteppedClock
+from device.flight_recorder import FlightRecorder
+from device.state_bus import StateBus, SECTION_FIELDS
+from tools.replay import replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def record(path):
+    # 2 s at 100 Hz of telemetry, START pressed and released, then the stick and the right trigger moving
+    clock = SteppedClock(1000.0)
+    recorder = FlightRecorder(path, list(SECTION_FIELDS), capacity=4096, clock=clock)
+    bus = StateBus(recorder)
+    inputs = {10: (1, 0x13b, 1), 20: (1, 0x13b, 0)}
+    for n in range(30, 200, 5):
+        inputs[n] = (3, 0x03, (n * 500) % 32768) if n % 10 else (3, 0x05, n % 256)
+    trace = 0
+    for n in range(0, 200):
+        clock.advance_to(1000.0 + n * 0.01)
+        bus.nucleo.write(rx_stw_mode=5, rx_actual_angle_lpf=n * 0.1, rx_target_angle_lpf=n * 0.1, rx_time=clock.time())
+        bus.odrive.write(fb_pos_0=n * 10.0, fb_pos_1=n * 10.0, fb_state_0=8, fb_state_1=8)
+        if n in inputs:
+            trace += 1
+            gp_type, gp_code, gp_value = inputs[n]
+            bus.input.write(gp_type=gp_type, gp_code=gp_code, gp_value=gp_value, gp_time=clock.time(), gp_trace=trace,
+                            gp_bus_time=clock.time())
+    recorder.close()
+
+
+def test_replay_fast(tmp_path):
+    path = str(tmp_path / 'main.rec')
+    record(path)
+    with open(os.path.join(ROOT, 'config.yml')) as f:
+        cfg = yaml.safe_load(f)
+    logger = logging.getLogger('test_replay')
+    result = replay(path, cfg, True, logger)
+    assert result['records'] > 0
+    assert len(result['commands']) > 0
+    lines = [line for _, _, line in result['serial']]
+    # START is the closed loop request to both devices, the stick and the trigger move the setpoints
+    assert 'l' in lines
+    assert 'w axis0.requested_state 8' in lines
+    assert any(line.startswith('p,') for line in lines)
+    assert any(line.startswith('p 0 ') for line in lines)
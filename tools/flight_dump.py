@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import sys
+from device.flight_recorder import load
+from device.state_bus import SECTION_FIELDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a flight recorder file as CSV')
+    parser.add_argument('path')
+    parser.add_argument('--section', nargs='+', default=list(SECTION_FIELDS))
+    args = parser.parse_args()
+
+    header, records = load(args.path)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['time', 'section'] + ['value_{}'.format(i) for i in range(0, max(len(f) for f in SECTION_FIELDS.values()))])
+    for name in args.section:
+        writer.writerow(['#', name] + SECTION_FIELDS[name])
+    for time_mono, name, values in records:
+        if name in args.section:
+            # seconds since the recorder was opened
+            writer.writerow(['{:.6f}'.format(time_mono - header['time_mono']), name] + list(values))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import math
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+from device.gamepad_mp import GamePadMp
+from device.state_bus import StateBus
+from inputs.inputs import DeviceManager, EVENT_FORMAT, GamePad
+
+EVENT = struct.Struct(EVENT_FORMAT)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = (EV_SYN, 0x00, 0)
+SYN_DROPPED = (EV_SYN, 0x03, 0)
+# a write up to PIPE_BUF is never split, so a reader always gets whole input_event records like from evdev
+CHUNK_EVENTS = 4096 // EVENT.size
+DEVICE_PATH = '/dev/input/by-id/usb-GamePad_Sim-event-joystick'
+
+
+# scripted tracks, each returns the events of one frame at t seconds
+def stick_sweep(code=0x03, period=2.0, amplitude=32767):
+    def track(t):
+        return [(EV_ABS, code, int(amplitude * math.sin(2.0 * math.pi * t / period)))]
+    return track
+
+
+def trigger_ramp(code=0x05, period=1.0, maximum=255):
+    def track(t):
+        return [(EV_ABS, code, int(maximum * ((t / period) % 1.0)))]
+    return track
+
+
+def button_mash(codes=(0x130, 0x131), rate=20.0):
+    # press and release each button rate times per second, events only on a change like a real pad
+    state = {code: 0 for code in codes}
+
+    def track(t):
+        events = []
+        for n, code in enumerate(codes):
+            value = int(t * rate * 2.0 + n * 0.5) % 2
+            if value != state[code]:
+                state[code] = value
+                events.append((EV_KEY, code, value))
+        return events
+    return track
+
+
+SCRIPTS = {
+    'sweep': lambda: [stick_sweep(0x03)],
+    'ramp': lambda: [trigger_ramp(0x05), trigger_ramp(0x02, period=1.5)],
+    'mash': lambda: [button_mash()],
+}
+
+
+class SimGamePad(GamePad):
+    # a GamePad on the simulator's FIFO or socket instead of /dev/input/eventN, it has no sysfs entry
+    def __init__(self, manager, device_path=DEVICE_PATH, char_path_override=None, stream=None):
+        super().__init__(manager, device_path, char_path_override or device_path)
+        if stream is not None:
+            self._character_file = stream
+
+    def _set_name(self):
+        self.name = 'GamePad Simulator'
+
+
+class GamePadSim():
+    # llHHi event records at a set rate into a FIFO or a socketpair, 0 for as fast as the reader takes them
+    def __init__(self, tracks=None, rate=1000.0, dropped_every=0, transport='fifo'):
+        self.tracks = tracks or [stick_sweep(0x03), trigger_ramp(0x05), trigger_ramp(0x02, period=1.5), button_mash()]
+        self._rate = rate
+        self._dropped_every = dropped_every
+        self._frame_count = 0
+        self.is_run = False
+        self.written = 0
+        self.written_input = 0
+        self._pads = []
+        if transport == 'fifo':
+            self.path = os.path.join(tempfile.mkdtemp(), 'event-sim')
+            os.mkfifo(self.path)
+            self._sock = None
+        else:
+            self.path = None
+            self._sock, peer = socket.socketpair()
+            self._stream = peer.makefile('rb')
+            peer.close()
+
+    def plug(self, manager):
+        # first in the list, GamePadMp takes gamepads[0]
+        if self._sock is None:
+            pad = SimGamePad(manager, char_path_override=self.path)
+        else:
+            pad = SimGamePad(manager, stream=self._stream)
+        manager.gamepads.insert(0, pad)
+        manager._update_all_devices()
+        self._pads.append((manager, pad))
+        return pad
+
+    def unplug(self):
+        for manager, pad in self._pads:
+            manager.gamepads.remove(pad)
+            manager._update_all_devices()
+        self._pads = []
+
+    def frame(self, t):
+        events = []
+        if self._dropped_every and self._frame_count and self._frame_count % self._dropped_every == 0:
+            events.append(SYN_DROPPED)
+        for track in self.tracks:
+            events.extend(track(t))
+        events.append(SYN_REPORT)
+        self._frame_count += 1
+        return events
+
+    def encode(self, frames, frame_rate=1000.0):
+        # a whole recording at once, stamped as if the frames came at frame_rate
+        pack = EVENT.pack
+        data = []
+        for n in range(0, frames):
+            t = n / frame_rate
+            sec, usec = divmod(n * 1000000 // int(frame_rate), 1000000)
+            data.extend(pack(sec, usec, *event) for event in self.frame(t))
+        return b''.join(data)
+
+    def start(self):
+        self.is_run = True
+        self._th = threading.Thread(target=self._process, daemon=True)
+        self._th.start()
+
+    def close(self):
+        self.is_run = False
+        self.unplug()
+        if self._sock is not None:
+            self._sock.close()
+            self._stream.close()
+        elif os.path.exists(self.path):
+            os.unlink(self.path)
+            os.rmdir(os.path.dirname(self.path))
+
+    def _process(self):
+        # opening a FIFO for writing waits for the reader
+        fd = os.open(self.path, os.O_WRONLY) if self._sock is None else self._sock.fileno()
+        pack = EVENT.pack
+        time_start = time.monotonic()
+        try:
+            while self.is_run:
+                time_now = time.monotonic()
+                due = CHUNK_EVENTS if self._rate <= 0 else min(CHUNK_EVENTS, int((time_now - time_start) * self._rate) - self.written)
+                if due <= 0:
+                    time.sleep((self.written + 1) / self._rate - (time_now - time_start))
+                    continue
+                # the stamp of the kernel, taken when the frame is generated
+                stamp = time.time()
+                sec, usec = int(stamp), int(stamp % 1.0 * 1000000)
+                events = []
+                while len(events) < due:
+                    frame = self.frame(time_now - time_start)
+                    if len(events) + len(frame) > CHUNK_EVENTS:
+                        break
+                    events.extend(frame)
+                os.write(fd, b''.join(pack(sec, usec, *event) for event in events))
+                self.written += len(events)
+                self.written_input += sum(1 for event in events if event[0] != EV_SYN)
+        except OSError:
+            # the reader is gone
+            self.is_run = False
+        if self._sock is None:
+            os.close(fd)
+
+
+def drain(gamepad_mp, time_end):
+    count = 0
+    while time.time() < time_end:
+        try:
+            gamepad_mp.events.get(timeout=max(0.0, time_end - time.time()))
+            count += 1
+        except queue.Empty:
+            pass
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic evdev gamepad on a FIFO or socketpair, load test of GamePadMp')
+    parser.add_argument('--rate', type=float, default=100000.0, help='events per second, 0 for as fast as possible')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds')
+    parser.add_argument('--script', nargs='+', default=['sweep', 'ramp', 'mash'], choices=list(SCRIPTS))
+    parser.add_argument('--dropped-every', type=int, default=0, help='a SYN_DROPPED every n frames, 0 for none')
+    parser.add_argument('--transport', default='fifo', choices=['fifo', 'socketpair'])
+    args = parser.parse_args()
+
+    tracks = []
+    for name in args.script:
+        tracks.extend(SCRIPTS[name]())
+    logger = logging.getLogger('gamepad_sim')
+    logger.addHandler(logging.StreamHandler())
+    sim = GamePadSim(tracks, rate=args.rate, dropped_every=args.dropped_every, transport=args.transport)
+    devices = DeviceManager(kinds={'gamepad'})
+    sim.plug(devices)
+    bus = StateBus()
+    gamepad_mp = GamePadMp(logger, bus, devices=devices)
+    sim.start()
+    # the button events are taken like the main loop does, a full queue would stall the worker
+    button_events = drain(gamepad_mp, time.time() + args.duration)
+    written, written_input, handled = sim.written, sim.written_input, bus.input.read().gp_trace
+    gamepad_mp.is_run.value = False
+    while gamepad_mp._p.is_alive():
+        drain(gamepad_mp, time.time() + 0.1)
+    sim.close()
+    # GamePadMp skips the Sync events, the rest counts on the bus
+    print('written {:9.0f} events/s, {:9.0f} of them input  GamePadMp {:9.0f} input events/s  backlog {}  '
+          'button events {}'.format(written / args.duration, written_input / args.duration, handled / args.duration,
+                                    written_input - handled, button_events))
+
+
+if __name__ == '__main__':
+    main()
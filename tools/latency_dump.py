@@ -0,0 +1,25 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+from device.latency_trace import load, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print p50, p99 and max per stage of a latency trace file')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    stages = load(args.path)
+    print('{:14s} {:>9s} {:>10s} {:>10s} {:>10s} {:>10s}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'max ms'))
+    for name, (count, sum_us, max_us, buckets) in stages.items():
+        if count == 0:
+            print('{:14s} {:9d}'.format(name, 0))
+            continue
+        print('{:14s} {:9d} {:10.3f} {:10.3f} {:10.3f} {:10.3f}'.format(
+            name, count, sum_us / count / 1000.0, min(percentile(buckets, count, 50), max_us) / 1000.0,
+            min(percentile(buckets, count, 99), max_us) / 1000.0, max_us / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import ctypes
+import random
+import selectors
+import time
+from device.notifier import Notifier
+from multiprocessing import Process, Value
+
+
+def producer(stamp, notifier, is_run, interval):
+    # a device process publishing a new sample at random times
+    while is_run.value:
+        time.sleep(random.uniform(0.0, interval * 2.0))
+        stamp.value = time.time()
+        notifier.notify()
+
+
+def run(mode, duration, period, interval):
+    stamp = Value(ctypes.c_double, 0.0)
+    is_run = Value(ctypes.c_bool, True)
+    notifier = Notifier()
+    selector = selectors.DefaultSelector()
+    selector.register(notifier, selectors.EVENT_READ)
+    p = Process(target=producer, args=(stamp, notifier, is_run, interval))
+    p.start()
+
+    latency = []
+    wakeups = 0
+    stamp_z1 = 0.0
+    time_end = time.time() + duration
+    while time.time() < time_end:
+        value = stamp.value
+        if value != stamp_z1:
+            latency.append(time.time() - value)
+            stamp_z1 = value
+        wakeups += 1
+        if mode == 'sleep':
+            time.sleep(period)
+        else:
+            for key, _ in selector.select(period):
+                key.fileobj.clear()
+    is_run.value = False
+    p.join()
+    notifier.close()
+    return sorted(latency), wakeups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Input-to-main-loop latency, fixed sleep against selector wakeup')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per mode')
+    parser.add_argument('--period', type=float, default=0.05, help='main loop period [s]')
+    parser.add_argument('--interval', type=float, default=0.02, help='mean producer interval [s]')
+    args = parser.parse_args()
+
+    for mode in ('sleep', 'select'):
+        latency, wakeups = run(mode, args.duration, args.period, args.interval)
+        n = len(latency)
+        print('{:6s}: {:5d} samples  p50 {:7.3f} ms  p90 {:7.3f} ms  p99 {:7.3f} ms  max {:7.3f} ms  {:6.1f} wakeups/s'.format(
+            mode, n, latency[n // 2] * 1000.0, latency[n * 9 // 10] * 1000.0,
+            latency[min(n - 1, n * 99 // 100)] * 1000.0, latency[-1] * 1000.0, wakeups / args.duration))
+
+
+if __name__ == '__main__':
+    main()
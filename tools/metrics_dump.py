@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+from device.metrics import render
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a metrics file in the Prometheus text format, once')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as f:
+        sys.stdout.write(render(f.read()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import serial
+import time
+from device.odrive_transport import open_pipeline
+from tools.odrive_sim import OdriveSim
+
+
+def run_feedback(pipeline, depth, duration):
+    # depth counts feedback requests, the native protocol needs two packets for each
+    pipeline.rtt.clear()
+    count = 0
+    responses = 0
+    time_end = time.time() + duration
+    while time.time() < time_end:
+        while pipeline.in_flight() < depth * pipeline.feedback_requests:
+            pipeline.request_feedback(count % 2, ('f', count % 2))
+            count += 1
+        responses += len(pipeline.poll())
+    time_end = time.time() + 0.5
+    while pipeline.in_flight() and time.time() < time_end:
+        responses += len(pipeline.poll())
+    return responses
+
+
+def run_setpoint(pipeline, sim, duration):
+    rx_lines = sim.rx_lines
+    count = 0
+    time_start = time.time()
+    time_end = time_start + duration
+    while time.time() < time_end:
+        pipeline.set_pos_setpoint(count % 2, count * 0.1)
+        count += 1
+    # the simulator consumes what is still in the pty buffer
+    while sim.rx_lines - rx_lines < count:
+        time.sleep(0.001)
+    return count / (time.time() - time_start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ODrive setpoint throughput and feedback latency against the pty simulator')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per depth')
+    parser.add_argument('--delay', type=float, default=0.0, help='simulated link latency [s]')
+    parser.add_argument('--depth', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--protocol', nargs='+', default=['ascii', 'native'])
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench')
+    sim = OdriveSim(delay=args.delay)
+    sim.start()
+    for protocol in args.protocol:
+        ser = serial.Serial(sim.port, 115200, timeout=0.1)
+        pipeline = open_pipeline(ser, protocol, logger, cache_path='/tmp/odrive_endpoints_bench.json')
+        pipeline.rtt = type(pipeline.rtt)(maxlen=1000000)
+        print('{}: setpoint {:7.0f} cmd/s'.format(protocol, run_setpoint(pipeline, sim, args.duration)))
+        for depth in args.depth:
+            count = run_feedback(pipeline, depth, args.duration)
+            p = pipeline.rtt_percentiles((50, 90, 99))
+            print('{}: depth {:2d}: {:7.0f} resp/s  rtt p50 {:.3f} ms  p90 {:.3f} ms  p99 {:.3f} ms  timeouts {}'.format(
+                protocol, depth, count / args.duration,
+                p[50] * 1000.0, p[90] * 1000.0, p[99] * 1000.0, pipeline.timeout_count))
+        ser.close()
+    sim.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import select
+import struct
+import threading
+import time
+import tty
+from device.odrive_native import PROTOCOL_VERSION, SYNC_BYTE, calc_crc16, decode_frames, encode_frame
+
+
+class OdriveSim():
+    def __init__(self, delay=0.0, axis_num=2, calibration_time=4.0, index_search_time=0.5, fw_version_minor=5):
+        self._delay = delay
+        self._state_time = {3: calibration_time, 6: index_search_time}
+        self.is_run = False
+        self.rx_lines = 0
+        self.lock = threading.Lock()
+
+        # properties
+        self.props = {'fw_version_major': 0, 'fw_version_minor': fw_version_minor}
+        for i in range(0, axis_num):
+            self.props.update({
+                'axis{}.current_state'.format(i): 1,
+                'axis{}.requested_state'.format(i): 0,
+                'axis{}.error'.format(i): 0,
+                'axis{}.motor.error'.format(i): 0,
+                'axis{}.encoder.error'.format(i): 0,
+                'axis{}.controller.error'.format(i): 0,
+                'axis{}.config.watchdog_timeout'.format(i): 0.0,
+                'axis{}.motor.is_calibrated'.format(i): 0,
+                'axis{}.motor.config.pre_calibrated'.format(i): 0,
+                'axis{}.encoder.is_ready'.format(i): 0,
+                'axis{}.encoder.config.pre_calibrated'.format(i): 0,
+                'axis{}.encoder.config.use_index'.format(i): 1,
+                'axis{}.motor.config.calibration_current'.format(i): 10.0,
+                'axis{}.motor.config.current_lim'.format(i): 10.0,
+                'axis{}.controller.config.vel_limit'.format(i): 20000.0,
+                'axis{}.controller.config.vel_limit_tolerance'.format(i): 1.2,
+            })
+            if fw_version_minor >= 5:
+                self.props['axis{}.config.enable_watchdog'.format(i)] = 0
+        self._pos = [0.0] * axis_num
+        self._vel = [0.0] * axis_num
+        self._pos_setpoint = [0.0] * axis_num
+        self._state_end = [0.0] * axis_num
+        self._feed_time = [0.0] * axis_num
+        self.watchdog_trip_count = 0
+        self.save_count = 0
+        # ASCII command -> number of replies to lose on the wire
+        self.drop_replies = {}
+        self._time_z1 = time.time()
+
+        # native protocol endpoints, a subset of the firmware's
+        self._functions = {'save_configuration': self.save_configuration, 'reboot': self.reboot}
+        if fw_version_minor >= 5:
+            self._functions['clear_errors'] = self.clear_errors
+        for i in range(0, axis_num):
+            self._functions['axis{}.watchdog_feed'.format(i)] = lambda i=i: self._feed(i)
+        # 0.5 takes the setpoints as inputs, its setpoints are read only
+        if fw_version_minor >= 5:
+            self._inputs = ('input_pos', 'input_vel', 'input_torque')
+            self._setpoints = ('pos_setpoint', 'vel_setpoint', 'torque_setpoint')
+        else:
+            self._inputs = self._setpoints = ('pos_setpoint', 'vel_setpoint', 'current_setpoint')
+        self._endpoint_names = ['vbus_voltage'] + sorted(self.props) + sorted(self._functions)
+        for i in range(0, axis_num):
+            self._endpoint_names += ['axis{}.encoder.pos_estimate'.format(i), 'axis{}.encoder.vel_estimate'.format(i)]
+            self._endpoint_names += ['axis{}.controller.{}'.format(i, name)
+                                     for name in sorted(set(self._inputs + self._setpoints))]
+        self._json_bytes = self._endpoint_json()
+        self._json_crc = calc_crc16(PROTOCOL_VERSION, self._json_bytes)
+
+        # pty
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+
+    def start(self):
+        self.is_run = True
+        self._th = threading.Thread(target=self._process, daemon=True)
+        self._th.start()
+
+    def close(self):
+        self.is_run = False
+
+    def _update(self):
+        time_now = time.time()
+        dt = time_now - self._time_z1
+        self._time_z1 = time_now
+        for i in range(0, len(self._pos)):
+            if self._state_end[i] and time_now >= self._state_end[i]:
+                # calibration and index search finished
+                self._state_end[i] = 0.0
+                self.props['axis{}.motor.is_calibrated'.format(i)] = 1
+                self.props['axis{}.encoder.is_ready'.format(i)] = 1
+                self.props['axis{}.current_state'.format(i)] = 1
+            # 0.5 arms the watchdog with enable_watchdog, 0.4 with any timeout above 0
+            watchdog_timeout = self.props['axis{}.config.watchdog_timeout'.format(i)]
+            if self.props.get('axis{}.config.enable_watchdog'.format(i), 1) == 0:
+                watchdog_timeout = 0.0
+            if watchdog_timeout > 0 and self.props['axis{}.current_state'.format(i)] == 8 \
+                    and time_now - self._feed_time[i] > watchdog_timeout:
+                self.watchdog_trip_count += 1
+                self.props['axis{}.error'.format(i)] = 0x800
+                self.props['axis{}.current_state'.format(i)] = 1
+            if self.props['axis{}.current_state'.format(i)] != 8:
+                self._vel[i] = 0.0
+                continue
+            vel_limit = self.props['axis{}.controller.config.vel_limit'.format(i)]
+            error = self._pos_setpoint[i] - self._pos[i]
+            step = max(-vel_limit * dt, min(vel_limit * dt, error))
+            self._pos[i] += step
+            self._vel[i] = step / dt if dt > 0 else 0.0
+
+    def _endpoint_type(self, name):
+        if name in self._functions:
+            return 'function'
+        elif isinstance(self.props.get(name), int):
+            return 'int32'
+        return 'float'
+
+    def _endpoint_json(self):
+        root = [{'name': '', 'id': 0, 'type': 'json', 'access': 'r'}]
+        for endpoint_id, name in enumerate(self._endpoint_names, 1):
+            members = root
+            parts = name.split('.')
+            for part in parts[:-1]:
+                for member in members:
+                    if member['name'] == part:
+                        break
+                else:
+                    member = {'name': part, 'type': 'object', 'members': []}
+                    members.append(member)
+                members = member['members']
+            access = 'r' if parts[-1] in self._setpoints and parts[-1] not in self._inputs else 'rw'
+            members.append({'name': parts[-1], 'id': endpoint_id, 'type': self._endpoint_type(name), 'access': access})
+        return json.dumps(root).encode()
+
+    def get(self, name):
+        words = name.split('.')
+        if name == 'vbus_voltage':
+            return 24.0
+        elif name.endswith('encoder.pos_estimate'):
+            return self._pos[int(words[0][4:])]
+        elif name.endswith('encoder.vel_estimate'):
+            return self._vel[int(words[0][4:])]
+        elif words[-1] in ('pos_setpoint', 'input_pos'):
+            return self._pos_setpoint[int(words[0][4:])]
+        elif words[-1] in self._inputs + self._setpoints:
+            return 0.0
+        return self.props[name]
+
+    def set(self, name, value):
+        words = name.split('.')
+        if words[-1] == self._inputs[0]:
+            self._pos_setpoint[int(words[0][4:])] = float(value)
+        elif words[-1] in self._inputs + self._setpoints:
+            # the other inputs are not modelled, writes to read-only setpoints are ignored like on the firmware
+            pass
+        elif name.endswith('.requested_state'):
+            self.props[name] = int(value)
+            self._request_state(int(words[0][4:]), int(value))
+        else:
+            self.props[name] = type(self.props[name])(float(value))
+
+    def _execute_native(self, packet):
+        seq_no, endpoint_id, response_length = struct.unpack('<HHH', packet[0:6])
+        payload, trailer = packet[6:-2], struct.unpack('<H', packet[-2:])[0]
+        expect_response = endpoint_id & 0x8000
+        endpoint_id &= 0x7fff
+        if endpoint_id == 0:
+            if trailer != PROTOCOL_VERSION:
+                return None
+            offset = struct.unpack('<I', payload)[0]
+            data = self._json_bytes[offset:offset + response_length]
+        elif trailer != self._json_crc or endpoint_id > len(self._endpoint_names):
+            return None
+        else:
+            self._update()
+            name = self._endpoint_names[endpoint_id - 1]
+            endpoint_type = self._endpoint_type(name)
+            fmt = '<i' if endpoint_type == 'int32' else '<f'
+            if endpoint_type == 'function':
+                self._functions[name]()
+                data = b''
+            elif payload:
+                self.set(name, struct.unpack(fmt, payload)[0])
+                data = b''
+            else:
+                data = struct.pack(fmt, self.get(name))
+        if not expect_response:
+            return None
+        return encode_frame(struct.pack('<H', seq_no | 0x8000) + data)
+
+    def _request_state(self, i, state):
+        # like the firmware, an axis with an error set stays where it is until the error is cleared
+        if any(self.props['axis{}.{}'.format(i, name)] for name in ('error', 'motor.error', 'encoder.error',
+                                                                   'controller.error')):
+            return
+        if state == 8 and not (self.props['axis{}.motor.is_calibrated'.format(i)]
+                               and self.props['axis{}.encoder.is_ready'.format(i)]):
+            self.props['axis{}.error'.format(i)] = 1
+            state = 1
+        self._state_end[i] = time.time() + self._state_time[state] if state in self._state_time else 0.0
+        self._feed_time[i] = time.time()
+        self.props['axis{}.current_state'.format(i)] = state
+
+    def _feed(self, i):
+        self._feed_time[i] = time.time()
+
+    def clear_errors(self):
+        for i in range(0, len(self._pos)):
+            for name in ('error', 'motor.error', 'encoder.error', 'controller.error'):
+                self.props['axis{}.{}'.format(i, name)] = 0
+
+    def _drop(self, line):
+        words = line.split()
+        if words and self.drop_replies.get(words[0], 0) > 0:
+            self.drop_replies[words[0]] -= 1
+            return True
+        return False
+
+    def save_configuration(self):
+        self.save_count += 1
+
+    def reboot(self):
+        # only pre-calibrated motors come back calibrated
+        for i in range(0, len(self._pos)):
+            self.props['axis{}.motor.is_calibrated'.format(i)] = self.props['axis{}.motor.config.pre_calibrated'.format(i)]
+            self.props['axis{}.encoder.is_ready'.format(i)] = 0
+            self.props['axis{}.current_state'.format(i)] = 1
+            self._state_end[i] = 0.0
+
+    def _execute(self, line):
+        words = line.split()
+        if not words:
+            return None
+        self._update()
+        if words[0] == 'p' and len(words) >= 3:
+            self._pos_setpoint[int(words[1])] = float(words[2])
+            return None
+        elif words[0] == 'f' and len(words) == 2:
+            i = int(words[1])
+            if i >= len(self._pos):
+                return 'invalid motor'
+            return '{} {}'.format(self._pos[i], self._vel[i])
+        elif words[0] == 'r' and len(words) == 2:
+            if words[1] not in self._endpoint_names:
+                return 'invalid property'
+            return str(self.get(words[1]))
+        elif words[0] == 'w' and len(words) == 3:
+            if words[1] not in self._endpoint_names:
+                return 'invalid property'
+            self.set(words[1], words[2])
+            return None
+        elif words[0] == 'u' and len(words) == 2:
+            self._feed(int(words[1]))
+            return None
+        elif words[0] == 'sr':
+            self.reboot()
+            return None
+        elif words[0] == 'sc' and 'clear_errors' in self._functions:
+            self.clear_errors()
+            return None
+        elif words[0] == 'ss':
+            self.save_configuration()
+            return None
+        elif words[0] == 'se':
+            return None
+        return 'unknown command'
+
+    def _process(self):
+        # the delay models link latency, so responses overlap instead of queueing behind each other
+        buf = b''
+        tx_queue = []
+        while self.is_run:
+            wait = max(0.0, tx_queue[0][0] - time.time()) if tx_queue else 0.1
+            readable, _, _ = select.select([self._master], [], [], wait)
+            # held while a read is handled, a caller holding it with nothing left to read sees an idle simulator
+            with self.lock:
+                if readable:
+                    try:
+                        buf += os.read(self._master, 4096)
+                    except OSError:
+                        break
+                while buf:
+                    # the native protocol and ASCII lines share the stream, a frame starts with the sync byte
+                    if buf[0] == SYNC_BYTE:
+                        if len(buf) < 3 or len(buf) < 3 + buf[1] + 2:
+                            break
+                        packets, _ = decode_frames(buf[0:3 + buf[1] + 2])
+                        buf = buf[3 + buf[1] + 2:]
+                        response = self._execute_native(packets[0]) if packets and len(packets[0]) >= 8 else None
+                    elif b'\n' in buf:
+                        line, buf = buf.split(b'\n', 1)
+                        line = line.decode('utf-8', 'replace')
+                        response = self._execute(line)
+                        if response is not None and self._drop(line):
+                            response = None
+                        response = (response + '\r\n').encode() if response is not None else None
+                    else:
+                        break
+                    self.rx_lines += 1
+                    if response is not None:
+                        tx_queue.append((time.time() + self._delay, response))
+                while tx_queue and tx_queue[0][0] <= time.time():
+                    os.write(self._master, tx_queue.pop(0)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ODrive ASCII protocol simulator on a pty')
+    parser.add_argument('--delay', type=float, default=0.0, help='response link latency [s]')
+    parser.add_argument('--calibration-time', type=float, default=4.0, help='full calibration sequence [s]')
+    args = parser.parse_args()
+
+    sim = OdriveSim(delay=args.delay, calibration_time=args.calibration_time)
+    sim.start()
+    print('ODrive simulator on {}'.format(sim.port))
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    sim.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import collections
+import csv
+import fcntl
+import logging
+import os
+import struct
+import termios
+import time
+import tty
+import yaml
+from device.clock import RealClock, SteppedClock
+from device.clock_loop import ClockEventLoop
+from device.flight_recorder import load
+from device.gamepad_mp import GamePadMp
+from device.latency_trace import LatencyTrace
+from device.odrive_mp import ENCODER_CPR, OdriveMp
+from device.serial_mp import SerilaMp
+from device.state_bus import StateBus, SECTION_FIELDS
+from inputs.inputs import DeviceManager
+from main import build_control, control_loop
+from tools.gamepad_sim import GamePadSim
+from tools.odrive_sim import OdriveSim
+
+ReplayEvent = collections.namedtuple('ReplayEvent', ['ev_type', 'code', 'state', 'timestamp'])
+
+
+def fionread(fd):
+    return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+
+class ReplayGamePad(GamePadMp):
+    # GamePadMp on the event loop, on a simulator pad that never sends anything, fed from the recorded input section
+    def __init__(self, logger, bus, loop, clock, chords=None, long_press=1.0, trace=None):
+        self._sim = GamePadSim(transport='socket')
+        devices = DeviceManager(kinds=())
+        self._sim.plug(devices)
+        super().__init__(logger, bus, chords, long_press, loop=loop, clock=clock, trace=trace, devices=devices)
+        self._codes = devices.codes
+        self._trace_index = SECTION_FIELDS['input'].index('gp_trace')
+        self._record_trace_z1 = None
+
+    def close(self):
+        super().close()
+        self._sim.close()
+
+    def feed(self, values):
+        # a button resync after dropped events writes the section again without a new event
+        if values[self._trace_index] == self._record_trace_z1:
+            return
+        self._record_trace_z1 = values[self._trace_index]
+        ev_type = self._codes['types'][int(values[0])]
+        code = self._codes[ev_type][int(values[1])]
+        self._handle([ReplayEvent(ev_type, code, int(values[2]), self._clock.time())])
+        self._schedule_expire()
+
+
+def tap_writes(ser, clock, port, output, commands=None):
+    # lines are logged as the worker writes them, the pty hands them over a little later
+    write = ser.write
+
+    def write_tapped(data):
+        for line in data.decode('utf-8', 'replace').split('\n'):
+            line = line.strip()
+            if line and (commands is None or line.split()[0] in commands):
+                output.append((clock.time(), port, line))
+        return write(data)
+    ser.write = write_tapped
+
+
+class NucleoStandIn():
+    # the Nucleo end of a pty: recorded telemetry goes in, the worker's commands are drained
+    def __init__(self, loop):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        os.set_blocking(self._master, False)
+        loop.add_reader(self._master, self._on_readable)
+
+    def feed(self, values):
+        fb = dict(zip(SECTION_FIELDS['nucleo'], values))
+        line = '#,{:d},{},{},{:d},{:d},{:d},0,0,0,0,0\n'.format(
+            int(fb['rx_stw_mode']), fb['rx_actual_angle_lpf'], fb['rx_target_angle_lpf'],
+            int(fb['rx_selector_switch']), int(fb['rx_actual_encoder_pos']), int(fb['rx_potentio_a_raw'])).encode()
+        # wait until the line is readable on the worker's side, so the clock cannot pass it
+        pending = fionread(self._slave) + len(line)
+        os.write(self._master, line)
+        time_end = time.time() + 0.1
+        while fionread(self._slave) < pending and time.time() < time_end:
+            pass
+
+    def _on_readable(self):
+        try:
+            os.read(self._master, 4096)
+        except BlockingIOError:
+            pass
+
+
+class OdriveStandIn(OdriveSim):
+    # the simulator's protocol, with positions and states from the recording instead of its model
+    def feed(self, values):
+        fb = dict(zip(SECTION_FIELDS['odrive'], values))
+        # the bus keeps encoder counts, the simulator answers in the units of its firmware version
+        scale = 1.0 / ENCODER_CPR if self.props['fw_version_minor'] >= 5 else 1.0
+        for i in range(0, 2):
+            self._pos[i] = fb['fb_pos_{}'.format(i)] * scale
+            self._vel[i] = fb['fb_vel_{}'.format(i)] * scale
+            self.props['axis{}.current_state'.format(i)] = int(fb['fb_state_{}'.format(i)])
+
+    def _update(self):
+        pass
+
+    def wait_idle(self):
+        # every line the worker wrote has been handled and answered
+        time_end = time.time() + 0.1
+        while time.time() < time_end:
+            with self.lock:
+                if fionread(self._master) == 0:
+                    return
+
+
+class CommandLog():
+    # stands in for a flight recorder section, every published command set with the replay time
+    def __init__(self, clock):
+        self._clock = clock
+        self.records = []
+        self.sections = {'command': self}
+
+    def append(self, values):
+        self.records.append((self._clock.time(), list(values)))
+
+
+def replay(path, cfg, fast, logger, trace=None):
+    header, records = load(path)
+    records = [record for record in records if record[1] != 'command']
+    recorded_commands = sum(1 for record in load(path)[1] if record[1] == 'command')
+    if fast:
+        clock = SteppedClock(records[0][0])
+        loop = ClockEventLoop(clock)
+    else:
+        clock = RealClock()
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    command_log = CommandLog(clock)
+    serial_output = []
+    bus = StateBus(command_log)
+    odrive_sim = OdriveStandIn()
+    odrive_sim.start()
+    nucleo = NucleoStandIn(loop)
+    gamepad = ReplayGamePad(logger, bus, loop, clock, chords=cfg['gamepad_chords'], long_press=cfg['gamepad_long_press'],
+                            trace=trace)
+    # the main loop watchdog is left out, a replay never stalls
+    odrive_mp = OdriveMp(
+        logger, bus, port=odrive_sim.port,
+        speed_lim=cfg['odrive_speed_lim'], current_lim=cfg['odrive_current_lim'],
+        calibration_current=cfg['odrive_calibration_current'],
+        feedback_rate=cfg['odrive_feedback_rate'], feedback_depth=cfg['odrive_feedback_depth'],
+        protocol='ascii', endpoint_cache='/tmp/odrive_endpoints_replay.json', loop=loop, clock=clock,
+        trace=trace)
+    serial_mp = SerilaMp(
+        logger, bus, port=nucleo.port, keepalive_interval=cfg['nucleo_keepalive_interval'], loop=loop, clock=clock,
+        trace=trace)
+    # feedback requests are left out of the ODrive stream
+    tap_writes(odrive_mp._ser, clock, 'odrive', serial_output, commands=('p', 'w', 'ss'))
+    tap_writes(serial_mp._ser, clock, 'nucleo', serial_output)
+    control = build_control(cfg, bus, gamepad.events, clock=clock, trace=trace)
+    feeders = {'input': gamepad.feed, 'nucleo': nucleo.feed, 'odrive': odrive_sim.feed}
+    state = {'is_run': True}
+
+    async def feed_records():
+        time_offset = loop.time() - records[0][0]
+        for time_mono, name, values in records:
+            time_record = time_mono + time_offset
+            if fast:
+                # jump from timer to timer until the record is due
+                while True:
+                    await loop.settle()
+                    odrive_sim.wait_idle()
+                    await loop.settle()
+                    time_timer = loop.next_timer()
+                    if time_timer is None or time_timer >= time_record:
+                        clock.advance_to(time_record)
+                        break
+                    clock.advance_to(time_timer)
+                await loop.settle()
+            else:
+                await asyncio.sleep(time_record - loop.time())
+            feeders[name](values)
+        state['is_run'] = False
+        if fast:
+            # nothing else moves the virtual clock, the main loop would wait for its period forever
+            clock.step(cfg['main_loop_period'])
+
+    time_start = time.time()
+    loop.run_until_complete(asyncio.gather(
+        feed_records(),
+        control_loop(loop, control, lambda: state['is_run'],
+                     [gamepad.notifier, serial_mp.notifier], cfg['main_loop_period'])))
+    time_real = time.time() - time_start
+    odrive_mp.close()
+    serial_mp.close()
+    gamepad.close()
+    odrive_sim.close()
+    return {
+        'time_replay': records[-1][0] - records[0][0], 'time_real': time_real,
+        'records': len(records), 'recorded_commands': recorded_commands,
+        'commands': command_log.records, 'serial': serial_output, 'time_start': records[0][0] if fast else time_start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a flight recorder file through the control logic and the device workers')
+    parser.add_argument('path')
+    parser.add_argument('--fast', action='store_true', help='as fast as possible on a virtual clock instead of 1x')
+    parser.add_argument('--output', help='write <output>_commands.csv and <output>_serial.csv')
+    parser.add_argument('--config', default='config.yml')
+    parser.add_argument('--trace', help='latency trace file, in replay time')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)
+    logger = logging.getLogger('replay')
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler())
+
+    trace = LatencyTrace(args.trace) if args.trace else None
+    result = replay(args.path, cfg, args.fast, logger, trace)
+    if trace is not None:
+        trace.close()
+    print('{:.1f} s replayed in {:.2f} s ({:.1f}x), {} records, {} command sets ({} recorded), {} serial lines'.format(
+        result['time_replay'], result['time_real'], result['time_replay'] / result['time_real'], result['records'],
+        len(result['commands']), result['recorded_commands'], len(result['serial'])))
+
+    if args.output:
+        with open(args.output + '_commands.csv', 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time'] + SECTION_FIELDS['command'])
+            for time_command, values in result['commands']:
+                writer.writerow(['{:.6f}'.format(time_command - result['time_start'])] + values)
+        with open(args.output + '_serial.csv', 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'port', 'line'])
+            for time_line, port, line in result['serial']:
+                writer.writerow(['{:.6f}'.format(time_line - result['time_start']), port, line])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import selectors
+import subprocess
+import sys
+import threading
+import time
+import tty
+from device.odrive_mp import OdriveMp
+from device.serial_mp import SerilaMp, Action_t
+from device.state_bus import StateBus
+from tools.odrive_sim import OdriveSim
+
+
+class NucleoSim():
+    # telemetry lines at a fixed rate, rx_target_angle_lpf carries the send time for the latency
+    def __init__(self, rate=100.0):
+        self._period = 1.0 / rate
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.is_run = False
+
+    def start(self):
+        self.is_run = True
+        threading.Thread(target=self._process, daemon=True).start()
+
+    def close(self):
+        self.is_run = False
+
+    def _process(self):
+        time_next = time.time()
+        while self.is_run:
+            os.write(self._master, '#,1,0.0,{:.6f},0,0,0,0,0,0,0,0\n'.format(time.time() % 1000.0).encode())
+            try:
+                # drop the commands
+                os.set_blocking(self._master, False)
+                os.read(self._master, 4096)
+            except BlockingIOError:
+                pass
+            time_next += self._period
+            time.sleep(max(0.0, time_next - time.time()))
+
+
+def cpu_time(pid):
+    with open('/proc/{}/stat'.format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def memory(pid):
+    # PSS splits the pages the forked workers share with main, RSS counts them in every process
+    rss = pss = 0
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    except IOError:
+        pss = rss
+    return rss, pss
+
+
+def run(runtime, odrive_port, nucleo_port, duration, period):
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    loop = asyncio.get_event_loop() if runtime == 'asyncio' else None
+    bus = StateBus()
+    odrive_mp = OdriveMp(logger, bus, port=odrive_port, loop=loop, endpoint_cache='/tmp/odrive_endpoints_bench.json')
+    serial_mp = SerilaMp(logger, bus, port=nucleo_port, loop=loop)
+    command = bus.command.read()
+    latency = []
+    state = {'rx_time': 0.0, 'command_time': 0.0, 'count': 0}
+
+    def control_step():
+        # the main loop's work: read telemetry, publish a command set every main loop period
+        time_now = time.time()
+        rx = bus.nucleo.read()
+        if rx.rx_time and rx.rx_time != state['rx_time']:
+            state['rx_time'] = rx.rx_time
+            latency.append((time_now % 1000.0 - rx.rx_target_angle_lpf) % 1000.0)
+        if time_now < state['command_time']:
+            return
+        state['command_time'] = time_now + period
+        state['count'] += 1
+        command.nucleo_mode = command.odrive_mode = Action_t.ACTION_VELOCITY_CTRL.value
+        command.nucleo_target_angle = command.odrive_target_angle_0 = command.odrive_target_angle_1 = state['count'] % 90
+        command.nucleo_seq += 1
+        command.odrive_seq += 1
+        bus.command.publish(command)
+
+    def pids():
+        return [os.getpid()] + [p.pid for p in multiprocessing.active_children()]
+
+    async def control_loop(time_end):
+        wake = asyncio.Event()
+
+        def wake_up():
+            serial_mp.notifier.clear()
+            wake.set()
+
+        loop.add_reader(serial_mp.notifier.fileno(), wake_up)
+        while time.time() < time_end:
+            control_step()
+            try:
+                await asyncio.wait_for(wake.wait(), period)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    def measure(time_end):
+        if loop is None:
+            selector = selectors.DefaultSelector()
+            selector.register(serial_mp.notifier, selectors.EVENT_READ)
+            while time.time() < time_end:
+                control_step()
+                for key, _ in selector.select(period):
+                    key.fileobj.clear()
+        else:
+            loop.run_until_complete(control_loop(time_end))
+
+    # warm up, then measure the steady state only
+    measure(time.time() + 1.0)
+    del latency[:]
+    cpu_start = {pid: cpu_time(pid) for pid in pids()}
+    time_start = time.time()
+    measure(time_start + duration)
+    elapsed = time.time() - time_start
+    cpu = sum(cpu_time(pid) - cpu_start.get(pid, 0.0) for pid in pids())
+    rss = pss = 0
+    for pid in pids():
+        rss_pid, pss_pid = memory(pid)
+        rss += rss_pid
+        pss += pss_pid
+    processes = len(pids())
+    odrive_mp.close()
+    serial_mp.close()
+
+    latency.sort()
+    n = len(latency)
+    print(json.dumps({
+        'processes': processes, 'rss_kb': rss, 'pss_kb': pss, 'cpu': cpu / elapsed, 'samples': n,
+        'p50': latency[n // 2] if n else 0.0, 'p99': latency[min(n - 1, n * 99 // 100)] if n else 0.0}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory, CPU and telemetry latency, worker processes against the asyncio runtime')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per runtime')
+    parser.add_argument('--period', type=float, default=0.05, help='main loop period [s]')
+    parser.add_argument('--rate', type=float, default=50.0, help='Nucleo telemetry rate [Hz]')
+    parser.add_argument('--runtime', nargs='+', default=['mp', 'asyncio'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--odrive-port', help=argparse.SUPPRESS)
+    parser.add_argument('--nucleo-port', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.child, args.odrive_port, args.nucleo_port, args.duration, args.period)
+        return
+
+    # the simulators stay in this process, each runtime is measured in a fresh interpreter
+    for runtime in args.runtime:
+        odrive_sim = OdriveSim()
+        odrive_sim.start()
+        nucleo_sim = NucleoSim(args.rate)
+        nucleo_sim.start()
+        output = subprocess.check_output([
+            sys.executable, '-m', 'tools.runtime_bench', '--child', runtime,
+            '--odrive-port', odrive_sim.port, '--nucleo-port', nucleo_sim.port,
+            '--duration', str(args.duration), '--period', str(args.period)])
+        odrive_sim.close()
+        nucleo_sim.close()
+        r = json.loads(output.decode().strip().splitlines()[-1])
+        print('{:7s}: {} processes  RSS {:6.1f} MB  PSS {:6.1f} MB  CPU {:5.1f} %  telemetry p50 {:6.3f} ms  p99 {:6.3f} ms'.format(
+            runtime, r['processes'], r['rss_kb'] / 1024.0, r['pss_kb'] / 1024.0, r['cpu'] * 100.0,
+            r['p50'] * 1000.0, r['p99'] * 1000.0))
+
+
+if __name__ == '__main__':
+    main()
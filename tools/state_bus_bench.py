@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import ctypes
+import time
+from device.state_bus import StateBus
+from multiprocessing import Process, Value
+
+FIELDS = ('gp_code', 'gp_value', 'rx_stw_mode', 'rx_actual_angle_lpf', 'rx_target_angle_lpf',
+          'fb_pos_0', 'fb_pos_1', 'fb_state_0')
+
+
+def value_writer(values, is_run, period):
+    # the device processes updating their Values, 0 for as fast as they can
+    n = 0
+    while is_run.value:
+        n += 1
+        for value in values:
+            value.value = n
+        time.sleep(period)
+
+
+def bus_writer(bus, is_run, period):
+    n = 0
+    while is_run.value:
+        n += 1
+        bus.input.write(gp_code=n, gp_value=n)
+        bus.nucleo.write(rx_stw_mode=n, rx_actual_angle_lpf=n, rx_target_angle_lpf=n)
+        bus.odrive.write(fb_pos_0=n, fb_pos_1=n, fb_state_0=n)
+        time.sleep(period)
+
+
+def read_values(values, duration):
+    # what the main loop did per cycle: one lock round trip per field
+    count = 0
+    time_end = time.time() + duration
+    while time.time() < time_end:
+        for _ in range(0, 100):
+            [value.value for value in values]
+        count += 100
+    return count / duration
+
+
+def read_bus(bus, duration):
+    count = 0
+    time_end = time.time() + duration
+    while time.time() < time_end:
+        for _ in range(0, 100):
+            bus.input.read()
+            bus.nucleo.read()
+            bus.odrive.read()
+        count += 100
+    return count / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Main loop state reads per second, multiprocessing.Value against the state bus')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per case')
+    parser.add_argument('--writer-period', type=float, default=0.001, help='writer update period [s]')
+    args = parser.parse_args()
+
+    for contended in (False, True):
+        values = [Value(ctypes.c_double, 0.0) for _ in FIELDS]
+        bus = StateBus()
+        results = []
+        for name, writer, reader, shared in (('Value', value_writer, read_values, values),
+                                             ('bus', bus_writer, read_bus, bus)):
+            is_run = Value(ctypes.c_bool, True)
+            if contended:
+                p = Process(target=writer, args=(shared, is_run, args.writer_period))
+                p.start()
+            results.append((name, reader(shared, args.duration)))
+            is_run.value = False
+            if contended:
+                p.join()
+        for name, rate in results:
+            print('{:5s} {:13s}: {:9.0f} snapshots/s ({} fields)'.format(
+                name, 'with writer' if contended else 'idle', rate, len(FIELDS)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+from device.timeline import dump_chrome_trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a timeline file as Chrome trace JSON, for chrome://tracing or ui.perfetto.dev')
+    parser.add_argument('path')
+    parser.add_argument('output', nargs='?')
+    args = parser.parse_args()
+
+    output = args.output or args.path.replace('.bin', '.json')
+    dump_chrome_trace(args.path, output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()